@@ -0,0 +1,322 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+"""
+On-disk cache of the results of the inspiral coincidence engine.
+
+Re-running ligolw_thinca or ligolw_sstinca on a document whose triggers,
+time slides, vetoes and coincidence thresholds are identical to those of
+a previous run produces identical coincidences.  The CoincCache class
+defined here allows the coinc_event, coinc_event_map and coinc_inspiral
+rows produced by a run to be stored on disk, keyed by a hash of the
+inputs, so that a matching re-run can insert the stored rows and skip
+the coincidence analysis entirely.
+"""
+
+
+import cPickle
+import hashlib
+import os
+import sys
+import tempfile
+import zlib
+
+
+from glue.ligolw import ilwd
+from glue.ligolw import lsctables
+from glue.ligolw import types as ligolwtypes
+from pylal import git_version
+
+
+__version__ = "git id %s" % git_version.id
+__date__ = git_version.date
+
+
+#
+# =============================================================================
+#
+#                                 Input Hashing
+#
+# =============================================================================
+#
+
+
+def _func_name(func):
+	"""
+	Return a string identifying a function for the purpose of
+	computing a cache key.  Default argument values are included so
+	that closures specialized with default arguments (e.g., the
+	end-time restricted ntuple comparison functions) are told apart.
+	"""
+	if func is None:
+		return "None"
+	return "%s.%s%s" % (getattr(func, "__module__", None), getattr(func, "__name__", repr(func)), repr(getattr(func, "func_defaults", None)))
+
+
+def _hash_table(h, tbl):
+	"""
+	Update the hash object h with the contents of the table tbl.  The
+	hash is independent of the order of the columns in the document,
+	but not of the order of the rows.  ID columns are hashed by their
+	string form, as the repr() of an ilwdchar need not be.
+	"""
+	columns = sorted((colname, coltype in ligolwtypes.IDTypes) for colname, coltype in zip(tbl.columnnames, tbl.columntypes))
+	h.update(repr([colname for colname, isid in columns]))
+	for row in tbl:
+		h.update(repr(tuple((unicode(getattr(row, colname)) if getattr(row, colname) is not None else None) if isid else getattr(row, colname) for colname, isid in columns)))
+
+
+def coinc_cache_key(xmldoc, thresholds, seglists = None, veto_segments = None, event_comparefunc = None, ntuple_comparefunc = None, **kwargs):
+	"""
+	Compute the cache key identifying a coincidence analysis.  The key
+	is the hex digest of a hash of the sngl_inspiral and time_slide
+	tables in xmldoc, the thresholds, the instrument segment lists
+	(seglists), the veto segments and the names of the comparison
+	functions.  Additional keyword arguments are included in the hash
+	by their repr(), and any other parameter that affects the outcome
+	(e.g., the effective SNR factor) must be passed this way.
+	"""
+	h = hashlib.sha1()
+	h.update(__version__)
+	_hash_table(h, lsctables.SnglInspiralTable.get_table(xmldoc))
+	_hash_table(h, lsctables.TimeSlideTable.get_table(xmldoc))
+	h.update(repr(thresholds))
+	for segs in (seglists, veto_segments):
+		if segs is None:
+			h.update("None")
+		else:
+			h.update(repr(sorted((instrument, tuple(seglist)) for instrument, seglist in segs.items())))
+	h.update(_func_name(event_comparefunc))
+	h.update(_func_name(ntuple_comparefunc))
+	for name, value in sorted(kwargs.items()):
+		h.update("%s=%s" % (name, _func_name(value) if callable(value) else repr(value)))
+	return h.hexdigest()
+
+
+#
+# =============================================================================
+#
+#                             Result Serialization
+#
+# =============================================================================
+#
+
+
+#
+# columns that are not stored because they are re-assigned when the rows
+# are inserted into a new document
+#
+
+
+_rewritten_columns = frozenset(("process_id", "coinc_def_id", "coinc_event_id"))
+
+
+def _pack_rows(tbl, rows, coinc_index):
+	"""
+	Convert the rows to a compact, picklable form.  Returns a tuple
+	of (columnnames, coinc index list, columns), where the coinc index
+	list gives, for each row, the position in the stored coinc_event
+	rows of the coinc to which the row belongs, and columns is a list
+	of tuples of column values.  ID columns are stored as strings.
+	"""
+	columns = [(unicode(colname), coltype in ligolwtypes.IDTypes) for colname, coltype in zip(tbl.columnnames, tbl.columntypes) if colname not in _rewritten_columns]
+	return (
+		tuple(colname for colname, isid in columns),
+		tuple(coinc_index[row.coinc_event_id] for row in rows),
+		[tuple((unicode(getattr(row, colname)) if getattr(row, colname) is not None else None) if isid else getattr(row, colname) for row in rows) for colname, isid in columns]
+	)
+
+
+def _unpack_rows(tbl, packed, process_id, coinc_def_id, coinc_event_ids):
+	"""
+	Inverse of _pack_rows().  Generates rows of tbl's row type.
+	"""
+	columnnames, coinc_indexes, columns = packed
+	idcolumns = set(colname for colname, coltype in zip(tbl.columnnames, tbl.columntypes) if coltype in ligolwtypes.IDTypes)
+	columns = [(colname, [ilwd.ilwdchar(value) if value is not None else None for value in values] if colname in idcolumns else values) for colname, values in zip(columnnames, columns)]
+	for i, coinc_index in enumerate(coinc_indexes):
+		row = tbl.RowType()
+		for colname, values in columns:
+			setattr(row, colname, values[i])
+		if "process_id" in tbl.columnnames:
+			row.process_id = process_id
+		if "coinc_def_id" in tbl.columnnames:
+			row.coinc_def_id = coinc_def_id
+		row.coinc_event_id = coinc_event_ids[coinc_index]
+		yield row
+
+
+def extract_coincs(xmldoc, process_id, coinc_def_id):
+	"""
+	Extract the coinc_event, coinc_event_map and coinc_inspiral rows
+	created by the process process_id with the coinc type
+	coinc_def_id, and return them in a compact, picklable form
+	suitable for re-insertion into a document with insert_coincs().
+	"""
+	coinc_table = lsctables.CoincTable.get_table(xmldoc)
+	coinc_map_table = lsctables.CoincMapTable.get_table(xmldoc)
+	coinc_inspiral_table = lsctables.CoincInspiralTable.get_table(xmldoc)
+
+	coincs = [row for row in coinc_table if row.process_id == process_id and row.coinc_def_id == coinc_def_id]
+	coinc_index = dict((row.coinc_event_id, i) for i, row in enumerate(coincs))
+
+	return {
+		"coinc_event": _pack_rows(coinc_table, coincs, coinc_index),
+		"coinc_event_map": _pack_rows(coinc_map_table, [row for row in coinc_map_table if row.coinc_event_id in coinc_index], coinc_index),
+		"coinc_inspiral": _pack_rows(coinc_inspiral_table, [row for row in coinc_inspiral_table if row.coinc_event_id in coinc_index], coinc_index)
+	}
+
+
+def insert_coincs(coinc_tables, process_id, coinc_def_id, coincs):
+	"""
+	Insert the coincs previously extracted with extract_coincs() into
+	the document through the InspiralCoincTables instance
+	coinc_tables.  New coinc_event IDs are assigned, and the rows are
+	assigned to the process process_id and the coinc type
+	coinc_def_id.  Returns the number of coincs inserted.
+	"""
+	n = len(coincs["coinc_event"][1])
+	coinc_event_ids = [coinc_tables.coinctable.get_next_id() for i in xrange(n)]
+	for tbl, name in ((coinc_tables.coinctable, "coinc_event"), (coinc_tables.coincmaptable, "coinc_event_map"), (coinc_tables.coinc_inspiral_table, "coinc_inspiral")):
+		tbl.extend(_unpack_rows(tbl, coincs[name], process_id, coinc_def_id, coinc_event_ids))
+	return n
+
+
+#
+# =============================================================================
+#
+#                                  The Cache
+#
+# =============================================================================
+#
+
+
+class CoincCache(object):
+	"""
+	A size-bounded, least-recently-used, on-disk cache of coincidence
+	analysis results.  Each entry is stored as a zlib-compressed
+	pickle in its own file in the cache directory, named by the cache
+	key.  The modification time of an entry's file is updated
+	whenever the entry is retrieved, and when the total size of the
+	cache exceeds max_size bytes the least-recently-used entries are
+	removed.
+
+	Example:
+
+	>>> cache = CoincCache("/tmp/coinc_cache", max_size = 2**30)
+	>>> key = coinc_cache_key(xmldoc, thresholds)
+	>>> coincs = cache.get(key)
+	>>> if coincs is None:
+	...	# run coincidence, then
+	...	cache.put(key, extract_coincs(xmldoc, process_id, coinc_def_id))
+	"""
+	suffix = ".coincs"
+
+	def __init__(self, directory, max_size = 2**30, verbose = False):
+		if max_size < 0:
+			raise ValueError(max_size)
+		self.directory = directory
+		self.max_size = max_size
+		self.verbose = verbose
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def filename(self, key):
+		return os.path.join(self.directory, key + self.suffix)
+
+	def __contains__(self, key):
+		return os.path.exists(self.filename(key))
+
+	def get(self, key):
+		"""
+		Return the cached results for key, or None if there are
+		none.
+		"""
+		filename = self.filename(key)
+		try:
+			f = open(filename, "rb")
+		except IOError:
+			if self.verbose:
+				print >>sys.stderr, "coinc cache miss for %s" % key
+			return None
+		try:
+			coincs = cPickle.loads(zlib.decompress(f.read()))
+		except (zlib.error, cPickle.UnpicklingError, EOFError, ValueError):
+			# corrupt entry.  remove it and treat as a miss
+			f.close()
+			os.remove(filename)
+			if self.verbose:
+				print >>sys.stderr, "coinc cache entry for %s is corrupt, removed" % key
+			return None
+		f.close()
+		# mark as recently used
+		os.utime(filename, None)
+		if self.verbose:
+			print >>sys.stderr, "coinc cache hit for %s" % key
+		return coincs
+
+	def put(self, key, coincs):
+		"""
+		Store the results coincs under key, then evict old entries
+		if needed.
+		"""
+		fd, tmpname = tempfile.mkstemp(suffix = ".tmp", dir = self.directory)
+		f = os.fdopen(fd, "wb")
+		try:
+			f.write(zlib.compress(cPickle.dumps(coincs, cPickle.HIGHEST_PROTOCOL)))
+		finally:
+			f.close()
+		# atomic so that concurrent jobs sharing a cache never see
+		# a partially-written entry
+		os.rename(tmpname, self.filename(key))
+		self.evict()
+
+	def evict(self):
+		"""
+		Remove least-recently-used entries until the total size of
+		the cache is no greater than max_size.
+		"""
+		entries = []
+		for name in os.listdir(self.directory):
+			if not name.endswith(self.suffix):
+				continue
+			path = os.path.join(self.directory, name)
+			try:
+				st = os.stat(path)
+			except OSError:
+				# removed by another process
+				continue
+			entries.append((st.st_mtime, st.st_size, path))
+		entries.sort()
+		size = sum(size for mtime, size, path in entries)
+		for mtime, entry_size, path in entries:
+			if size <= self.max_size:
+				break
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			size -= entry_size
+			if self.verbose:
+				print >>sys.stderr, "coinc cache evicted %s" % os.path.basename(path)
@@ -30,10 +30,10 @@ import sys
 from glue import iterutils
 from glue import segments
 from glue.ligolw import lsctables
-from glue.ligolw import dbtables
 from glue.ligolw.utils import search_summary as ligolw_search_summary
 from glue.ligolw.utils import segments as ligolw_segments
 from pylal import SnglInspiralUtils
+from pylal import ligolw_sqlutils as sqlutils
 
 
 #
@@ -59,9 +59,8 @@ def get_thinca_rings_by_available_instruments(connection, program_name = "thinca
   """
   # extract raw rings indexed by available instrument set
 
-  xmldoc = dbtables.get_xml(connection)
   seglists = segments.segmentlistdict()
-  for row in map(dbtables.table.get_table(xmldoc, lsctables.SearchSummaryTable.tableName).row_from_cols, connection.cursor().execute("""
+  for row in map(sqlutils.DBTableAccessor(connection).row_from_cols(lsctables.SearchSummaryTable.tableName), connection.cursor().execute("""
 SELECT
   search_summary.*
 FROM
@@ -77,7 +76,6 @@ WHERE
       seglists[available_instruments].append(row.get_out())
     except KeyError:
       seglists[available_instruments] = [row.get_out()]
-  xmldoc.unlink()
 
   # remove rings that are exact duplicates on the assumption that there are
   # zero-lag and time-slide thinca jobs represented in the same document
@@ -105,7 +103,7 @@ def get_thinca_zero_lag_segments(connection, program_name = "thinca"):
   """
   # extract the raw rings indexed by instrument
 
-  xmldoc = dbtables.get_xml(connection)
+  xmldoc = sqlutils.DBTableAccessor(connection).get_xml([lsctables.ProcessTable.tableName, lsctables.SearchSummaryTable.tableName])
   seglists = ligolw_search_summary.segmentlistdict_fromsearchsummary(xmldoc, program_name)
   xmldoc.unlink()
 
@@ -133,7 +131,7 @@ def get_veto_segments(connection, name):
   segments of the given name extracted from the database at the given
   connection.
   """
-  xmldoc = dbtables.get_xml(connection)
+  xmldoc = sqlutils.DBTableAccessor(connection).get_xml(sqlutils.segment_table_names)
   seglists = ligolw_segments.segmenttable_get_by_name(xmldoc, name).coalesce()
   xmldoc.unlink()
   return seglists
@@ -145,9 +143,7 @@ def get_background_offset_vectors(connection):
   at the given connection.  Each offset vector is returned as a dictionary
   mapping instrument name to offset.
   """
-  xmldoc = dbtables.get_xml(connection)
-  offset_vectors = [offsetvector for offsetvector in dbtables.table.get_table(xmldoc, lsctables.TimeSlideTable.tableName).as_dict().values() if any(offsetvector.values())]
-  xmldoc.unlink()
+  offset_vectors = [offsetvector for offsetvector in sqlutils.DBTableAccessor(connection).get_table(lsctables.TimeSlideTable.tableName).as_dict().values() if any(offsetvector.values())]
   return offset_vectors
 
 
@@ -15,12 +15,13 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import sys
+import multiprocessing
 from glue.ligolw import lsctables
 from glue.ligolw import dbtables
 from glue import segments
 from glue import segmentsUtils
-from glue.ligolw import table
 from pylal import rate
+from pylal import ligolw_sqlutils as sqlutils
 import numpy
 import math
 import copy
@@ -29,12 +30,6 @@ from glue.ligolw.utils import segments as ligolw_segments
 from glue.ligolw.utils import process
 from lalsimulation import SimInspiralTaylorF2ReducedSpinComputeChi, SimIMRPhenomBComputeChi
 
-try:
-	import sqlite3
-except ImportError:
-	# pre 2.5.x
-	from pysqlite2 import dbapi2 as sqlite3
-
 
 def allowed_analysis_table_names():
 	return (dbtables.lsctables.MultiBurstTable.tableName, dbtables.lsctables.CoincInspiralTable.tableName, dbtables.lsctables.CoincRingdownTable.tableName)
@@ -45,7 +40,7 @@ def make_sim_inspiral_row_from_columns_in_db(connection):
 	get the unique mapping of a sim inspiral row from columns in this
 	database
 	"""
-	return lsctables.table.get_table(dbtables.get_xml(connection), lsctables.SimInspiralTable.tableName).row_from_cols
+	return sqlutils.DBTableAccessor(connection).row_from_cols(lsctables.SimInspiralTable.tableName)
 
 
 def time_within_segments(geocent_end_time, geocent_end_time_ns, zero_lag_segments = None):
@@ -260,11 +255,15 @@ def compute_search_efficiency_in_bins(found, total, ndbins, sim_to_bins_function
 
 	input = rate.BinnedRatios(ndbins)
 
-	# increment the numerator with the missed injections
-	[input.incnumerator(sim_to_bins_function(sim)) for sim in found]
-
-	# increment the denominator with the total injections
-	[input.incdenominator(sim_to_bins_function(sim)) for sim in total]
+	# increment the numerator with the found injections, and the
+	# denominator with the total injections.  the co-ordinates are
+	# collected into one array per dimension and binned in one pass
+	for sims, fill in ((found, input.fillnumerator), (total, input.filldenominator)):
+		coords = [sim_to_bins_function(sim) for sim in sims]
+		if not coords:
+			continue
+		if fill(tuple(numpy.array(c) for c in zip(*coords))):
+			raise IndexError("injection(s) outside of the binning")
 
 	# regularize by setting denoms to 1 to avoid nans
 	input.regularize()
@@ -470,12 +469,123 @@ def symmetrize_sims(sims, col1, col2):
 			setattr(sim, col2, c1)
 	return sims
 
+def _copy_table(dbtable):
+	"""
+	Return an in-memory copy of the DBTable dbtable, which remains
+	usable after the connection dbtable reads from is closed.
+	"""
+	tbl = lsctables.New(lsctables.TableByName[dbtable.tableName], dbtable.columnnames)
+	tbl.extend(dbtable)
+	return tbl
+
+
+def _summarize_database(f, live_time_program = None, veto_segments_name = None, data_segments_name = "datasegments", tmp_path = None, verbose = False, keep_tables = True):
+	"""
+	Gather the summary information DataBaseSummary needs from the
+	database f.  Returns a dictionary of the partial summary.  The
+	analysis tables found in the database are copied into memory,
+	because the connection is closed before returning;  if keep_tables
+	is False they are not included, so that the result can be pickled.
+	"""
+	if verbose:
+		print >> sys.stderr, "Gathering stats from: %s...." % (f,)
+	working_filename = dbtables.get_connection_filename(f, tmp_path = tmp_path, verbose = verbose)
+	connection = sqlutils.get_connection(working_filename, scratch = working_filename != f)
+	try:
+		tables = sqlutils.DBTableAccessor(connection)
+		# only the tables get_segments() reads
+		xmldoc = tables.get_xml([lsctables.ProcessTable.tableName, lsctables.SearchSummaryTable.tableName] + sqlutils.segment_table_names)
+
+		summary = {
+			"sim": False,
+			"table_name": None,
+			"tables": {},
+			"numslides": None,
+			"instruments": set(),
+			"segments": None,
+			"zerolag_fars_by_instrument_set": {},
+			"ts_fars_by_instrument_set": {},
+			"injection_segments": None,
+			"injection_instruments": [],
+			"found_injections_by_instrument_set": {},
+			"missed_injections_by_instrument_set": {},
+			"total_injections_by_instrument_set": {}
+		}
+
+		# look for a sim inspiral table.  This is IMR work we have to have one of these :)
+		summary["sim"] = dbtables.lsctables.SimInspiralTable.tableName in tables
+
+		# look for the relevant table for analyses
+		for table_name in allowed_analysis_table_names():
+			if table_name not in tables:
+				summary["tables"][table_name] = None
+				continue
+			summary["tables"][table_name] = _copy_table(tables.get_table(table_name)) if keep_tables else None
+			if summary["table_name"] is None:
+				summary["table_name"] = table_name
+			else:
+				raise ValueError("detected more than one table type out of " + " ".join(allowed_analysis_table_names()))
+		table_name = summary["table_name"]
+
+		# the non simulation databases are where we get information about segments
+		if not summary["sim"]:
+			summary["numslides"] = connection.cursor().execute('SELECT count(DISTINCT(time_slide_id)) FROM time_slide').fetchone()[0]
+			summary["instruments"].update(get_instruments_from_coinc_event_table(connection))
+			# the segments for this file, needed to figure out the missed and found injections
+			summary["segments"] = get_segments(connection, xmldoc, table_name, live_time_program, veto_segments_name, data_segments_name = data_segments_name)
+
+			# get the far thresholds for the loudest events in these databases
+			for (instruments_set, far, ts) in get_event_fars(connection, table_name):
+				if not ts:
+					summary["zerolag_fars_by_instrument_set"].setdefault(instruments_set, []).append(far)
+				else:
+					summary["ts_fars_by_instrument_set"].setdefault(instruments_set, []).append(far)
+		# get the injections
+		else:
+			# We need to know the segments in this file to determine which injections are found
+			injection_segments = summary["injection_segments"] = get_segments(connection, xmldoc, table_name, live_time_program, veto_segments_name, data_segments_name = data_segments_name)
+			distinct_instruments = connection.cursor().execute('SELECT DISTINCT(instruments) FROM coinc_event WHERE instruments!=""').fetchall()
+			for instruments, in distinct_instruments:
+				instruments_set = frozenset(lsctables.instrument_set_from_ifos(instruments))
+				summary["injection_instruments"].append(instruments_set)
+				segments_to_consider_for_these_injections = injection_segments.intersection(instruments_set) - injection_segments.union(set(injection_segments.keys()) - instruments_set)
+				found, total, missed = get_min_far_inspiral_injections(connection, segments = segments_to_consider_for_these_injections, table_name = table_name)
+				if verbose:
+					print >> sys.stderr, "%s total injections: %d; Found injections %d: Missed injections %d" % (instruments, len(total), len(found), len(missed))
+				summary["found_injections_by_instrument_set"].setdefault(instruments_set, []).extend(found)
+				summary["total_injections_by_instrument_set"].setdefault(instruments_set, []).extend(total)
+				summary["missed_injections_by_instrument_set"].setdefault(instruments_set, []).extend(missed)
+	finally:
+		# All done
+		sqlutils.close_connection(working_filename)
+		dbtables.discard_connection_filename(f, working_filename, verbose = verbose)
+	return summary
+
+
+def _summarize_database_star(args):
+	"""
+	Unpack the arguments of _summarize_database() for
+	multiprocessing.Pool.imap().
+	"""
+	f, kwargs = args
+	return _summarize_database(f, **kwargs)
+
+
 class DataBaseSummary(object):
 	"""
 	This class stores summary information gathered across the databases
+
+	If nproc is greater than 1, the databases are read by that many
+	worker processes, and the partial summaries merged in the order of
+	filelist, giving the same result as reading them one after the
+	other.  In that case the attributes holding the analysis tables
+	(coinc_inspiral, etc.) are None, because the tables of one process'
+	databases cannot be passed to another;  table_name is still set.
+	Otherwise they hold in-memory copies of the tables of the last
+	database in filelist.
 	"""
 
-	def __init__(self, filelist, live_time_program = None, veto_segments_name = None, data_segments_name = "datasegments", tmp_path = None, verbose = False):
+	def __init__(self, filelist, live_time_program = None, veto_segments_name = None, data_segments_name = "datasegments", tmp_path = None, verbose = False, nproc = 1):
 
 		self.segments = segments.segmentlistdict()
 		self.instruments = set()
@@ -486,69 +596,29 @@ class DataBaseSummary(object):
 		self.zerolag_fars_by_instrument_set = {}
 		self.ts_fars_by_instrument_set = {}
 		self.numslides = set()
+		for table_name in allowed_analysis_table_names():
+			setattr(self, table_name, None)
 
-		for f in filelist:
-			if verbose:
-				print >> sys.stderr, "Gathering stats from: %s...." % (f,)
-			working_filename = dbtables.get_connection_filename(f, tmp_path = tmp_path, verbose = verbose)
-			connection = sqlite3.connect(working_filename)
-			xmldoc = dbtables.get_xml(connection)
-
-			sim = False
-
-			# look for a sim inspiral table.  This is IMR work we have to have one of these :)
-			try:
-				sim_inspiral_table = table.get_table(xmldoc, dbtables.lsctables.SimInspiralTable.tableName)
-				sim = True
-			except ValueError:
-				pass
-
-			# look for the relevant table for analyses
-			for table_name in allowed_analysis_table_names():
-				try:
-					setattr(self, table_name, table.get_table(xmldoc, table_name))
-					if self.table_name is None or self.table_name == table_name:
-						self.table_name = table_name
-					else:
-						raise ValueError("detected more than one table type out of " + " ".join(allowed_analysis_table_names()))
-				except ValueError:
-					setattr(self, table_name, None)
-
-			# the non simulation databases are where we get information about segments
-			if not sim:
-				self.numslides.add(connection.cursor().execute('SELECT count(DISTINCT(time_slide_id)) FROM time_slide').fetchone()[0])
-				[self.instruments.add(ifos) for ifos in get_instruments_from_coinc_event_table(connection)]
-				# save a reference to the segments for this file, needed to figure out the missed and found injections
-				self.this_segments = get_segments(connection, xmldoc, self.table_name, live_time_program, veto_segments_name, data_segments_name = data_segments_name)
-				# FIXME we don't really have any reason to use playground segments, but I put this here as a reminder
-				# self.this_playground_segments = segmentsUtils.S2playground(self.this_segments.extent_all())
-				self.segments += self.this_segments
-
-				# get the far thresholds for the loudest events in these databases
-				for (instruments_set, far, ts) in get_event_fars(connection, self.table_name):
-					if not ts:
-						self.zerolag_fars_by_instrument_set.setdefault(instruments_set, []).append(far)
-					else:
-						self.ts_fars_by_instrument_set.setdefault(instruments_set, []).append(far)
-			# get the injections
-			else:
-				# We need to know the segments in this file to determine which injections are found
-				self.this_injection_segments = get_segments(connection, xmldoc, self.table_name, live_time_program, veto_segments_name, data_segments_name = data_segments_name)
-				self.this_injection_instruments = []
-				distinct_instruments = connection.cursor().execute('SELECT DISTINCT(instruments) FROM coinc_event WHERE instruments!=""').fetchall()
-				for instruments, in distinct_instruments:
-					instruments_set = frozenset(lsctables.instrument_set_from_ifos(instruments))
-					self.this_injection_instruments.append(instruments_set)
-					segments_to_consider_for_these_injections = self.this_injection_segments.intersection(instruments_set) - self.this_injection_segments.union(set(self.this_injection_segments.keys()) - instruments_set)
-					found, total, missed = get_min_far_inspiral_injections(connection, segments = segments_to_consider_for_these_injections, table_name = self.table_name)
-					if verbose:
-						print >> sys.stderr, "%s total injections: %d; Found injections %d: Missed injections %d" % (instruments, len(total), len(found), len(missed))
-					self.found_injections_by_instrument_set.setdefault(instruments_set, []).extend(found)
-					self.total_injections_by_instrument_set.setdefault(instruments_set, []).extend(total)
-					self.missed_injections_by_instrument_set.setdefault(instruments_set, []).extend(missed)
-
-			# All done
-			dbtables.discard_connection_filename(f, working_filename, verbose = verbose)
+		kwargs = {"live_time_program": live_time_program, "veto_segments_name": veto_segments_name, "data_segments_name": data_segments_name, "tmp_path": tmp_path, "verbose": verbose}
+		if nproc <= 1 or len(filelist) < 2:
+			summaries = (_summarize_database(f, **kwargs) for f in filelist)
+			pool = None
+		else:
+			kwargs["keep_tables"] = False
+			pool = multiprocessing.Pool(min(nproc, len(filelist)))
+			summaries = pool.imap(_summarize_database_star, [(f, kwargs) for f in filelist])
+		try:
+			for summary in summaries:
+				self.add_summary(summary)
+			if pool is not None:
+				pool.close()
+		except:
+			if pool is not None:
+				pool.terminate()
+			raise
+		finally:
+			if pool is not None:
+				pool.join()
 		if len(self.numslides) > 1:
 			raise ValueError('number of slides differs between input files')
 		elif self.numslides:
@@ -559,3 +629,35 @@ class DataBaseSummary(object):
 		# FIXME
 		# Things left to do
 		# 1) summarize the far threshold over the entire dataset
+
+	def add_summary(self, summary):
+		"""
+		Merge the partial summary of one database, as returned by
+		_summarize_database(), into this summary.
+		"""
+		for table_name, tbl in summary["tables"].items():
+			setattr(self, table_name, tbl)
+		if summary["table_name"] is not None:
+			if self.table_name is None or self.table_name == summary["table_name"]:
+				self.table_name = summary["table_name"]
+			else:
+				raise ValueError("detected more than one table type out of " + " ".join(allowed_analysis_table_names()))
+
+		if not summary["sim"]:
+			self.numslides.add(summary["numslides"])
+			self.instruments |= summary["instruments"]
+			# save a reference to the segments for this file
+			# FIXME we don't really have any reason to use playground segments, but I put this here as a reminder
+			# self.this_playground_segments = segmentsUtils.S2playground(self.this_segments.extent_all())
+			self.this_segments = summary["segments"]
+			self.segments += self.this_segments
+			for instruments_set, fars in summary["zerolag_fars_by_instrument_set"].items():
+				self.zerolag_fars_by_instrument_set.setdefault(instruments_set, []).extend(fars)
+			for instruments_set, fars in summary["ts_fars_by_instrument_set"].items():
+				self.ts_fars_by_instrument_set.setdefault(instruments_set, []).extend(fars)
+		else:
+			self.this_injection_segments = summary["injection_segments"]
+			self.this_injection_instruments = summary["injection_instruments"]
+			for name in ("found_injections_by_instrument_set", "total_injections_by_instrument_set", "missed_injections_by_instrument_set"):
+				for instruments_set, injections in summary[name].items():
+					getattr(self, name).setdefault(instruments_set, []).extend(injections)
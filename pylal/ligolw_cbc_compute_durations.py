@@ -28,15 +28,14 @@ A collection of functions needed for ligolw_cbc_compute_durations
 """
 
 import sys
-import sqlite3
 from operator import itemgetter
 
 from glue import iterutils
 from glue import segments
 from glue.ligolw import table
 from glue.ligolw import lsctables
-from glue.ligolw import dbtables
 from glue.ligolw.utils import segments as ligolw_segments
+from pylal import ligolw_sqlutils as sqlutils
 
 #
 # =============================================================================
@@ -55,11 +54,10 @@ def get_single_ifo_segments(connection, program_name = "inspiral", usertag = Non
 	@param usertag: the usertag for the desired filter jobs e.g. ("FULL_DATA","PLAYGROUND")
 	"""
 
-	xmldoc = dbtables.get_xml(connection)
 	seglist_dict = segments.segmentlistdict()
 	# extract segments indexed by available instrument
 	for row in map( 
-		dbtables.table.get_table(xmldoc, lsctables.SearchSummaryTable.tableName).row_from_cols, 
+		sqlutils.DBTableAccessor(connection).row_from_cols(lsctables.SearchSummaryTable.tableName), 
 		connection.cursor().execute("""
 			SELECT search_summary.*
 			FROM search_summary
@@ -84,7 +82,6 @@ def get_single_ifo_segments(connection, program_name = "inspiral", usertag = Non
 			except KeyError:
 				seglist_dict[instrument] = [filtered_segment]
 			
-	xmldoc.unlink()
 
 	seglist_dict = segments.segmentlistdict((key, segments.segmentlist(sorted(set(value)))) for key, value in seglist_dict.items())
 	return seglist_dict
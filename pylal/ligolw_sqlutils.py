@@ -17,12 +17,17 @@ import re
 import os
 import bisect
 import copy
+import itertools
 import time
 import pdb
+import json
+import numpy
 
+from glue.ligolw import ligolw
 from glue.ligolw import dbtables
 from glue.ligolw import lsctables
 from glue.ligolw import ilwd
+from glue.ligolw.utils import ligolw_sqlite
 from glue import git_version
 
 __author__ = "Collin Capano <cdcapano@physics.syr.edu>"
@@ -458,7 +463,160 @@ class parse_coinc_options:
             
 
 
-def del_rows_from_table( connection, del_table, del_table_id, join_conditions, del_filters = None, save_filters = None, verbose = False ):
+class DeletionPlanner:
+    """
+    Carries out the DELETE statements of a cleanup phase so that they do not
+    scale quadratically with the size of the database. Statements of the form
+    "DELETE FROM table WHERE column NOT IN (SELECT key_column FROM key_table)"
+    are rewritten as anti-joins (NOT EXISTS) against an index on the key
+    column. If the key_table has no index on the key column, one is created
+    and kept until finish() is called, so that it can be shared by the
+    other statements in the phase; if the keys are filtered, or come from a
+    view, they are first copied to a temporary keyed table. Deletes of rows
+    selected by an arbitrary query are likewise carried out through a
+    temporary keyed table.
+
+    The indices are created in the database itself, so finish() must be
+    called even if a delete fails. Use the planner as a context manager to
+    make sure of this: finish() is called on leaving the with block, however
+    it is left.
+
+    If dry_run is True, the statements are not executed; instead, each
+    statement and its EXPLAIN QUERY PLAN output is printed to stderr.
+    (The temporary tables and indices are still created, so that the plans
+    printed are the ones that would be used.)
+
+    Example:
+
+    with DeletionPlanner(connection) as planner:
+        planner.delete_where_not_in('process_params', 'process_id', 'process', 'process_id')
+        planner.delete_where_not_in('search_summary', 'process_id', 'process', 'process_id')
+    """
+    def __init__(self, connection, dry_run = False, verbose = False):
+        self.connection = connection
+        self.dry_run = dry_run
+        self.verbose = verbose
+        self.temp_indices = []
+        self.temp_tables = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+        return False
+
+    def has_index(self, table, column):
+        """
+        Returns True if table has an index whose first column is column.
+        """
+        cursor = self.connection.cursor()
+        for index in cursor.execute('PRAGMA index_list(%s)' % table).fetchall():
+            index_columns = cursor.execute('PRAGMA index_info(%s)' % index[1]).fetchall()
+            if index_columns and index_columns[0][2] == column:
+                return True
+        return False
+
+    def ensure_index(self, table, column):
+        """
+        Creates a temporary index on table's column if there isn't already
+        an index on it. The index is dropped by finish().
+        """
+        if self.has_index(table, column):
+            return
+        index_name = '_'.join(['_pylal_planner', table, column, 'idx'])
+        if self.verbose:
+            print >> sys.stderr, "Creating temporary index on %s (%s)..." % (table, column)
+        self.connection.cursor().execute('CREATE INDEX %s ON %s (%s)' % (index_name, table, column))
+        self.temp_indices.append(index_name)
+
+    def create_keyed_table(self, select_sql):
+        """
+        Creates a temporary table with a single, indexed column, "key",
+        filled with the distinct, non-NULL values returned by select_sql.
+        Returns the name of the table, which is dropped by finish().
+        """
+        table_name = '_pylal_planner_keys_%i' % len(self.temp_tables)
+        cursor = self.connection.cursor()
+        cursor.execute('CREATE TEMP TABLE %s (key PRIMARY KEY)' % table_name)
+        cursor.execute('INSERT OR IGNORE INTO %s (key) SELECT * FROM (%s)' % (table_name, select_sql))
+        cursor.execute('DELETE FROM %s WHERE key IS NULL' % table_name)
+        self.temp_tables.append(table_name)
+        return table_name
+
+    def execute(self, sqlquery):
+        """
+        Executes sqlquery, or prints its query plan if dry_run is set.
+        """
+        if self.dry_run:
+            print >> sys.stderr, sqlquery.strip()
+            for row in self.connection.cursor().execute('EXPLAIN QUERY PLAN ' + sqlquery):
+                print >> sys.stderr, '\t' + ' '.join([str(val) for val in row[:-1]]), row[-1]
+            print >> sys.stderr
+        else:
+            self.connection.cursor().execute(sqlquery)
+
+    def delete_where_not_in(self, table, column, key_table, key_column, key_filter = '', where = ''):
+        """
+        Deletes the rows of table whose column is not NULL and is not in the
+        key_column of key_table. This is equivalent to:
+
+        DELETE FROM table WHERE column NOT IN (SELECT key_column FROM key_table key_filter) AND where
+
+        except that NULL keys are ignored, rather than preventing any rows
+        from being deleted.
+
+        @key_filter: a WHERE clause to apply to the key_table
+        @where: an additional condition the deleted rows must satisfy
+        """
+        is_table = self.connection.cursor().execute(
+            'SELECT COUNT(*) FROM (SELECT name FROM sqlite_master WHERE type == "table" UNION ALL SELECT name FROM sqlite_temp_master WHERE type == "table") WHERE name == ?',
+            (key_table,)).fetchone()[0]
+        if key_filter.strip() or not is_table:
+            if key_filter.strip() and not key_filter.strip().upper().startswith('WHERE'):
+                key_filter = 'WHERE ' + key_filter
+            key_table = self.create_keyed_table('SELECT %s FROM %s %s' % (key_column, key_table, key_filter))
+            key_column = 'key'
+        else:
+            self.ensure_index(key_table, key_column)
+        sqlquery = ''.join([ """
+            DELETE FROM """, table, """
+            WHERE """, table, '.', column, """ IS NOT NULL AND NOT EXISTS (
+                SELECT 1
+                FROM """, key_table, """
+                WHERE """, key_table, '.', key_column, ' == ', table, '.', column, ')',
+            where and ''.join(['\n            AND (', where, ')']) or '' ])
+        self.execute(sqlquery)
+
+    def delete_where_in(self, table, column, select_sql):
+        """
+        Deletes the rows of table whose column is in the values returned by
+        select_sql. The values are copied to a temporary keyed table first,
+        so that select_sql is evaluated only once.
+        """
+        key_table = self.create_keyed_table(select_sql)
+        sqlquery = ''.join([ """
+            DELETE FROM """, table, """
+            WHERE """, column, """ IN (
+                SELECT key
+                FROM """, key_table, ')' ])
+        self.execute(sqlquery)
+
+    def finish(self):
+        """
+        Drops the temporary tables and indices created by the planner.
+        """
+        cursor = self.connection.cursor()
+        for index_name in self.temp_indices:
+            cursor.execute('DROP INDEX IF EXISTS %s' % index_name)
+        for table_name in self.temp_tables:
+            cursor.execute('DROP TABLE IF EXISTS %s' % table_name)
+        self.temp_indices = []
+        self.temp_tables = []
+        self.connection.commit()
+
+
+def del_rows_from_table( connection, del_table, del_table_id, join_conditions, del_filters = None, save_filters = None, verbose = False, dry_run = False ):
     """
     Deletes triggers from any specified table in the del_table option.
     @connection: DBTables connection to a database
@@ -471,6 +629,8 @@ def del_rows_from_table( connection, del_table, del_table_id, join_conditions, d
      JOIN table2 ON table2-link', etc.
     @del_filter: List of filters. Triggers that fall within will be deleted.
     @save_filter: List of filters. Triggers that fall within will NOT be deleted.
+    @dry_run: if True, print the query plan of the delete rather than
+     carrying it out; see DeletionPlanner.
 
     NOTE: Save filters will override del_filters if they overlap. For example,
     say del filter species H1,H2 triggers in H1,H2,L1 time and save filters are
@@ -505,13 +665,11 @@ def del_rows_from_table( connection, del_table, del_table_id, join_conditions, d
         print >> sys.stderr, "Deleting rows from %s table %s..." % (del_table, where_clause)
   
     sqlquery = ' '.join([
-          'DELETE FROM', del_table,
-          'WHERE', del_table_id, 'IN (', 
-              'SELECT', del_table_id,
-              'FROM', del_table, join_conditions,
-                 where_clause, ')' ])
-    connection.cursor().execute( sqlquery )
-    connection.commit()
+          'SELECT', del_table_id,
+          'FROM', del_table, join_conditions,
+             where_clause ])
+    with DeletionPlanner(connection, dry_run = dry_run, verbose = verbose) as planner:
+        planner.delete_where_in( del_table, del_table_id, sqlquery )
 
 
 def get_tables_in_database( connection ):
@@ -521,6 +679,83 @@ def get_tables_in_database( connection ):
     sqlquery = 'SELECT name FROM sqlite_master WHERE type == "table"'
     return connection.cursor().execute(sqlquery).fetchall()
 
+# the tables needed to register a process in a document, and to read
+# segments from one
+process_table_names = ['process', 'process_params']
+segment_table_names = ['segment_definer', 'segment_summary', 'segment']
+
+class DBTableAccessor:
+    """
+    Gives access to the tables in a database without the cost of
+    dbtables.get_xml, which builds a DBTable object, including finding the
+    next free ID by scanning the table, for every table in the database.
+    Here the tables' names and column information are read once, and the
+    DBTable objects are built only for the tables asked for, the first time
+    they are asked for.
+
+    Example:
+
+    tables = DBTableAccessor(connection)
+    if 'sim_inspiral' in tables:
+        make_sim = tables.row_from_cols('sim_inspiral')
+    xmldoc = tables.get_xml(['process', 'search_summary'])
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self._table_names = None
+        self._column_info = {}
+        self._tables = {}
+
+    @property
+    def table_names(self):
+        """
+        The names of the tables in the database.
+        """
+        if self._table_names is None:
+            self._table_names = dbtables.get_table_names(self.connection)
+        return self._table_names
+
+    def __contains__(self, table_name):
+        return table_name in self.table_names
+
+    def column_info(self, table_name):
+        """
+        Returns a list of (column name, SQLite type) tuples for the given
+        table.
+        """
+        if table_name not in self._column_info:
+            self._column_info[table_name] = dbtables.get_column_info(self.connection, table_name)
+        return self._column_info[table_name]
+
+    def get_table(self, table_name):
+        """
+        Returns the DBTable object for the given table. As with
+        glue.ligolw.table.get_table, ValueError is raised if the table is not
+        in the database.
+        """
+        if table_name not in self._tables:
+            if table_name not in self:
+                raise ValueError("no table named %s" % table_name)
+            self._tables[table_name] = dbtables.get_xml(self.connection, [table_name]).childNodes[0]
+        return self._tables[table_name]
+
+    def row_from_cols(self, table_name):
+        """
+        Returns a function that converts a row of values, in the order of
+        the table's columns in the database (i.e., as returned by
+        "SELECT table_name.* ..."), to a row object of the given table.
+        """
+        return self.get_table(table_name).row_from_cols
+
+    def get_xml(self, table_names):
+        """
+        Returns a ligolw.LIGO_LW element containing the tables in
+        table_names that are in the database, for passing to functions that
+        expect a document. New DBTable objects are built for the tables,
+        so the element can be unlinked when done with.
+        """
+        return dbtables.get_xml(self.connection, [table_name for table_name in table_names if table_name in self])
+
 def vacuum_database(connection, vacuum=None, verbose=None):
     """
     Remove empty space and defragment the database.
@@ -560,6 +795,309 @@ def get_user_created_indices( connection, table_names ):
     return indices
 
 
+#
+# Connection factory. Connections are tuned with a set of performance
+# pragmas, have the common pylal SQL functions registered on them, and are
+# reused for the same file within a process.
+#
+
+# pragmas applied to every connection; a negative cache_size is in KiB
+connection_pragmas = [
+    ('cache_size', -262144),
+    ('mmap_size', 1073741824),
+    ]
+
+# additional pragmas applied to scratch copies of databases, i.e., the
+# working copies made by dbtables.get_connection_filename, which are
+# discarded if the program fails
+scratch_pragmas = [
+    ('journal_mode', 'OFF'),
+    ('synchronous', 'OFF'),
+    ]
+
+_connection_pool = {}
+
+class SQLProfile:
+    """
+    Records the text, duration, number of rows affected and, optionally,
+    query plan of every statement executed through a TracingConnection, and
+    reports them. For a SELECT, the duration is that of the execute call,
+    which includes the time taken to find the first row, but not to fetch
+    the rest.
+    """
+    def __init__(self, explain = False):
+        self.explain = explain
+        self.records = []
+
+    def add(self, statement, duration, rows, plan = None):
+        self.records.append({'statement': statement, 'duration': duration, 'rows': rows, 'plan': plan})
+
+    def summary(self):
+        """
+        Returns a list of dictionaries, one for each distinct statement
+        (ignoring whitespace), giving the number of times it was executed
+        and the total and maximum durations and total rows affected, sorted
+        by total duration from largest to smallest.
+        """
+        stats = {}
+        for record in self.records:
+            key = ' '.join(record['statement'].split())
+            if key not in stats:
+                stats[key] = {'statement': key, 'calls': 0, 'total_duration': 0., 'max_duration': 0., 'rows': 0, 'plan': record['plan']}
+            this_stats = stats[key]
+            this_stats['calls'] += 1
+            this_stats['total_duration'] += record['duration']
+            this_stats['max_duration'] = max(this_stats['max_duration'], record['duration'])
+            this_stats['rows'] += record['rows']
+        return sorted(stats.values(), key = lambda x: x['total_duration'], reverse = True)
+
+    def report(self, fileobj = sys.stderr, format = 'table', max_statement_length = 100):
+        """
+        Writes the summary of the profile to fileobj, either as JSON, if
+        format is 'json', or as a table sorted by total duration.
+        """
+        summary = self.summary()
+        if format == 'json':
+            json.dump(summary, fileobj, indent = 1)
+            print >> fileobj
+            return
+        print >> fileobj, '%10s %10s %6s %10s  %s' % ('total (s)', 'max (s)', 'calls', 'rows', 'statement')
+        for stats in summary:
+            statement = stats['statement']
+            if len(statement) > max_statement_length:
+                statement = statement[:max_statement_length-3] + '...'
+            print >> fileobj, '%10.3f %10.3f %6i %10i  %s' % (stats['total_duration'], stats['max_duration'], stats['calls'], stats['rows'], statement)
+            if stats['plan'] is not None:
+                for line in stats['plan']:
+                    print >> fileobj, '%40s  %s' % ('', line)
+
+    def write(self, filename):
+        """
+        Writes the report to filename, as JSON if filename ends in '.json',
+        otherwise as a table.
+        """
+        fileobj = open(filename, 'w')
+        self.report(fileobj, format = filename.endswith('.json') and 'json' or 'table')
+        fileobj.close()
+
+class TracingCursor(sqlite3.Cursor):
+    """
+    A cursor that records the statements it executes in the profile of
+    its TracingConnection. The statements in a script passed to
+    executescript are executed and recorded one by one, unless the script
+    controls transactions itself, in which case it is recorded as a
+    whole.
+    """
+    _transaction_re = re.compile(r'\s*(BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+    # the statements the sqlite3 module does not commit before running
+    _dml_re = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+    def _explain(self, sql, parameters = ()):
+        if not self.connection.profile.explain:
+            return None
+        if self._dml_re.match(sql):
+            # the sqlite3 module commits before running an EXPLAIN, so
+            # explaining these here would end an open transaction
+            return self.connection.explain_elsewhere(sql, parameters)
+        # the statement will commit anyway
+        return self.connection.explain(sql, parameters)
+
+    def _trace(self, method, sql, plan, *args):
+        total_changes = self.connection.total_changes
+        start = time.time()
+        result = method(self, *args)
+        self.connection.profile.add(sql, time.time() - start, self.connection.total_changes - total_changes, plan)
+        return result
+
+    def execute(self, sql, parameters = ()):
+        plan = self._explain(sql, parameters)
+        result = self._trace(sqlite3.Cursor.execute, sql, plan, sql, parameters)
+        if plan is None and self.connection.profile.explain and self._dml_re.match(sql):
+            self.connection.explain_later(self.connection.profile.records[-1], sql, parameters)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._trace(sqlite3.Cursor.executemany, sql, None, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        statements = []
+        statement = ''
+        for part in sql_script.split(';'):
+            statement += part + ';'
+            if sqlite3.complete_statement(statement):
+                if statement.strip(' \t\n;'):
+                    statements.append(statement)
+                statement = ''
+        if statement.strip(' \t\n;'):
+            statements.append(statement)
+        if [stmt for stmt in statements if self._transaction_re.match(re.sub('--[^\n]*', '', stmt))]:
+            return self._trace(sqlite3.Cursor.executescript, sql_script, None, sql_script)
+        for statement in statements:
+            # executescript commits before running, so the plan can be
+            # found on this connection
+            plan = self.connection.explain(statement) if self.connection.profile.explain else None
+            self._trace(sqlite3.Cursor.executescript, statement, plan, statement)
+        return self
+
+class TracingConnection(sqlite3.Connection):
+    """
+    A connection whose cursors are TracingCursors, which record the
+    statements they execute in the connection's profile, an SQLProfile.
+    Use get_connection(filename, trace = True) to create one.
+
+    The query plans of SELECTs and of statements that change rows are
+    found with a second connection to the same file, as running EXPLAIN on
+    this connection would commit its open transaction. Those the second
+    connection cannot explain, such as statements using temporary tables,
+    are explained on this connection after the next commit or rollback.
+    """
+    def __init__(self, *args, **kwargs):
+        sqlite3.Connection.__init__(self, *args, **kwargs)
+        self.profile = SQLProfile()
+        self.filename = kwargs.get('database', args and args[0] or None)
+        self._plan_connection = None
+        self._pending_plans = []
+
+    def cursor(self, factory = TracingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def explain(self, sql, parameters = ()):
+        """
+        Returns the query plan of sql on this connection, or None if it
+        cannot be found. This commits any open transaction.
+        """
+        try:
+            return [row[-1] for row in sqlite3.Cursor(self).execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error:
+            return None
+
+    def explain_elsewhere(self, sql, parameters = ()):
+        """
+        Returns the query plan of sql found with a second connection to
+        the database file, or None if it cannot be found that way.
+        """
+        if self._plan_connection is None and self.filename not in (None, '', ':memory:'):
+            # no timeout, so that a lock held by this connection does
+            # not stall it
+            self._plan_connection = sqlite3.connect(self.filename, timeout = 0, isolation_level = None)
+            register_sql_functions(self._plan_connection)
+        if self._plan_connection is None:
+            return None
+        try:
+            return [row[-1] for row in self._plan_connection.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+        except sqlite3.Error:
+            return None
+
+    def explain_later(self, record, sql, parameters = ()):
+        """
+        Finds the query plan of sql after the next commit or rollback, and
+        puts it in the given profile record.
+        """
+        self._pending_plans.append((record, sql, parameters))
+
+    def _explain_pending(self):
+        pending, self._pending_plans = self._pending_plans, []
+        for record, sql, parameters in pending:
+            record['plan'] = self.explain(sql, parameters)
+
+    def commit(self):
+        sqlite3.Connection.commit(self)
+        self._explain_pending()
+
+    def rollback(self):
+        sqlite3.Connection.rollback(self)
+        self._explain_pending()
+
+    def close(self):
+        if self._plan_connection is not None:
+            self._plan_connection.close()
+            self._plan_connection = None
+        sqlite3.Connection.close(self)
+
+def register_sql_functions( connection ):
+    """
+    Registers the SQL functions and aggregates defined in this module that
+    are commonly used in queries on the connection: concatenate (and its
+    concat_Ncols aliases), agg_concatenate, get_mapped_tables,
+    end_time_in_ns and convert_duration.
+    """
+    connection.create_function('concatenate', -1, concatenate)
+    for ncols in (2, 5, 7):
+        connection.create_function('concat_%icols' % ncols, ncols, concatenate)
+    connection.create_aggregate('agg_concatenate', -1, aggregate_concatenate)
+    connection.create_aggregate('get_mapped_tables', 1, get_mapped_tables)
+    connection.create_function('end_time_in_ns', 2, end_time_in_ns)
+    connection.create_function('convert_duration', 2, convert_duration)
+
+def get_connection( filename, scratch = False, tmp_path = None, memory_temp_store = False, trace = False, explain = False, verbose = False ):
+    """
+    Returns a connection to the database in filename, creating one if
+    there isn't already an open connection to it in this process. New
+    connections have the connection_pragmas applied to them, and the
+    scratch_pragmas as well if scratch is True, and the functions in
+    register_sql_functions registered on them. If tmp_path is given,
+    SQLite's temporary files are put in it; otherwise SQLite's default
+    is used.
+
+    The connection is shared: every call for the same file in the same
+    process returns it, and close_connection closes it for all of them.
+    So only the caller that opened it should close it, once no one else
+    is using it. A ValueError is raised if the connection is already
+    open with different scratch, tmp_path, memory_temp_store, trace or
+    explain settings than those asked for.
+
+    @filename: the database file; usually the working_filename returned
+     by dbtables.get_connection_filename
+    @scratch: set to True if filename is a scratch copy of a database,
+     i.e., if working_filename != filename
+    @memory_temp_store: if True, temporary tables and indices are kept in
+     memory instead; this is faster, but large sorts and temporary tables
+     can then exhaust the memory of the node
+    @trace: if True, the connection is a TracingConnection, which records
+     every statement executed on it in its profile attribute
+    @explain: if True (and trace is), the query plans of the statements are
+     recorded as well
+    """
+    key = (os.getpid(), os.path.realpath(filename))
+    options = dict(scratch = bool(scratch), tmp_path = tmp_path, memory_temp_store = bool(memory_temp_store),
+        trace = bool(trace), explain = bool(trace and explain))
+    if key in _connection_pool:
+        connection, pooled_options = _connection_pool[key]
+        if options != pooled_options:
+            raise ValueError, "the connection to %s is already open with %s, not %s" % (filename,
+                ', '.join('%s = %r' % item for item in sorted(pooled_options.items()) if options[item[0]] != item[1]),
+                ', '.join('%s = %r' % item for item in sorted(options.items()) if pooled_options[item[0]] != item[1]))
+        return connection
+    if trace:
+        connection = sqlite3.connect(filename, factory = TracingConnection)
+        connection.profile.explain = explain
+    else:
+        connection = sqlite3.connect(filename)
+    cursor = connection.cursor()
+    pragmas = connection_pragmas + (scratch and scratch_pragmas or [])
+    if memory_temp_store:
+        pragmas = pragmas + [('temp_store', 'MEMORY')]
+    for pragma, value in pragmas:
+        cursor.execute('PRAGMA %s = %s' % (pragma, value))
+    if tmp_path is not None:
+        dbtables.set_temp_store_directory(connection, tmp_path, verbose = verbose)
+    register_sql_functions(connection)
+    _connection_pool[key] = (connection, options)
+    return connection
+
+def close_connection( filename ):
+    """
+    Commits and closes the pooled connection to filename, if there is one.
+    This should be called before the file is moved or deleted, e.g., by
+    dbtables.put_connection_filename or discard_connection_filename. The
+    connection is closed for everyone who got it from get_connection.
+    """
+    connection, options = _connection_pool.pop((os.getpid(), os.path.realpath(filename)), (None, None))
+    if connection is not None:
+        connection.commit()
+        connection.close()
+
+
 def convert_duration( duration, convert_to ):
     """
     Converts durations stored in the experiment_summary_table from seconds 
@@ -664,11 +1202,20 @@ class Summaries:
 
     zero_lag_ids stores the esid of all zero-lag "slides" of an experiment.
         zero_lag_ids[ experiment_id ] = [experiment_summ_id1, experiment_summ_id2, etc.]
+
+    esid_datatypes maps each experiment_summ_id to its datatype.
+
+    The calc_ufar_by_max, calc_ufar_by_min, and calc_cfar methods compute
+    fars for one trigger at a time, and can be registered as SQLite
+    functions. To compute fars for many triggers at once, use calc_ufars,
+    calc_cfars, or update_fars instead; these give identical results but do
+    the counting with numpy.
     """
     def __init__(self):
         self.bkg_stats = {}
         self.sngl_slide_stats = {}
         self.datatypes = {}
+        self.esid_datatypes = {}
         self.frg_durs = {}
         self.bkg_durs = {}
         self.max_bkg_fars = {}
@@ -707,15 +1254,13 @@ class Summaries:
         if datatype not in self.datatypes[experiment_id]:
             self.datatypes[experiment_id][datatype] = []
         self.datatypes[experiment_id][datatype].append(experiment_summ_id)
+        self.esid_datatypes.setdefault(experiment_summ_id, datatype)
 
     def get_datatype(self, experiment_summ_id):
         """
         Retrieve the datatype for a given experiment_summ_id.
         """
-        for eid in self.datatypes:
-            for datatype, esid_list in self.datatypes[eid].items():
-                if experiment_summ_id in esid_list:
-                    return datatype
+        return self.esid_datatypes.get(experiment_summ_id)
 
     def append_zero_lag_id(self, experiment_id, zero_lag_esid):
         """
@@ -825,6 +1370,315 @@ class Summaries:
             (len( self.max_bkg_fars[(esid, ifo_group)] ) - bisect.bisect_left( self.max_bkg_fars[(esid,ifo_group)], ufar ))*ufar \
             + sum([self.max_bkg_fars[(esid,ifo_group)][ii] for ii in range(bisect.bisect_left( self.max_bkg_fars[(esid,ifo_group)], ufar))])
 
+    def calc_ufars(self, eids, esids, ifos, param_groups, stats, rank_by = "MAX"):
+        """
+        Calculates the uncombined fars of many triggers at once. Returns an
+        array of the ufars, which are the same as would be returned by
+        calc_ufar_by_max (if rank_by is "MAX") or calc_ufar_by_min (if
+        rank_by is "MIN") for each trigger in turn. The triggers are
+        grouped by category, and the counting of the background triggers
+        in the same category, and in the same slide, is done for each
+        category with one numpy.searchsorted.
+
+        @eids, esids, ifos, param_groups, stats: sequences giving the
+         experiment_id, experiment_summ_id, ifos, param_group, and ranking
+         stat of each trigger
+        @rank_by: "MAX" or "MIN"
+        """
+        if rank_by not in ("MAX", "MIN"):
+            raise ValueError, "rank_by must be MAX or MIN"
+        stats = numpy.asarray(stats, dtype = float)
+        ufars = numpy.zeros(len(stats), dtype = float)
+        bkg_durs = numpy.array([self.bkg_durs[esid] for esid in esids], dtype = float)
+
+        def count(stat_list, these_stats):
+            # the number of entries in stat_list that are >= (for MAX)
+            # or <= (for MIN) each of these_stats
+            stat_list = numpy.array(stat_list, dtype = float)
+            if rank_by == "MAX":
+                return len(stat_list) - stat_list.searchsorted(these_stats, side = 'left')
+            return stat_list.searchsorted(these_stats, side = 'right')
+
+        # group the triggers by category and by slide
+        categories = {}
+        slides = {}
+        for ii, (eid, esid, this_ifos, param_group) in enumerate(zip(eids, esids, ifos, param_groups)):
+            categories.setdefault((eid, this_ifos, param_group), []).append(ii)
+            slides.setdefault((eid, esid, this_ifos, param_group), []).append(ii)
+
+        for category, indices in categories.items():
+            ufars[indices] += count(self.bkg_stats[category], stats[indices])
+        for slide, indices in slides.items():
+            ufars[indices] -= count(self.sngl_slide_stats[slide], stats[indices])
+        ufars /= bkg_durs
+        if rank_by == "MIN":
+            # see calc_ufar_by_min
+            ufars[stats == 0.] = 0.
+        return ufars
+
+    def calc_cfars(self, esids, ifo_groups, ufars):
+        """
+        Calculates the combined fars of many triggers at once. Returns an
+        array of the cfars, which are the same as would be returned by
+        calc_cfar for each trigger in turn.
+
+        @esids, ifo_groups, ufars: sequences giving the experiment_summ_id,
+         ifo_group, and uncombined far of each trigger
+        """
+        ufars = numpy.asarray(ufars, dtype = float)
+        cfars = numpy.zeros(len(ufars), dtype = float)
+        groups = {}
+        for ii, key in enumerate(zip(esids, ifo_groups)):
+            groups.setdefault(key, []).append(ii)
+        for key, indices in groups.items():
+            max_bkg_fars = numpy.array(sorted(self.max_bkg_fars[key]), dtype = float)
+            # the sum of the max_bkg_fars of the inactive categories is
+            # looked up in the cumulative sum
+            inactive_sums = numpy.hstack(([0.], numpy.cumsum(max_bkg_fars)))
+            these_ufars = ufars[indices]
+            num_inactive = max_bkg_fars.searchsorted(these_ufars, side = 'left')
+            cfars[indices] = (len(max_bkg_fars) - num_inactive) * these_ufars + inactive_sums[num_inactive]
+        return cfars
+
+    def update_fars(self, connection, sqlquery, table_name, ufar_column, cfar_column = None, rank_by = "MAX", ifo_group = None, sqlparams = (), verbose = False):
+        """
+        Calculates uncombined and (optionally) combined fars for all the
+        triggers returned by a query, and writes them to the given table
+        with a single executemany UPDATE.
+
+        @sqlquery: a query returning the coinc_event_id, experiment_id,
+         experiment_summ_id, ifos, param_group, and ranking stat, in that
+         order, of each trigger to update. There should be one row per
+         coinc_event_id.
+        @table_name: the table to update; must have a coinc_event_id column
+        @ufar_column: the column to store the uncombined fars in
+        @cfar_column: the column to store the combined fars in; if None,
+         combined fars are not calculated
+        @rank_by: "MAX" or "MIN"; see calc_ufars
+        @ifo_group: the ifo_group with which the max_bkg_fars were stored,
+         e.g., "ALL_IFOS" when combining fars across ifos and param bins.
+         If None, each trigger's ifos is used.
+        @sqlparams: parameters for sqlquery
+        """
+        if verbose:
+            print >> sys.stderr, "Retrieving triggers..."
+        rows = connection.cursor().execute(sqlquery, sqlparams).fetchall()
+        if not rows:
+            return
+        ceids, eids, esids, ifos, param_groups, stats = zip(*rows)
+        del rows
+        if verbose:
+            print >> sys.stderr, "Calculating fars for %i triggers..." % len(ceids)
+        ufars = self.calc_ufars(eids, esids, ifos, param_groups, stats, rank_by = rank_by)
+        if cfar_column is not None:
+            if ifo_group is None:
+                cfars = self.calc_cfars(esids, ifos, ufars)
+            else:
+                cfars = self.calc_cfars(esids, [ifo_group] * len(esids), ufars)
+        table_name = validate_option(table_name)
+        ufar_column = validate_option(ufar_column)
+        if verbose:
+            print >> sys.stderr, "Updating %s..." % table_name
+        if cfar_column is None:
+            sqlquery = "UPDATE %s SET %s = ? WHERE coinc_event_id == ?" % (table_name, ufar_column)
+            values = zip(ufars.tolist(), ceids)
+        else:
+            sqlquery = "UPDATE %s SET %s = ?, %s = ? WHERE coinc_event_id == ?" % (table_name, ufar_column, validate_option(cfar_column))
+            values = zip(ufars.tolist(), cfars.tolist(), ceids)
+        connection.cursor().executemany(sqlquery, values)
+
+    def calc_max_bkg_fars(self, ifo_group = None):
+        """
+        Replaces max_bkg_fars with the maximum background fars of every
+        category found in bkg_stats, for every experiment_summ_id in
+        bkg_durs. The maximum background far of a category in a slide is
+        the number of background triggers in the category, not counting
+        those in the same slide, divided by the slide's background
+        duration; if there are no such triggers, 1/(background duration)
+        is used. calc_bkg_durs must be called first.
+
+        @ifo_group: the ifo_group to file the max_bkg_fars under, e.g.,
+         "ALL_IFOS"; if None, each category's ifos is used
+        """
+        self.max_bkg_fars = {}
+        for (eid, ifos, param_group), stat_list in self.bkg_stats.items():
+            for esid in self.frg_durs.get(eid, {}):
+                num = len(stat_list) - len(self.sngl_slide_stats.get((eid, esid, ifos, param_group), []))
+                if num == 0:
+                    num = 1.
+                self.append_max_bkg_far(esid, ifos if ifo_group is None else ifo_group, num / self.bkg_durs[esid])
+        self.sort_max_bkg_fars()
+
+    #
+    # Persistent background. The sorted stats of each slide in each
+    # category are stored in a side table in the database, together with
+    # the slide's background duration, so that when new triggers are
+    # added to the database the background can be updated by merging the
+    # new triggers into it, and only the fars that change need to be
+    # recomputed.
+    #
+
+    bkg_stats_table = "summaries_bkg_stats"
+
+    def save_bkg_stats(self, connection):
+        """
+        Writes sngl_slide_stats and bkg_durs to the bkg_stats_table in the
+        database, replacing its contents.
+        """
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS %s (experiment_id, experiment_summ_id, ifos, param_group, bkg_duration, stats BLOB)" % self.bkg_stats_table)
+        cursor.execute("DELETE FROM %s" % self.bkg_stats_table)
+        cursor.executemany("INSERT INTO %s VALUES (?, ?, ?, ?, ?, ?)" % self.bkg_stats_table, [
+            (eid, esid, ifos, param_group, self.bkg_durs.get(esid), sqlite3.Binary(numpy.array(stat_list, dtype = float).tostring()))
+            for (eid, esid, ifos, param_group), stat_list in self.sngl_slide_stats.items()])
+
+    def load_bkg_stats(self, connection):
+        """
+        Reads sngl_slide_stats from the bkg_stats_table in the database,
+        and rebuilds bkg_stats from them. The background durations
+        with which they were stored are put in saved_bkg_durs. Returns
+        False if the database has no bkg_stats_table, True otherwise.
+        Raises ValueError if the table has more than one row for a slide,
+        ifos and param_group, as then the background would be counted
+        more than once.
+        """
+        self.saved_bkg_durs = {}
+        if (self.bkg_stats_table,) not in get_tables_in_database(connection):
+            return False
+        categories = {}
+        loaded = set()
+        for eid, esid, ifos, param_group, bkg_dur, stats in connection.cursor().execute("SELECT * FROM %s" % self.bkg_stats_table):
+            key = (eid, esid, ifos, param_group)
+            if key in loaded:
+                raise ValueError("%s has more than one row for %s" % (self.bkg_stats_table, str(key)))
+            loaded.add(key)
+            stats = numpy.frombuffer(stats, dtype = float)
+            self.sngl_slide_stats[key] = stats.tolist()
+            categories.setdefault((eid, ifos, param_group), []).append(stats)
+            self.saved_bkg_durs[esid] = bkg_dur
+        for category, stats in categories.items():
+            self.bkg_stats[category] = numpy.sort(numpy.concatenate(stats), kind = 'mergesort').tolist()
+        return True
+
+    def merge_bkg_stats(self, eids, esids, ifos, param_groups, stats):
+        """
+        Adds the stats of new triggers to bkg_stats and sngl_slide_stats,
+        keeping them sorted. As with add_to_bkg_stats, only slide triggers
+        are added to the background. Returns a dictionary mapping each
+        category to which triggers were added to the (smallest, largest)
+        stat added to it.
+        """
+        new_slide_stats = {}
+        for eid, esid, this_ifos, param_group, stat in zip(eids, esids, ifos, param_groups, stats):
+            self.bkg_stats.setdefault((eid, this_ifos, param_group), [])
+            self.sngl_slide_stats.setdefault((eid, esid, this_ifos, param_group), [])
+            if not ( eid in self.zero_lag_ids and esid in self.zero_lag_ids[eid] ):
+                new_slide_stats.setdefault((eid, esid, this_ifos, param_group), []).append(stat)
+        affected = {}
+        for (eid, esid, this_ifos, param_group), new_stats in new_slide_stats.items():
+            new_stats.sort()
+            category = (eid, this_ifos, param_group)
+            # the lists are concatenations of two sorted runs, which sort
+            # merges in linear time
+            for key, stat_list in (((eid, esid, this_ifos, param_group), self.sngl_slide_stats), (category, self.bkg_stats)):
+                stat_list[key].extend(new_stats)
+                stat_list[key].sort()
+            lo, hi = affected.get(category, (new_stats[0], new_stats[-1]))
+            affected[category] = (min(lo, new_stats[0]), max(hi, new_stats[-1]))
+        return affected
+
+    def update_fars_incrementally(self, connection, sqlquery, table_name, ufar_column, cfar_column = None, rank_by = "MAX", ifo_group = None, sqlparams = (), verbose = False):
+        """
+        Updates the fars in a database to which new triggers have been
+        added since the fars were last calculated, using the background
+        saved in the database by the previous call. New triggers are
+        identified by a NULL uncombined far. The new slide triggers are
+        merged into the saved background, and uncombined fars are only
+        recomputed for the new triggers, the triggers in slides whose
+        background duration has changed, and the triggers in the same
+        categories as the new background triggers whose ufars the new
+        triggers can change. If cfar_column is given, max_bkg_fars are
+        recalculated with calc_max_bkg_fars and combined fars with
+        calc_cfars. Only the rows whose fars have changed are written
+        back, after which the updated background is saved. If the database
+        has no saved background, all the fars are calculated from scratch.
+        Returns the number of rows updated.
+
+        The durations, datatypes and zero_lag_ids must be filled in, and
+        calc_bkg_durs called, before calling this method; the background
+        stats must not be.
+
+        @sqlquery: a query returning the coinc_event_id, experiment_id,
+         experiment_summ_id, ifos, param_group, ranking stat, uncombined
+         far, and combined far (or NULL if cfar_column is None), in that
+         order, of every trigger. There should be one row per
+         coinc_event_id.
+        @table_name, ufar_column, cfar_column, rank_by, ifo_group,
+         sqlparams: see update_fars
+        """
+        have_saved = self.load_bkg_stats(connection)
+        rows = connection.cursor().execute(sqlquery, sqlparams).fetchall()
+        if not rows:
+            self.save_bkg_stats(connection)
+            return 0
+        ceids, eids, esids, ifos, param_groups, stats, ufars, cfars = zip(*rows)
+        del rows
+        stats = numpy.array(stats, dtype = float)
+        ufars = numpy.array(ufars, dtype = float)
+        cfars = numpy.array(cfars, dtype = float)
+
+        # new triggers have not had their ufars calculated
+        if have_saved:
+            new = numpy.isnan(ufars)
+        else:
+            new = numpy.ones(len(ceids), dtype = bool)
+        new_indices, = new.nonzero()
+        if verbose:
+            print >> sys.stderr, "Merging %i new triggers into the background..." % len(new_indices)
+        affected_categories = self.merge_bkg_stats([eids[ii] for ii in new_indices], [esids[ii] for ii in new_indices], [ifos[ii] for ii in new_indices], [param_groups[ii] for ii in new_indices], stats[new_indices].tolist())
+
+        # find the triggers whose ufars can have changed
+        changed_durs = set(esid for esid, bkg_dur in self.bkg_durs.items() if self.saved_bkg_durs.get(esid) != bkg_dur)
+        affected = new.copy()
+        for ii, (eid, esid, this_ifos, param_group) in enumerate(zip(eids, esids, ifos, param_groups)):
+            if affected[ii]:
+                continue
+            if esid in changed_durs:
+                affected[ii] = True
+            elif (eid, this_ifos, param_group) in affected_categories:
+                lo, hi = affected_categories[(eid, this_ifos, param_group)]
+                affected[ii] = stats[ii] <= hi if rank_by == "MAX" else stats[ii] >= lo
+        indices, = affected.nonzero()
+        if verbose:
+            print >> sys.stderr, "Calculating ufars for %i of %i triggers..." % (len(indices), len(ceids))
+        new_ufars = ufars.copy()
+        new_ufars[indices] = self.calc_ufars([eids[ii] for ii in indices], [esids[ii] for ii in indices], [ifos[ii] for ii in indices], [param_groups[ii] for ii in indices], stats[indices], rank_by = rank_by)
+        changed = new | (new_ufars != ufars)
+        ufars = new_ufars
+
+        if cfar_column is not None:
+            self.calc_max_bkg_fars(ifo_group = ifo_group)
+            new_cfars = self.calc_cfars(esids, ifos if ifo_group is None else [ifo_group] * len(esids), ufars)
+            changed |= new_cfars != cfars
+            cfars = new_cfars
+
+        # write back the fars that have changed
+        indices, = changed.nonzero()
+        if verbose:
+            print >> sys.stderr, "Updating %i rows in %s..." % (len(indices), table_name)
+        table_name = validate_option(table_name)
+        ufar_column = validate_option(ufar_column)
+        if cfar_column is None:
+            sqlquery = "UPDATE %s SET %s = ? WHERE coinc_event_id == ?" % (table_name, ufar_column)
+            values = [(ufars[ii], ceids[ii]) for ii in indices]
+        else:
+            sqlquery = "UPDATE %s SET %s = ?, %s = ? WHERE coinc_event_id == ?" % (table_name, ufar_column, validate_option(cfar_column))
+            values = [(ufars[ii], cfars[ii], ceids[ii]) for ii in indices]
+        connection.cursor().executemany(sqlquery, values)
+
+        self.save_bkg_stats(connection)
+        return len(indices)
+
 class rank_stats:
     """
     Class to return a rank for stats.
@@ -870,6 +1724,87 @@ class rank_stats:
         else:
             return len(self.stats) - bisect.bisect_right(self.stats, this_stat) + 1
 
+    def get_ranks( self, stats ):
+        """
+        Returns an array of the ranks of many stats at once, the same as
+        get_rank would return for each. As in get_rank, NULL (None) stats,
+        whether in stats or in self.stats, sort before all others.
+        """
+        # NULLs sort before everything in self.stats, so count them
+        # separately and search only the rest
+        null_stats = len([stat for stat in self.stats if stat is None])
+        sorted_stats = numpy.array(self.stats[null_stats:], dtype = float)
+        is_null = numpy.array([stat is None for stat in stats], dtype = bool)
+        stats = numpy.array([stat is None and numpy.nan or stat for stat in stats], dtype = float)
+        if self.rank_by == "ASC":
+            ranks = null_stats + numpy.searchsorted(sorted_stats, stats, side = 'left') + 1
+            # bisect_left puts a NULL before the NULLs in self.stats
+            ranks[is_null] = 1
+        else:
+            ranks = len(self.stats) - (null_stats + numpy.searchsorted(sorted_stats, stats, side = 'right')) + 1
+            # bisect_right puts a NULL after the NULLs in self.stats
+            ranks[is_null] = len(self.stats) - null_stats + 1
+        return ranks
+
+    def write_ranks( self, connection, rank_column, id_column = 'coinc_event_id', filter = '', temp_table = None, verbose = False ):
+        """
+        Ranks every row of self.table selected by filter in one pass, and
+        writes the ranks to rank_column, creating it if need be. This is
+        much faster than calling get_rank as a SQL function on each row, and
+        gives the same ranks. The ranks are put in a temporary table keyed by
+        id_column, which is then joined to self.table to update it.
+        populate_stats_list must be called first.
+
+        @rank_column: name of the column to write the ranks to
+        @id_column: a column in self.table that uniquely identifies its rows
+        @filter: apply a filter (i.e., a SQLite WHERE clause), as in
+         populate_stats_list
+        @temp_table: if given, self.table is left unchanged; instead the
+         temporary table is created with this name, with columns id_column
+         and rank_column, for the caller to join to self.table and to drop
+         when done with
+        Returns the number of rows ranked.
+        """
+        if verbose:
+            print >> sys.stderr, "Ranking %s by %s..." % (self.table, self.ranking_stat)
+        cursor = connection.cursor()
+        if temp_table is not None:
+            cursor.execute('CREATE TEMP TABLE %s (%s PRIMARY KEY, %s INTEGER)' % (temp_table, id_column, rank_column))
+        elif rank_column not in get_column_names_from_table(connection, self.table):
+            cursor.execute('ALTER TABLE %s ADD COLUMN %s INTEGER' % (self.table, rank_column))
+        sqlquery = ''.join(["""
+            SELECT DISTINCT
+                """, self.table, '.', id_column, """,
+                """, self.ranking_stat, """
+            FROM
+                """, self.table, """
+            """, filter ])
+        rows = cursor.execute(sqlquery).fetchall()
+        if not rows:
+            return 0
+        ids, stats = zip(*rows)
+        ranks = [int(rank) for rank in self.get_ranks(stats)]
+        if temp_table is not None:
+            cursor.executemany('INSERT OR REPLACE INTO %s (%s, %s) VALUES (?, ?)' % (temp_table, id_column, rank_column), zip(ids, ranks))
+            return len(ids)
+        cursor.execute('CREATE TEMP TABLE _ranks_ (id PRIMARY KEY, rank)')
+        cursor.executemany('INSERT OR REPLACE INTO _ranks_ (id, rank) VALUES (?, ?)', zip(ids, ranks))
+        cursor.execute(''.join(["""
+            UPDATE
+                """, self.table, """
+            SET
+                """, rank_column, """ = (
+                    SELECT rank
+                    FROM _ranks_
+                    WHERE _ranks_.id == """, self.table, '.', id_column, """)
+            WHERE
+                """, id_column, """ IN (
+                    SELECT id
+                    FROM _ranks_)""" ]))
+        cursor.execute('DROP TABLE _ranks_')
+        connection.commit()
+        return len(ids)
+
 
 def get_col_type(table_name, col_name, default = 'lstring'):
     """
@@ -912,7 +1847,7 @@ def create_column( connection, table_name, column_name ):
 # process, process_params, search_summary,search_summvars, and summ_value
 # tables
 
-def clean_metadata(connection, key_tables, verbose = False):
+def clean_metadata(connection, key_tables, verbose = False, dry_run = False):
     """
     Cleans metadata from tables that don't have process_ids in any of the tables
     listed in the key_tables list.
@@ -926,47 +1861,31 @@ def clean_metadata(connection, key_tables, verbose = False):
         (this doesn't have to be 'process_id', but it should be a
         process_id type),
         filter is a filter to apply to the table when selecting process_ids
+    @dry_run: if True, print the query plans of the deletes rather than
+     carrying them out; see DeletionPlanner.
     """
     if verbose:
         print >> sys.stderr, "Removing unneeded metadata..."
     
-    #
-    # create a temp. table of process_ids to keep
-    #
-    sqlscript = 'CREATE TEMP TABLE save_proc_ids (process_id);'
-    
-    # cycle over the key_tables, adding execution blocks for each
-    for table, column, filter in key_tables:
-        if filter != '' and not filter.strip().startswith('WHERE'):
-            filter = 'WHERE\n' + filter
-        sqlscript = '\n'.join([ sqlscript,
-            'INSERT INTO save_proc_ids (process_id)',
-                'SELECT DISTINCT',
-                    column,
-                'FROM', table, filter, ';' ])
-
-    sqlscript = sqlscript + '\nCREATE INDEX proc_index ON save_proc_ids (process_id);'
-    
-    # now step through all tables with process_ids and remove rows who's ids 
-    # aren't in save_proc_ids
-    tableList = [table for table in ['process','process_params','search_summary','search_summvars','summ_value']
-        if table in get_tables_in_database(connection) ]
-    for table in tableList:
-        sqlscript = '\n'.join([ sqlscript, 
-            'DELETE FROM',
-                table,
-            'WHERE',
-                'process_id NOT IN (',
-                    'SELECT',
-                        'process_id',
-                    'FROM',
-                        'save_proc_ids );' ])
-
-    # drop the save_proc_ids table
-    sqlscript = sqlscript + '\nDROP TABLE save_proc_ids;'
-
-    # execute the script
-    connection.cursor().executescript(sqlscript)
+    with DeletionPlanner(connection, dry_run = dry_run, verbose = verbose) as planner:
+
+        #
+        # create a temp. table of process_ids to keep
+        #
+        selects = []
+        for table, column, filter in key_tables:
+            if filter != '' and not filter.strip().startswith('WHERE'):
+                filter = 'WHERE\n' + filter
+            selects.append(' '.join([ 'SELECT', column, 'FROM', table, filter ]))
+        save_proc_ids = planner.create_keyed_table( '\nUNION\n'.join(selects) or 'SELECT NULL' )
+
+        # now step through all tables with process_ids and remove rows who's ids
+        # aren't in save_proc_ids; the planner drops the save_proc_ids table
+        all_tables = [table for (table,) in get_tables_in_database(connection)]
+        tableList = [table for table in ['process','process_params','search_summary','search_summvars','summ_value']
+            if table in all_tables ]
+        for table in tableList:
+            planner.delete_where_not_in( table, 'process_id', save_proc_ids, 'key' )
 
 def clean_metadata_using_end_time(connection, key_table, key_column, verbose = False):
     """
@@ -1811,7 +2730,7 @@ class sim_tag_proc_id_mapper:
 # Following utilities are apply to any table with a coinc_event_id column
 def clean_using_coinc_table( connection, table_name, verbose = False,
     clean_experiment_map = True, clean_coinc_event_table = True, clean_coinc_definer = True,
-    clean_coinc_event_map = True, clean_mapped_tables = True, selected_tables = []):
+    clean_coinc_event_map = True, clean_mapped_tables = True, selected_tables = [], dry_run = False):
     """
     Clears experiment_map, coinc_event, coinc_event_map, and all tables pointing to the
     coinc_event_map of triggers that are no longer in the specified table.
@@ -1832,76 +2751,53 @@ def clean_using_coinc_table( connection, table_name, verbose = False,
     @selected_tables: if clean_mapped_tables is on, will clean the listed tables if they appear in the 
      coinc_event_map and have an event_id column. Default, [], is to clean all tables found.
      The requirement that the table has an event_id avoids cleaning simulation tables.
+    @dry_run: if True, print the query plans of the deletes rather than
+     carrying them out; see DeletionPlanner.
     """
-
-    # Delete from experiment_map
-    if clean_experiment_map:
-        if verbose:
-            print >> sys.stderr, "Cleaning the experiment_map table..."
-        sqlquery = ''.join(["""
-            DELETE
-            FROM experiment_map
-            WHERE coinc_event_id NOT IN (
-                SELECT coinc_event_id
-                FROM """, table_name, ')' ])
-        connection.cursor().execute( sqlquery )
-        connection.commit()
-
-    # Delete from coinc_event_map
-    if clean_coinc_event_map:
-        if verbose:
-            print >> sys.stderr, "Cleaning the coinc_event_map table..."
-        skip_tables = [ ''.join(['table_name != "', tname, '"'])
-            for tname in get_cem_table_names(connection) if tname == 'coinc_event' or tname.startswith('sim_')
-            ]
-
-        sqlquery = ''.join([ """
-            DELETE
-            FROM coinc_event_map
-            WHERE
-                coinc_event_id NOT IN (
-                    SELECT coinc_event_id
-                    FROM """, table_name, ')',
-                skip_tables != [] and ' AND\n\t\t'+' AND\n\t\t'.join(skip_tables) or '' ])
-        connection.cursor().execute( sqlquery )
-        connection.commit()
-
-    # Find tables listed in coinc_event_map
-    if clean_mapped_tables and selected_tables == []:
-        selected_tables = get_cem_table_names(connection)
-
-    # Delete events from tables that were listed in the coinc_event_map
-    # we only want to delete event_ids, not simulations, so if a table
-    # does not have an event_id, we just pass
-    if clean_mapped_tables:
-        clean_mapped_event_tables( connection, selected_tables,
-            raise_err_on_missing_evid = False, verbose = verbose )
-
-    # Delete from coinc_event
-    if clean_coinc_event_table:
-        if verbose:
-            print >> sys.stderr, "Cleaning the coinc_event table..."
-        sqlquery = """
-            DELETE
-            FROM coinc_event 
-            WHERE coinc_event_id NOT IN (
-                SELECT DISTINCT coinc_event_id
-                FROM coinc_event_map)"""
-        connection.cursor().execute( sqlquery )
-        connection.commit()
-  
-    # Delete from coinc_definer
-    if clean_coinc_definer and clean_coinc_event_table:
-        if verbose:
-            print >> sys.stderr, "Cleaning the coinc_definer table..."
-        sqlquery = """
-            DELETE
-            FROM coinc_definer
-            WHERE coinc_def_id NOT IN (
-                SELECT coinc_def_id
-                FROM coinc_event )"""
-        connection.cursor().execute( sqlquery )
-        connection.commit()
+    with DeletionPlanner(connection, dry_run = dry_run, verbose = verbose) as planner:
+        # Delete from experiment_map
+        if clean_experiment_map:
+            if verbose:
+                print >> sys.stderr, "Cleaning the experiment_map table..."
+            planner.delete_where_not_in( 'experiment_map', 'coinc_event_id', table_name, 'coinc_event_id' )
+            connection.commit()
+
+        # Delete from coinc_event_map
+        if clean_coinc_event_map:
+            if verbose:
+                print >> sys.stderr, "Cleaning the coinc_event_map table..."
+            skip_tables = [ ''.join(['table_name != "', tname, '"'])
+                for tname in get_cem_table_names(connection) if tname == 'coinc_event' or tname.startswith('sim_')
+                ]
+
+            planner.delete_where_not_in( 'coinc_event_map', 'coinc_event_id', table_name, 'coinc_event_id',
+                where = ' AND '.join(skip_tables) )
+            connection.commit()
+
+        # Find tables listed in coinc_event_map
+        if clean_mapped_tables and selected_tables == []:
+            selected_tables = get_cem_table_names(connection)
+
+        # Delete events from tables that were listed in the coinc_event_map
+        # we only want to delete event_ids, not simulations, so if a table
+        # does not have an event_id, we just pass
+        if clean_mapped_tables:
+            clean_mapped_event_tables( connection, selected_tables,
+                raise_err_on_missing_evid = False, verbose = verbose, planner = planner )
+
+        # Delete from coinc_event
+        if clean_coinc_event_table:
+            if verbose:
+                print >> sys.stderr, "Cleaning the coinc_event table..."
+            planner.delete_where_not_in( 'coinc_event', 'coinc_event_id', 'coinc_event_map', 'coinc_event_id' )
+            connection.commit()
+
+        # Delete from coinc_definer
+        if clean_coinc_definer and clean_coinc_event_table:
+            if verbose:
+                print >> sys.stderr, "Cleaning the coinc_definer table..."
+            planner.delete_where_not_in( 'coinc_definer', 'coinc_def_id', 'coinc_event', 'coinc_def_id' )
+            connection.commit()
 
 def apply_inclusion_rules_to_coinc_table( connection, coinc_table, exclude_coincs = None, include_coincs = None, 
         param_filters = None, verbose = False ):
@@ -1947,6 +2843,68 @@ def apply_inclusion_rules_to_coinc_table( connection, coinc_table, exclude_coinc
             clean_coinc_event_map = True, clean_mapped_tables = True )
 
 
+def range_max( x, lo, hi ):
+    """
+    Returns an array giving, for each i, the maximum of x[lo[i]:hi[i]].
+    All of the ranges must be non-empty. Uses a sparse table of the maxima
+    of x over spans of 2^k elements, so the cost is O(n log n) for n
+    elements, all of it in numpy.
+
+    @x: array of values
+    @lo: array of the first index of each range
+    @hi: array of one past the last index of each range
+    """
+    table = [x]
+    while 2**len(table) <= len(x):
+        prev, step = table[-1], 2**(len(table) - 1)
+        table.append( numpy.maximum(prev[:-step], prev[step:]) )
+    # the largest k such that 2^k <= hi - lo
+    level = numpy.frexp( hi - lo )[1] - 1
+    result = numpy.empty( len(lo), dtype = x.dtype )
+    for k in numpy.unique( level ):
+        idx = level == k
+        result[idx] = numpy.maximum( table[k][lo[idx]], table[k][hi[idx] - 2**k] )
+    return result
+
+def sweep_cluster( rows, window, rank_by ):
+    """
+    Returns a list of the (ceid, esid) pairs of the triggers that lose
+    clustering. A trigger loses if there is another trigger in the same
+    (esid, ifos, param_grouping) group with a better ranking stat and a
+    gps_time in (gps_time - window, gps_time + window]. Triggers with NULL
+    gps_times or ranking stats neither lose nor cause others to lose.
+
+    @rows: an iterable of (esid, ifos, param_grouping, gps_time,
+     ranking_stat, ceid) tuples, sorted by esid, ifos, param_grouping and
+     gps_time
+    @window: the cluster window, in the units of gps_time
+    @rank_by: ">" if larger ranking stats are better, "<" if smaller
+    """
+    if not window > 0:
+        raise ValueError, "cluster window must be greater than 0"
+    losers = []
+    for group, group_rows in itertools.groupby( rows, lambda row: row[:3] ):
+        group_rows = list(group_rows)
+        if len(group_rows) < 2 or None in group:
+            continue
+        # NULLs are converted to NaNs and removed
+        times = numpy.array([row[3] for row in group_rows], dtype = float)
+        stats = numpy.array([row[4] for row in group_rows], dtype = float)
+        if rank_by == "<":
+            stats = -stats
+        valid, = numpy.nonzero( ~(numpy.isnan(times) | numpy.isnan(stats)) )
+        times = times[valid]
+        stats = stats[valid]
+        # the range of triggers in the window of each trigger. the
+        # window includes the trigger itself, so a trigger loses if the
+        # best stat in its window is better than its own
+        lo = times.searchsorted( times - window, side = 'right' )
+        hi = times.searchsorted( times + window, side = 'right' )
+        for i in valid[range_max( stats, lo, hi ) > stats]:
+            losers.append( (group_rows[i][5], group_rows[i][0]) )
+    return losers
+
+
 # =============================================================================
 #
 #                       CoincDefiner Utilities
@@ -2327,7 +3285,7 @@ def create_mapped_tables_func(connection, nargs = 1):
     """
     connection.create_aggregate( 'get_mapped_tables', nargs, get_mapped_tables)
     
-def clean_mapped_event_tables( connection, tableList, raise_err_on_missing_evid = False, verbose = False ):
+def clean_mapped_event_tables( connection, tableList, raise_err_on_missing_evid = False, verbose = False, dry_run = False, planner = None ):
     """
     Cleans tables given in tableList of events whose event_ids aren't in
     the coinc_event_map table.
@@ -2337,6 +3295,11 @@ def clean_mapped_event_tables( connection, tableList, raise_err_on_missing_evid
     @raise_err_on_missing_evid: if set to True, will raise an error
      if an event_id column can't be found in any table in tableList.
      If False, will just skip the table.
+    @dry_run: if True, print the query plans of the deletes rather than
+     carrying them out; see DeletionPlanner.
+    @planner: a DeletionPlanner to carry out the deletes with; if given,
+     dry_run is ignored and the caller is responsible for calling its
+     finish method.
     """
     # get tables from tableList that have event_id columns
     selected_tables = [ table for table in tableList
@@ -2346,16 +3309,16 @@ def clean_mapped_event_tables( connection, tableList, raise_err_on_missing_evid
             table for table in tableList if table not in selected_tables ])
     
     # clean the tables
-    for table in selected_tables:
-        if verbose:
-            print >> sys.stderr, "Cleaning the %s table..." % table
-        sqlquery = ''.join([ """ 
-            DELETE
-            FROM """, table, """
-            WHERE event_id NOT IN (
-                SELECT event_id
-                FROM coinc_event_map )""" ])
-        connection.cursor().execute( sqlquery )
+    def clean_tables( planner ):
+        for table in selected_tables:
+            if verbose:
+                print >> sys.stderr, "Cleaning the %s table..." % table
+            planner.delete_where_not_in( table, 'event_id', 'coinc_event_map', 'event_id' )
+    if planner is None:
+        with DeletionPlanner(connection, dry_run = dry_run, verbose = verbose) as planner:
+            clean_tables( planner )
+    else:
+        clean_tables( planner )
     connection.commit()
 
 
@@ -2591,6 +3554,12 @@ class segdict_from_segment:
     """
     Class to a build a segmentlist dict out of the entries in the segment
     and segment_definer table in the sqlite database.
+
+    Membership is tested against a sorted array of the boundaries of each
+    instrument's coalesced segments, in integer nanoseconds: a time is in
+    the segments if the number of boundaries at or before it is odd. This
+    is O(log n) per time, and avoids building a LIGOTimeGPS for every time
+    tested.
     """
     from glue import segments
     try:
@@ -2599,8 +3568,6 @@ class segdict_from_segment:
         # s6 code
         from pylal.xlal.date import LIGOTimeGPS
 
-    snglinst_segdict = segments.segmentlistdict()
-
     def __init__(self, connection, filter = ''):
         if filter != '' and not filter.strip().startswith('WHERE'):
             filter = 'WHERE\n' + filter
@@ -2616,17 +3583,46 @@ class segdict_from_segment:
                 segment_definer ON
                 segment_definer.segment_def_id == segment.segment_def_id""",
             filter ])
+        self.snglinst_segdict = self.segments.segmentlistdict()
         for ifos, start_time, end_time in connection.cursor().execute(sqlquery):
             for ifo in lsctables.instrument_set_from_ifos(ifos):
-               if ifo not in self.snglinst_segdict:
-                self.snglinst_segdict[ifo] = segments.segmentlist()
-                self.snglinst_segdict[ifo].append( segments.segment(LIGOTimeGPS(start_time, 0),LIGOTimeGPS(end_time,0)) )
+                if ifo not in self.snglinst_segdict:
+                    self.snglinst_segdict[ifo] = self.segments.segmentlist()
+                self.snglinst_segdict[ifo].append( self.segments.segment(self.LIGOTimeGPS(start_time, 0), self.LIGOTimeGPS(end_time, 0)) )
+        self.snglinst_segdict.coalesce()
+
+        # the boundaries of each instrument's segments, in ns
+        self.boundaries = {}
+        self.boundary_arrays = {}
+        for ifo, seglist in self.snglinst_segdict.items():
+            self.boundaries[ifo] = [ int(t.ns()) for seg in seglist for t in seg ]
+            self.boundary_arrays[ifo] = numpy.array(self.boundaries[ifo], dtype = numpy.int64)
 
     def is_in_sngl_segdict( self, instrument, gpstime, gpstime_ns ):
         """
         Checks if a gpstime is in the given instrument time.
         """
-        return LIGOTimeGPS(gpstime, gpstime_ns) in self.snglinst_segdict[instrument]
+        return bisect.bisect_right(self.boundaries[instrument], gpstime * 1000000000 + gpstime_ns) % 2 == 1
+
+    def are_in_sngl_segdict( self, instruments, gpstimes, gpstimes_ns ):
+        """
+        Checks if each of many gpstimes is in the given instrument's time.
+        Returns a boolean array.
+
+        @instruments: the instrument to check against, or an array of them,
+         one for each gpstime
+        @gpstimes: array of the integer seconds of the gpstimes
+        @gpstimes_ns: array of the integer nanoseconds of the gpstimes
+        """
+        times = numpy.asarray(gpstimes, dtype = numpy.int64) * 1000000000 + numpy.asarray(gpstimes_ns, dtype = numpy.int64)
+        if isinstance(instruments, basestring):
+            return numpy.searchsorted(self.boundary_arrays[instruments], times, side = 'right') % 2 == 1
+        instruments = numpy.asarray(instruments)
+        result = numpy.zeros(times.shape, dtype = bool)
+        for instrument in numpy.unique(instruments):
+            mask = instruments == instrument
+            result[mask] = numpy.searchsorted(self.boundary_arrays[instrument], times[mask], side = 'right') % 2 == 1
+        return result
         
 
 def simplify_segments_tbls(connection, verbose=False, debug=False):
@@ -3024,3 +4020,368 @@ def simplify_vetodef_tbl(connection, verbose=False, debug=False):
         if verbose:
             print >> sys.stdout, "This database lacks a veto_definer table."
 
+
+
+# =============================================================================
+#
+#                          Combined Simplification
+#
+# =============================================================================
+
+# The simplify_* functions above each find and remove one kind of duplicate
+# with its own queries.  simplify_database does the same work in one pass.
+
+# Maps each id column to the type of id it holds and gives the table in
+# which ids of each type are defined.
+simplify_id_columns = {
+    'process_id': 'process_id',
+    'sim_proc_id': 'process_id',
+    'time_slide_id': 'time_slide_id',
+    'coinc_def_id': 'coinc_def_id',
+    'experiment_id': 'experiment_id',
+    'experiment_summ_id': 'experiment_summ_id'
+    }
+simplify_id_tables = {
+    'process_id': 'process',
+    'time_slide_id': 'time_slide',
+    'coinc_def_id': 'coinc_definer',
+    'experiment_id': 'experiment',
+    'experiment_summ_id': 'experiment_summary'
+    }
+
+# Tables whose rows are written by, and describe, a single process.  When a
+# process is a duplicate of another one its rows in these tables duplicate
+# those of the process that is kept, so they are deleted rather than remapped.
+process_owned_table_names = ['process_params', 'filter', 'summ_value',
+    'search_summary', 'search_summvars', 'sim_inspiral', 'sim_ringdown',
+    'veto_definer'] + segment_table_names
+
+
+def duplicate_id_map( keys ):
+    """
+    Given a dictionary mapping ids to a hashable description of the content
+    they identify, returns a dictionary mapping each id whose content is the
+    same as that of a smaller id to the smallest such id.  Ids that are kept
+    are not in the returned map.
+
+    @keys: dictionary of id -> content key
+    """
+    kept = {}
+    for this_id, key in keys.iteritems():
+        if key not in kept or this_id < kept[key]:
+            kept[key] = this_id
+    return dict([ (this_id, kept[key]) for this_id, key in keys.iteritems()
+        if kept[key] != this_id ])
+
+
+def _select_existing( cursor, table_name, column_names, table_columns ):
+    """
+    Selects the given columns from a table, substituting NULL for those
+    columns the table lacks.
+    """
+    sqlquery = 'SELECT %s FROM %s' % (', '.join([ col in table_columns and col
+        or 'NULL' for col in column_names ]), table_name)
+    return cursor.execute(sqlquery)
+
+
+def _process_keys( cursor, all_tables, columns ):
+    """
+    Returns a dictionary mapping each process_id to a description of the
+    process.  Processes are described by their program, process_params,
+    start and end times, username, node and version, as in get_process_info,
+    except those that wrote segments, which are described by the segments
+    they wrote (as in simplify_segments_tbls), and those that wrote a
+    veto_definer table, which are described by their program, version,
+    username, ifos, cvs information and comment (as in simplify_vetodef_tbl).
+    """
+    params = {}
+    if 'process_params' in all_tables:
+        for pid, param, value in cursor.execute(
+                'SELECT process_id, param, value FROM process_params'):
+            params.setdefault(pid, []).append((param, value))
+
+    keys = {}
+    veto_info = {}
+    for row in _select_existing(cursor, 'process', ['process_id', 'program',
+            'start_time', 'end_time', 'username', 'node', 'version', 'ifos',
+            'cvs_entry_time', 'cvs_repository', 'comment'], columns['process']):
+        pid = row[0]
+        keys[pid] = ('process', row[1:7], tuple(sorted(params.get(pid, []))))
+        veto_info[pid] = ('veto_definer', row[1], row[6], row[4]) + row[7:]
+
+    if 'veto_definer' in all_tables:
+        for (pid,) in cursor.execute(
+                'SELECT DISTINCT process_id FROM veto_definer'):
+            if pid in keys:
+                keys[pid] = veto_info[pid]
+
+    if not set(segment_table_names) - all_tables:
+        times = ['start_time', 'start_time_ns', 'end_time', 'end_time_ns']
+        segments = {}
+        for row in _select_existing(cursor, 'segment', ['segment_def_id']
+                + times, columns['segment']):
+            segments.setdefault(row[0], []).append(row[1:])
+        summaries = {}
+        for row in _select_existing(cursor, 'segment_summary',
+                ['segment_def_id'] + times, columns['segment_summary']):
+            summaries.setdefault(row[0], []).append(row[1:])
+        definers = {}
+        for sdid, pid, ifos, name, version in _select_existing(cursor,
+                'segment_definer', ['segment_def_id', 'process_id', 'ifos',
+                'name', 'version'], columns['segment_definer']):
+            definers.setdefault(pid, []).append((ifos, name, version,
+                tuple(sorted(summaries.get(sdid, []))),
+                tuple(sorted(segments.get(sdid, [])))))
+        for pid, definer_info in definers.iteritems():
+            if pid in keys:
+                keys[pid] = ('segment_definer', tuple(sorted(definer_info)))
+
+    return keys
+
+
+def simplify_database( connection, verbose = False, debug = False ):
+    """
+    Removes the duplicate metadata from a database made by merging the
+    outputs of many jobs, doing in a single pass the work of
+    get_process_info, simplify_summ_tbls, update_pid_in_snglstbls,
+    simplify_proc_tbls, simplify_sim_tbls, simplify_segments_tbls,
+    simplify_vetodef_tbl, simplify_timeslide_tbl, simplify_coincdef_tbl,
+    simplify_expr_tbl and simplify_exprsumm_tbl.
+
+    Each metadata table is read once and its rows are keyed by their content,
+    with the ids they refer to already remapped, so the maps from discarded
+    ids to kept ids are all built in memory.  As in the simplify_* functions,
+    the smallest id of a group of duplicates is kept, and the durations and
+    nevents of duplicate experiment_summary rows are summed.  All deletes and
+    id updates are then applied in one transaction and only touch the rows
+    that change, so indices need not be dropped first.
+
+    Rows of a duplicate process in the process_owned_table_names tables are
+    deleted; references to a discarded id in any other table are updated to
+    the id that is kept.
+
+    @connection: connection to the database
+    Returns a dictionary giving the number of ids discarded for each id type.
+    """
+    if verbose:
+        print >> sys.stdout, "\nSimplifying the database..."
+
+    all_tables = set([ name for (name,) in get_tables_in_database(connection) ])
+    columns = dict([ (table_name, get_column_names_from_table(connection,
+        table_name)) for table_name in all_tables ])
+    cursor = connection.cursor()
+    idmaps = {}
+
+    def remap( id_type, this_id ):
+        return idmaps.get(id_type, {}).get(this_id, this_id)
+
+    #
+    #   Build the maps of old ids to new ids, in the order in which ids
+    #   refer to one another
+    #
+
+    if 'process' in all_tables:
+        idmaps['process_id'] = duplicate_id_map(_process_keys(cursor,
+            all_tables, columns))
+
+    if 'time_slide' in all_tables:
+        offsets = {}
+        for tsid, instrument, offset in cursor.execute(
+                'SELECT time_slide_id, instrument, offset FROM time_slide'):
+            offsets.setdefault(tsid, []).append((instrument, offset))
+        idmaps['time_slide_id'] = duplicate_id_map(dict([ (tsid,
+            tuple(sorted(offset_list))) for tsid, offset_list in
+            offsets.iteritems() ]))
+
+    if 'coinc_definer' in all_tables:
+        idmaps['coinc_def_id'] = duplicate_id_map(dict([ (row[0], row[1:])
+            for row in cursor.execute('SELECT coinc_def_id, search, '
+            'search_coinc_type, description FROM coinc_definer') ]))
+
+    if 'experiment' in all_tables:
+        idmaps['experiment_id'] = duplicate_id_map(dict([ (row[0], row[1:])
+            for row in _select_existing(cursor, 'experiment', ['experiment_id',
+            'search', 'search_group', 'instruments', 'gps_start_time',
+            'gps_end_time', 'lars_id', 'comments'], columns['experiment']) ]))
+
+    summed_rows = []
+    if 'experiment_summary' in all_tables:
+        keys = {}
+        totals = {}
+        for esid, eid, tsid, veto_def_name, datatype, sim_proc_id, duration, \
+                nevents in _select_existing(cursor, 'experiment_summary',
+                ['experiment_summ_id', 'experiment_id', 'time_slide_id',
+                'veto_def_name', 'datatype', 'sim_proc_id', 'duration',
+                'nevents'], columns['experiment_summary']):
+            keys[esid] = (remap('experiment_id', eid),
+                remap('time_slide_id', tsid), veto_def_name, datatype,
+                remap('process_id', sim_proc_id))
+            totals[esid] = (duration, nevents)
+        esidmap = idmaps['experiment_summ_id'] = duplicate_id_map(keys)
+        # sum the durations and nevents of each kept row's duplicates, leaving
+        # the sum NULL if all the values are, as SQL's SUM does
+        groups = {}
+        for old_esid, new_esid in esidmap.iteritems():
+            groups.setdefault(new_esid, [new_esid]).append(old_esid)
+        for new_esid, esids in groups.iteritems():
+            sums = []
+            for values in zip(*[ totals[esid] for esid in esids ]):
+                values = [ value for value in values if value is not None ]
+                sums.append(sum(values) if values else None)
+            summed_rows.append((sums[0], sums[1], new_esid))
+
+    if verbose:
+        for id_type in sorted(idmaps):
+            print >> sys.stdout, "Found %d duplicate %s(s)" % \
+                (len(idmaps[id_type]), id_type)
+
+    # the background saved by Summaries.save_bkg_stats describes the
+    # experiments and slides as they were; once they are combined it no
+    # longer does, so it is dropped, to be recalculated from scratch
+    if Summaries.bkg_stats_table in all_tables and (idmaps.get('experiment_id')
+            or idmaps.get('experiment_summ_id')):
+        if verbose:
+            print >> sys.stdout, "Dropping the saved background in %s" % \
+                Summaries.bkg_stats_table
+        cursor.execute('DROP TABLE %s' % Summaries.bkg_stats_table)
+        all_tables.discard(Summaries.bkg_stats_table)
+
+    #
+    #   Apply the maps
+    #
+
+    # build the statements; deletes go first so that no row is updated only
+    # to then be deleted
+    deletes = []
+    updates = []
+    for table_name in sorted(all_tables):
+        for column_name in columns[table_name]:
+            id_type = simplify_id_columns.get(column_name)
+            if not idmaps.get(id_type):
+                continue
+            validate_option(table_name)
+            if table_name == simplify_id_tables[id_type] or (
+                    column_name == 'process_id'
+                    and table_name in process_owned_table_names):
+                deletes.append(("""
+                    DELETE FROM %s
+                    WHERE %s IN (
+                        SELECT old_id
+                        FROM _simplify_idmap_
+                        WHERE id_type == ? )""" % (table_name, column_name),
+                    (id_type,)))
+            else:
+                updates.append(("""
+                    UPDATE %s
+                    SET %s = (
+                        SELECT new_id
+                        FROM _simplify_idmap_
+                        WHERE id_type == ? AND old_id == %s.%s )
+                    WHERE %s IN (
+                        SELECT old_id
+                        FROM _simplify_idmap_
+                        WHERE id_type == ? )""" % (table_name, column_name,
+                    table_name, column_name, column_name), (id_type, id_type)))
+
+    discarded = dict([ (idmap_type, len(idmap)) for idmap_type, idmap in
+        idmaps.iteritems() ])
+    if not deletes and not updates:
+        if verbose:
+            print >> sys.stdout, "The database lacks duplicates."
+        cursor.close()
+        return discarded
+
+    # the ids are stored as they are in the database, so the map's columns are
+    # given no type affinity
+    cursor.execute('CREATE TEMP TABLE _simplify_idmap_ (id_type, old_id, new_id, PRIMARY KEY (id_type, old_id))')
+    cursor.executemany('INSERT INTO _simplify_idmap_ VALUES (?, ?, ?)',
+        [ (idmap_type, old_id, new_id) for idmap_type, idmap in
+        idmaps.iteritems() for old_id, new_id in idmap.iteritems() ])
+    if debug:
+        print >> sys.stderr, "SQL start time: %s" % str(time.localtime()[3:6])
+    for sqlquery, params in deletes + updates:
+        if debug:
+            print >> sys.stderr, sqlquery
+        cursor.execute(sqlquery, params)
+    if summed_rows and 'duration' in columns['experiment_summary'] \
+            and 'nevents' in columns['experiment_summary']:
+        cursor.executemany('UPDATE experiment_summary SET duration = ?, nevents = ? WHERE experiment_summ_id == ?', summed_rows)
+    connection.commit()
+    if debug:
+        print >> sys.stderr, "SQL end time:   %s" % str(time.localtime()[3:6])
+
+    cursor.execute('DROP TABLE _simplify_idmap_')
+    cursor.close()
+
+    return discarded
+
+
+# =============================================================================
+#
+#                             Merging Databases
+#
+# =============================================================================
+
+def insert_from_database( connection, filename, verbose = False ):
+    """
+    Inserts the contents of the database in filename into the database at
+    connection. The ids of the inserted rows are reassigned so that they do
+    not collide with those already in the database, as ligolw_sqlite does when
+    inserting a LIGO_LW XML document.
+    """
+    if verbose:
+        print >> sys.stderr, "Inserting %s..." % filename
+    source = sqlite3.connect(filename)
+    try:
+        # the saved background's ids are not known to ligolw_sqlite, so
+        # would not be remapped; see merge_databases
+        source_xmldoc = dbtables.get_xml(source, [table_name for table_name in
+            dbtables.get_table_names(source) if table_name != Summaries.bkg_stats_table])
+        ligolw_sqlite.insert_from_xmldoc(connection, source_xmldoc, verbose = verbose)
+        source_xmldoc.unlink()
+    finally:
+        source.close()
+
+
+def merge_databases( filename, input_filenames, tmp_path = None, simplify = True, verbose = False ):
+    """
+    Merges the databases and LIGO_LW XML documents in input_filenames into the
+    database in filename, which is created if it does not exist, then, if
+    simplify is True, removes the duplicate metadata from it with
+    simplify_database. Any background saved by Summaries.save_bkg_stats is
+    dropped. The connection to filename is closed when done, so the
+    file can be moved or merged into another. This is the unit of work of the
+    parallel merge done by ligolw_cbc_merge_dbs, and is safe to run in a
+    worker process. Returns filename.
+
+    @filename: the database to merge into; this is treated as a scratch
+     database, so should be a working file
+    @input_filenames: list of the files to merge; files ending in '.sqlite' or
+     '.sql' are read as databases, anything else as LIGO_LW XML documents
+    @tmp_path: where to put SQLite's temporary files
+    """
+    connection = get_connection(filename, scratch = True, tmp_path = tmp_path, verbose = verbose)
+
+    class ContentHandler(ligolw.LIGOLWContentHandler):
+        pass
+    dbtables.use_in(ContentHandler)
+    ContentHandler.connection = connection
+
+    for input_filename in input_filenames:
+        if input_filename.endswith('.sqlite') or input_filename.endswith('.sql'):
+            insert_from_database(connection, input_filename, verbose = verbose)
+        else:
+            ligolw_sqlite.insert_from_url(input_filename, contenthandler = ContentHandler, verbose = verbose)
+
+    # the background saved by Summaries.save_bkg_stats only describes the
+    # triggers of the database it was saved in, so is not merged; without
+    # it, Summaries.update_fars_incrementally recalculates all the fars of
+    # the merged database
+    if input_filenames:
+        connection.cursor().execute('DROP TABLE IF EXISTS %s' % Summaries.bkg_stats_table)
+
+    if simplify:
+        simplify_database(connection, verbose = verbose)
+
+    close_connection(filename)
+    return filename
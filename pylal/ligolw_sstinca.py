@@ -38,6 +38,7 @@ from glue.ligolw.utils import process as ligolw_process
 from glue.ligolw.utils import segments as ligolw_segments
 from glue.ligolw.utils import search_summary as ligolw_search_summary
 from glue import offsetvector
+from pylal import coinc_cache as ligolw_coinc_cache
 from pylal import git_version
 from pylal import snglcoinc
 from pylal.xlal import tools as xlaltools
@@ -546,8 +547,18 @@ def ligolw_thinca(
 	likelihood_func = None,
 	likelihood_params_func = None,
 	verbose = False,
-	max_dt_func = None
+	max_dt_func = None,
+	coinc_cache = None
 ):
+	"""
+	Run the inspiral coincidence engine on xmldoc.
+
+	If coinc_cache is not None it should be a
+	pylal.coinc_cache.CoincCache instance.  If the cache holds the
+	results of a previous run on identical inputs, those results are
+	inserted into the document and the coincidence analysis is
+	skipped, otherwise the results of this run are added to the cache.
+	"""
 	if not max_dt_func:
 		err_msg = "Must supply max_dt_func keyword argument to "
 		err_msg += "ligolw_thinca function."
@@ -574,6 +585,19 @@ def ligolw_thinca(
 	)
 	sngl_index = dict((row.event_id, row) for row in lsctables.table.get_table(xmldoc, lsctables.SnglInspiralTable.tableName))
 
+	#
+	# if the results of an identical run are in the cache, use them
+	#
+
+	if coinc_cache is not None:
+		cache_key = ligolw_coinc_cache.coinc_cache_key(xmldoc, thresholds, seglists = coinc_tables.seglists, veto_segments = veto_segments, event_comparefunc = event_comparefunc, ntuple_comparefunc = ntuple_comparefunc, likelihood_func = likelihood_func, likelihood_params_func = likelihood_params_func, magic_number = magic_number, weighted_snr = SnglInspiral.get_weighted_snr, max_dt_func = max_dt_func)
+		coincs = coinc_cache.get(cache_key)
+		if coincs is not None:
+			n = ligolw_coinc_cache.insert_coincs(coinc_tables, process_id, coinc_def_id, coincs)
+			if verbose:
+				print >>sys.stderr, "retrieved %d coincs from cache" % n
+			return xmldoc
+
 	#
 	# build the event list accessors, populated with events from those
 	# processes that can participate in a coincidence.  apply vetoes by
@@ -630,6 +654,13 @@ def ligolw_thinca(
 
         del eventlists.offsetvector
 
+	#
+	# save the results in the cache
+	#
+
+	if coinc_cache is not None:
+		coinc_cache.put(cache_key, ligolw_coinc_cache.extract_coincs(xmldoc, process_id, coinc_def_id))
+
 	#
 	# done
 	#
@@ -26,16 +26,19 @@
 
 import bisect
 import math
+import multiprocessing
 import sys
 
 
 from glue import iterutils
 from glue.ligolw import ligolw
 from glue.ligolw import lsctables
+from glue.ligolw import utils as ligolw_utils
 from glue.ligolw.utils import search_summary as ligolw_search_summary
 from glue.ligolw.utils import coincs as ligolw_coincs
 from glue import offsetvector
 import lal
+from pylal import coinc_cache as ligolw_coinc_cache
 from pylal import git_version
 from pylal import snglcoinc
 from pylal.xlal import tools as xlaltools
@@ -406,8 +409,18 @@ def ligolw_thinca(
 	likelihood_func = None,
 	likelihood_params_func = None,
 	verbose = False,
-	max_dt = None
+	max_dt = None,
+	coinc_cache = None
 ):
+	"""
+	Run the inspiral coincidence engine on xmldoc.
+
+	If coinc_cache is not None it should be a
+	pylal.coinc_cache.CoincCache instance.  If the cache holds the
+	results of a previous run on identical inputs, those results are
+	inserted into the document and the coincidence analysis is
+	skipped, otherwise the results of this run are added to the cache.
+	"""
 	#
 	# prepare the coincidence table interface.
 	#
@@ -418,6 +431,19 @@ def ligolw_thinca(
 	coinc_def_id = ligolw_coincs.get_coinc_def_id(xmldoc, coinc_definer_row.search, coinc_definer_row.search_coinc_type, create_new = True, description = coinc_definer_row.description)
 	sngl_index = dict((row.event_id, row) for row in lsctables.SnglInspiralTable.get_table(xmldoc))
 
+	#
+	# if the results of an identical run are in the cache, use them
+	#
+
+	if coinc_cache is not None:
+		cache_key = ligolw_coinc_cache.coinc_cache_key(xmldoc, thresholds, seglists = coinc_tables.seglists, veto_segments = veto_segments, event_comparefunc = event_comparefunc, ntuple_comparefunc = ntuple_comparefunc, likelihood_func = likelihood_func, likelihood_params_func = likelihood_params_func, effective_snr_factor = effective_snr_factor, max_dt = max_dt)
+		coincs = coinc_cache.get(cache_key)
+		if coincs is not None:
+			n = ligolw_coinc_cache.insert_coincs(coinc_tables, process_id, coinc_def_id, coincs)
+			if verbose:
+				print >>sys.stderr, "retrieved %d coincs from cache" % n
+			return xmldoc
+
 	#
 	# build the event list accessors, populated with events from those
 	# processes that can participate in a coincidence.  apply vetoes by
@@ -469,6 +495,13 @@ def ligolw_thinca(
 
 	del eventlists.offsetvector
 
+	#
+	# save the results in the cache
+	#
+
+	if coinc_cache is not None:
+		coinc_cache.put(cache_key, ligolw_coinc_cache.extract_coincs(xmldoc, process_id, coinc_def_id))
+
 	#
 	# done
 	#
@@ -590,6 +623,21 @@ class sngl_inspiral_coincs(object):
 			except KeyError:
 				continue
 
+		#
+		# pre-compute, for each coinc, the sngl_inspiral rows and
+		# the IDs of the processes whose metadata must accompany
+		# it, so that extracting a coinc costs time proportional
+		# to the size of the coinc and not of the source document
+		#
+
+		self.sngl_inspirals_index = dict((coinc_event_id, [self.sngl_inspiral_index[row.event_id] for row in rows]) for coinc_event_id, rows in self.coinc_event_map_index.items())
+		self.process_ids_index = {}
+		for coinc_event_id, coinc_event in self.coinc_event_index.items():
+			process_ids = set(row.process_id for row in self.sngl_inspirals_index[coinc_event_id])
+			process_ids.add(coinc_event.process_id)
+			process_ids.update(row.process_id for row in self.time_slide_index[coinc_event.time_slide_id])
+			self.process_ids_index[coinc_event_id] = process_ids
+
 	@property
 	def coinc_def_id(self):
 		"""
@@ -603,7 +651,7 @@ class sngl_inspiral_coincs(object):
 		Return a list of the sngl_inspiral rows that participated
 		in the coincidence given by coinc_event_id.
 		"""
-		return [self.sngl_inspiral_index[row.event_id] for row in self.coinc_event_map_index[coinc_event_id]]
+		return list(self.sngl_inspirals_index[coinc_event_id])
 
 	def offset_vector(self, time_slide_id):
 		"""
@@ -639,10 +687,9 @@ class sngl_inspiral_coincs(object):
 		new_coinc_inspiral_table.append(self.coinc_inspiral_index[coinc_event_id])
 		map(new_coinc_event_map_table.append, self.coinc_event_map_index[coinc_event_id])
 		map(new_time_slide_table.append, self.time_slide_index[coinc_event.time_slide_id])
-		for row in new_coinc_event_map_table:
-			new_sngl_inspiral_table.append(self.sngl_inspiral_index[row.event_id])
+		map(new_sngl_inspiral_table.append, self.sngl_inspirals_index[coinc_event_id])
 
-		for process_id in set(new_sngl_inspiral_table.getColumnByName("process_id")) | set(new_coinc_event_table.getColumnByName("process_id")) | set(new_time_slide_table.getColumnByName("process_id")):
+		for process_id in self.process_ids_index[coinc_event_id]:
 			# process row is required
 			new_process_table.append(self.process_index[process_id])
 			try:
@@ -690,3 +737,66 @@ class sngl_inspiral_coincs(object):
 			yield (coinc_event_id, self[coinc_event_id])
 
 	iteritems = items
+
+	def write_documents(self, coinc_event_ids, filename_func, nproc = 1, verbose = False):
+		"""
+		Write one XML document per coinc to disk.  coinc_event_ids
+		is a sequence of the coinc_event_id's of the coincs to
+		write, and filename_func is a function that is passed a
+		coinc_event_id and returns the name of the file to which
+		that coinc's document should be written.  Files whose
+		names end in ".gz" are gzip-compressed.  Returns a list of
+		the names of the files written, in the order of
+		coinc_event_ids.
+
+		If nproc is greater than 1, the documents are constructed
+		and written by that many forked worker processes.  This
+		relies on the workers inheriting this object from the
+		parent process, and so the source document is not copied
+		or pickled.
+		"""
+		jobs = [(coinc_event_id, filename_func(coinc_event_id)) for coinc_event_id in coinc_event_ids]
+		if nproc <= 1 or len(jobs) < 2:
+			for n in xrange(len(jobs)):
+				_write_coinc_document(n, jobs = jobs, coincs = self, verbose = verbose)
+		else:
+			global _bulk_export_state
+			_bulk_export_state = (self, jobs, verbose)
+			pool = multiprocessing.Pool(min(nproc, len(jobs)))
+			try:
+				# force any exceptions raised in the workers
+				# to be raised here
+				for n in pool.imap_unordered(_write_coinc_document, xrange(len(jobs)), chunksize = max(1, len(jobs) // (4 * nproc))):
+					pass
+				pool.close()
+			except:
+				pool.terminate()
+				raise
+			finally:
+				pool.join()
+				_bulk_export_state = None
+		return [filename for coinc_event_id, filename in jobs]
+
+
+#
+# state inherited by the forked worker processes of
+# sngl_inspiral_coincs.write_documents()
+#
+
+
+_bulk_export_state = None
+
+
+def _write_coinc_document(n, jobs = None, coincs = None, verbose = False):
+	"""
+	Construct and write the document for the n-th job in the job list.
+	When called in a worker process the sngl_inspiral_coincs instance
+	and job list are retrieved from _bulk_export_state.
+	"""
+	if jobs is None:
+		coincs, jobs, verbose = _bulk_export_state
+	coinc_event_id, filename = jobs[n]
+	xmldoc = coincs[coinc_event_id]
+	ligolw_utils.write_filename(xmldoc, filename, gz = (filename or "stdout").endswith(".gz"), verbose = verbose)
+	xmldoc.unlink()
+	return n
@@ -393,7 +393,10 @@ def printsims(connection, simulation_table, recovery_table, map_label, ranking_s
     rank_filter = '\n\t'.join([ sqlutils.join_experiment_tables_to_coinc_table(recovery_table), 'WHERE', rank_filter ])
     
     ranker.populate_stats_list(connection, limit = None, filter = rank_filter)
-    connection.create_function( 'rank', 1, ranker.get_rank )
+    # rank the recovered injections all at once
+    ranker.write_ranks(connection, 'rank', filter = ''.join([
+            'JOIN sim_rec_map ON (sim_rec_map.rec_id == ', recovery_table, '.coinc_event_id)']),
+        temp_table = 'sim_rec_ranks', verbose = verbose)
     
     #
     #   Set recovery table filters
@@ -610,7 +613,7 @@ def printsims(connection, simulation_table, recovery_table, map_label, ranking_s
             """, simulation_table, """.*,
             """, recovery_table, """.*,
             get_sim_tag(experiment_summary.sim_proc_id),
-            rank(sim_rec_map.ranking_stat),
+            sim_rec_ranks.rank,
             NULL AS match_rank,
             experiment.instruments,
             convert_duration(experiment_summary.duration),
@@ -618,9 +621,10 @@ def printsims(connection, simulation_table, recovery_table, map_label, ranking_s
         FROM
             sim_rec_map
         JOIN
-            """, ', '.join([simulation_table, recovery_table]), """, experiment, experiment_summary, experiment_map ON (
+            """, ', '.join([simulation_table, recovery_table]), """, sim_rec_ranks, experiment, experiment_summary, experiment_map ON (
             sim_rec_map.sim_id == """, simulation_table, """.simulation_id AND
             sim_rec_map.rec_id == """, recovery_table, """.coinc_event_id AND
+            sim_rec_map.rec_id == sim_rec_ranks.coinc_event_id AND
             sim_rec_map.rec_id == experiment_map.coinc_event_id AND
             experiment_map.experiment_summ_id == experiment_summary.experiment_summ_id AND
             experiment_summary.experiment_id == experiment.experiment_id)
@@ -711,8 +715,9 @@ def printsims(connection, simulation_table, recovery_table, map_label, ranking_s
                 and row.coinc_event_id != sfrow.coinc_event_id],
                 key = lambda row: row.recovered_match_rank))
     
-    # drop the sim_rec_map table
+    # drop the sim_rec_map and sim_rec_ranks tables
     connection.cursor().execute("DROP TABLE sim_rec_map")
+    connection.cursor().execute("DROP TABLE sim_rec_ranks")
     
     return sftable
 
@@ -725,7 +730,6 @@ def printmissed(connection, simulation_table, recovery_table, map_label, livetim
     from pylal import ligolw_sqlutils as sqlutils
     from pylal import ligolw_cbc_compute_durations as compute_dur
     from glue import segments
-    from glue.ligolw import dbtables
 
     # Get simulation/recovery tables
     simulation_table = sqlutils.validate_option(simulation_table)
@@ -834,7 +838,7 @@ def printmissed(connection, simulation_table, recovery_table, map_label, livetim
     if verbose:
         print >> sys.stderr, "Getting all veto category names from the experiment_summary table..."
 
-    xmldoc = dbtables.get_xml(connection)
+    xmldoc = sqlutils.DBTableAccessor(connection).get_xml(sqlutils.segment_table_names)
     # get veto_segments
     veto_segments = compute_dur.get_veto_segments(xmldoc, verbose)
 
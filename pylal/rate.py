@@ -43,7 +43,10 @@ except ImportError:
 	# be available
 	PosInf = float("+inf")
 	NegInf = float("-inf")
-import itertools
+import collections
+import functools
+import hashlib
+import json
 import math
 import numpy
 import random
@@ -52,13 +55,7 @@ numpyver = numpy.__version__.strip().split(".")[:3]
 scipyver = scipy.__version__.strip().split(".")[:3]
 __numpy__version__ = tuple(map(int, numpyver))
 __scipy__version__ = tuple(map(int, scipyver))
-if __scipy__version__ >= (0, 9) and __numpy__version__ >= (1, 7):
-	from scipy.interpolate import interp1d, interp2d, LinearNDInterpolator
-else:
-	# pre scipy/numpy 0.9/1.7 had busted/missing interpolation code.
-	# replacements are provided below
-	pass
-from scipy.signal import signaltools
+from scipy import ndimage
 
 
 from glue import iterutils
@@ -85,6 +82,19 @@ __date__ = git_version.date
 #
 
 
+def _masked_indices(indices, inrange):
+	"""
+	Construct the masked array of bin indices returned by the
+	.__getitem__() methods of the Bins classes when given an array of
+	co-ordinates.  indices is an integer array, inrange is a boolean
+	array that is False where the co-ordinate was not in the binning.
+	The masked elements of indices are set to 0.
+	"""
+	outofrange = ~inrange
+	indices[outofrange] = 0
+	return numpy.ma.MaskedArray(indices, mask = outofrange)
+
+
 class Bins(object):
 	"""
 	Parent class for 1-dimensional binnings.  This class is not
@@ -135,13 +145,40 @@ class Bins(object):
 		falls, and whose upper bound is 1 greater than the index of
 		the bin in which the slice's upper bound falls.  Steps are
 		not supported in slices.
+
+		The co-ordinate can also be a numpy array of values, in
+		which case a numpy.ma.MaskedArray of bin indices of the
+		same shape is returned.  Values that would cause IndexError
+		to be raised if converted one at a time are masked (their
+		indices are set to 0).  Masked indices must be removed
+		before the result is used to index an array, for example
+		with the .compressed() method or by selecting with
+		~numpy.ma.getmaskarray().
 		"""
 		if isinstance(x, slice):
 			if x.step is not None:
 				raise NotImplementedError("step not supported: %s" % repr(x))
 			return slice(self[x.start] if x.start is not None else 0, self[x.stop] + 1 if x.stop is not None else len(self))
+		if isinstance(x, numpy.ndarray):
+			return self._getitem_array(x)
 		raise NotImplementedError
 
+	def _getitem_array(self, x):
+		"""
+		Convert an array of co-ordinates to a masked array of bin
+		indices.  This implementation converts one co-ordinate at a
+		time, subclasses should override it with a vectorized
+		version.
+		"""
+		indices = numpy.zeros(x.shape, dtype = "intp")
+		inrange = numpy.ones(x.shape, dtype = "bool")
+		for i, value in numpy.ndenumerate(x):
+			try:
+				indices[i] = self[value]
+			except IndexError:
+				inrange[i] = False
+		return _masked_indices(indices, inrange)
+
 	def __iter__(self):
 		"""
 		If __iter__ does not exist, Python uses __getitem__ with
@@ -221,14 +258,31 @@ class Bins(object):
 			...
 		NotImplementedError: step not supported: slice(None, None, 2)
 		"""
+		# avoid symbol look-ups in the sampling loop
+		uniform = random.uniform
+		# determine boundaries and index range.  converting
+		# everything to tuples makes the sampling loop faster
+		l, u, ln_dx, lo, hi = self._randcoord_bounds(domain)
+		ln_dx = tuple(ln_dx)
+		l = tuple(l)
+		u = tuple(u)
+		# generate samples
+		for i, ln_Pi in iterutils.randindex(lo, hi, n = n):
+			yield uniform(l[i], u[i]), ln_Pi - ln_dx[i]
+
+	def _randcoord_bounds(self, domain):
+		"""
+		For internal use by .randcoord() and .randcoords().  Returns
+		the lower and upper boundaries of the bins, adjusted to the
+		domain, the natural logarithms of the bins' sizes, and the
+		range of indexes of the bins from which values can be
+		drawn.
+		"""
 		if len(self) < 1:
 			raise ValueError("empty binning")
 		if domain.step is not None:
 			raise NotImplementedError("step not supported: %s" % repr(domain))
-		# avoid symbol look-ups in the sampling loop
 		isinf = math.isinf
-		uniform = random.uniform
-		# determine boundaries and index range
 		l = self.lower()
 		u = self.upper()
 		lo, hi, _ = self[domain].indices(len(l))
@@ -245,17 +299,55 @@ class Bins(object):
 		if not lo < hi:
 			raise ValueError("slice too small")
 		# log() implicitly checks that the boundary adjustments
-		# above haven't made any bins <= 0 in size.  converting
-		# everything to tuples makes the sampling loop faster
-		ln_dx = tuple(numpy.log(u - l))
-		l = tuple(l)
-		u = tuple(u)
+		# above haven't made any bins <= 0 in size
+		ln_dx = numpy.log(u - l)
 		# one last safety check
-		if any(map(isinf, ln_dx[lo:hi])):
+		if numpy.isinf(ln_dx[lo:hi]).any():
 			raise ValueError("unavoidable infinite bin detected")
-		# generate samples
-		for i, ln_Pi in iterutils.randindex(lo, hi, n = n):
-			yield uniform(l[i], u[i]), ln_Pi - ln_dx[i]
+		return l, u, ln_dx, lo, hi
+
+	def randcoords(self, N, n = 1., domain = slice(None, None)):
+		"""
+		Draw N random co-ordinates in one call.  Returns a tuple of
+		two arrays:  the co-ordinates, and the natural logarithms
+		of the PDF from which they have been drawn evaluated at
+		each co-ordinate.  The distribution, and the meanings of n
+		and domain, are the same as for .randcoord().  The bin
+		indexes are drawn by inverse-CDF sampling, which is done
+		by numpy for all co-ordinates at once.
+
+		Example:
+
+		>>> x, lnP = LinearBins(0, 10, 5).randcoords(1000)
+		>>> x.shape, lnP.shape
+		((1000,), (1000,))
+		>>> bool(((0. <= x) & (x <= 10.)).all())
+		True
+		>>> lnP[0]
+		-2.3025850929940455
+		>>> x, lnP = ATanBins(-1, +1, 4).randcoords(1000, domain = slice(0.5, None))
+		>>> lnP[0]
+		1.9905535958518226
+		"""
+		if n <= 0.:
+			raise ValueError("n <= 0: %g" % n)
+		l, u, ln_dx, lo, hi = self._randcoord_bounds(domain)
+		# CDF evaluated at index boundaries.  see
+		# glue.iterutils.randindex()
+		cdf = numpy.arange(lo, hi + 1, dtype = "double")**n
+		cdf -= cdf[0]
+		cdf /= cdf[-1]
+		if n == 1.:
+			# uniform distribution.  avoid round-off noise
+			ln_P = numpy.repeat(math.log(1. / (hi - lo)), hi - lo)
+		else:
+			with numpy.errstate(divide = "ignore"):
+				ln_P = numpy.log(cdf[1:] - cdf[:-1])
+		# draw the bin indexes, skipping bins with 0 probability
+		i = (cdf.searchsorted(numpy.random.random_sample(N), side = "right") - 1).clip(0, hi - lo - 1)
+		ln_P = ln_P[i]
+		i += lo
+		return numpy.random.uniform(l[i], u[i]), ln_P - ln_dx[i]
 
 
 class IrregularBins(Bins):
@@ -278,6 +370,8 @@ class IrregularBins(Bins):
 	2
 	>>> x[4:17]
 	slice(0, 3, None)
+	>>> x[numpy.array([-1.0, 1.0, 13.0, 25.0])].filled(-1)
+	array([-1,  0,  1,  2])
 	>>> IrregularBins([0.0, 15.0, 11.0])
 	Traceback (most recent call last):
 		...
@@ -315,7 +409,7 @@ class IrregularBins(Bins):
 		return cmp(self.boundaries, other.boundaries)
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(IrregularBins, self).__getitem__(x)
 		if self.min <= x < self.max:
 			return bisect_right(self.boundaries, x) - 1
@@ -324,6 +418,14 @@ class IrregularBins(Bins):
 			return len(self.boundaries) - 2
 		raise IndexError(x)
 
+	def _getitem_array(self, x):
+		with numpy.errstate(invalid = "ignore"):
+			inrange = (self.min <= x) & (x < self.max)
+			atmax = x == self.max
+		indices = numpy.searchsorted(self.boundaries, x, side = "right") - 1
+		indices[atmax] = len(self.boundaries) - 2
+		return _masked_indices(indices, inrange | atmax)
+
 	def lower(self):
 		return numpy.array(self.boundaries[:-1])
 
@@ -371,13 +473,18 @@ class LinearBins(Bins):
 	slice(1, 3, None)
 	>>> x[10:]
 	slice(1, 3, None)
+	>>> i = x[numpy.array([1.0, 10.0, 25.0, 27.0])]
+	>>> i.filled(-1)
+	array([ 0,  1,  2, -1])
+	>>> i.mask
+	array([False, False, False,  True], dtype=bool)
 	"""
 	def __init__(self, min, max, n):
 		super(LinearBins, self).__init__(min, max, n)
 		self.delta = float(max - min) / n
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(LinearBins, self).__getitem__(x)
 		if self.min <= x < self.max:
 			return int(math.floor((x - self.min) / self.delta))
@@ -386,6 +493,16 @@ class LinearBins(Bins):
 			return len(self) - 1
 		raise IndexError(x)
 
+	def _getitem_array(self, x):
+		with numpy.errstate(invalid = "ignore"):
+			inrange = (self.min <= x) & (x < self.max)
+			atmax = x == self.max
+			indices = numpy.floor((x - self.min) / self.delta)
+		indices[~inrange] = 0
+		indices = indices.astype("intp")
+		indices[atmax] = len(self) - 1
+		return _masked_indices(indices, inrange | atmax)
+
 	def lower(self):
 		return numpy.linspace(self.min, self.max - self.delta, len(self))
 
@@ -433,6 +550,8 @@ class LinearPlusOverflowBins(Bins):
 	slice(0, 3, None)
 	>>> x[9:float("+inf")]
 	slice(2, 5, None)
+	>>> x[numpy.array([float("-inf"), 10.0, 100.0, float("nan")])].filled(-1)
+	array([ 0,  2,  4, -1])
 	"""
 	def __init__(self, min, max, n):
 		if n < 3:
@@ -441,7 +560,7 @@ class LinearPlusOverflowBins(Bins):
 		self.delta = float(max - min) / (n - 2)
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(LinearPlusOverflowBins, self).__getitem__(x)
 		if self.min <= x < self.max:
 			return int(math.floor((x - self.min) / self.delta)) + 1
@@ -453,6 +572,18 @@ class LinearPlusOverflowBins(Bins):
 			return 0
 		raise IndexError(x)
 
+	def _getitem_array(self, x):
+		with numpy.errstate(invalid = "ignore"):
+			inrange = (self.min <= x) & (x < self.max)
+			above = x >= self.max
+			below = x < self.min
+			indices = numpy.floor((x - self.min) / self.delta)
+		indices[~inrange] = 0
+		indices = indices.astype("intp") + 1
+		indices[above] = len(self) - 1
+		indices[below] = 0
+		return _masked_indices(indices, inrange | above | below)
+
 	def lower(self):
 		return numpy.concatenate((numpy.array([NegInf]), self.min + self.delta * numpy.arange(len(self) - 2), numpy.array([self.max])))
 
@@ -485,7 +616,7 @@ class LogarithmicBins(Bins):
 		self.delta = (math.log(max) - math.log(min)) / n
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(LogarithmicBins, self).__getitem__(x)
 		if self.min <= x < self.max:
 			return int(math.floor((math.log(x) - math.log(self.min)) / self.delta))
@@ -494,6 +625,16 @@ class LogarithmicBins(Bins):
 			return len(self) - 1
 		raise IndexError(x)
 
+	def _getitem_array(self, x):
+		with numpy.errstate(invalid = "ignore", divide = "ignore"):
+			inrange = (self.min <= x) & (x < self.max)
+			atmax = x == self.max
+			indices = numpy.floor((numpy.log(x) - math.log(self.min)) / self.delta)
+		indices[~inrange] = 0
+		indices = indices.astype("intp")
+		indices[atmax] = len(self) - 1
+		return _masked_indices(indices, inrange | atmax)
+
 	def lower(self):
 		return numpy.exp(numpy.linspace(math.log(self.min), math.log(self.max) - self.delta, len(self)))
 
@@ -543,7 +684,7 @@ class LogarithmicPlusOverflowBins(Bins):
 		self.delta = (math.log(max) - math.log(min)) / (n - 2)
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(LogarithmicPlusOverflowBins, self).__getitem__(x)
 		if self.min <= x < self.max:
 			return 1 + int(math.floor((math.log(x) - math.log(self.min)) / self.delta))
@@ -555,6 +696,18 @@ class LogarithmicPlusOverflowBins(Bins):
 			return 0
 		raise IndexError(x)
 
+	def _getitem_array(self, x):
+		with numpy.errstate(invalid = "ignore", divide = "ignore"):
+			inrange = (self.min <= x) & (x < self.max)
+			above = x >= self.max
+			below = x < self.min
+			indices = numpy.floor((numpy.log(x) - math.log(self.min)) / self.delta)
+		indices[~inrange] = 0
+		indices = indices.astype("intp") + 1
+		indices[above] = len(self) - 1
+		indices[below] = 0
+		return _masked_indices(indices, inrange | above | below)
+
 	def lower(self):
 		return numpy.concatenate((numpy.array([0.]), numpy.exp(numpy.linspace(math.log(self.min), math.log(self.max), len(self) - 1))))
 
@@ -584,6 +737,8 @@ class ATanBins(Bins):
 	5
 	>>> x[float("+inf")]
 	10
+	>>> x[numpy.array([float("-inf"), 0.0, float("+inf")])].filled(-1)
+	array([ 0,  5, 10])
 	>>> x.centres()
 	array([-4.42778777, -1.39400285, -0.73469838, -0.40913068, -0.18692843,
 	        0.        ,  0.18692843,  0.40913068,  0.73469838,  1.39400285,
@@ -596,7 +751,7 @@ class ATanBins(Bins):
 		self.delta = 1.0 / n
 
 	def __getitem__(self, x):
-		if isinstance(x, slice):
+		if isinstance(x, (slice, numpy.ndarray)):
 			return super(ATanBins, self).__getitem__(x)
 		# map to the domain [0, 1]
 		x = math.atan(float(x - self.mid) * self.scale) / math.pi + 0.5
@@ -605,6 +760,18 @@ class ATanBins(Bins):
 		# x == 1, special "measure zero" corner case
 		return len(self) - 1
 
+	def _getitem_array(self, x):
+		# map to the domain [0, 1]
+		x = numpy.arctan((numpy.asarray(x, dtype = "double") - self.mid) * self.scale) / math.pi + 0.5
+		with numpy.errstate(invalid = "ignore"):
+			below_one = x < 1.
+		indices = numpy.empty(x.shape, dtype = "intp")
+		indices[below_one] = numpy.floor(x[below_one] / self.delta)
+		# x == 1, special "measure zero" corner case, and, as in
+		# the scalar case, NaN
+		indices[~below_one] = len(self) - 1
+		return _masked_indices(indices, numpy.ones(x.shape, dtype = "bool"))
+
 	def lower(self):
 		x = numpy.tan(numpy.linspace(-math.pi / 2., +math.pi / 2., len(self), endpoint = False)) / self.scale + self.mid
 		x[0] = NegInf
@@ -742,8 +909,11 @@ class Categories(Bins):
 		"""
 		Return i if value is contained in i-th container. If value
 		is not contained in any of the containers, raise an
-		IndexError.
+		IndexError.  If value is a numpy array, it is converted
+		element-by-element as described in Bins.__getitem__().
 		"""
+		if isinstance(value, numpy.ndarray):
+			return self._getitem_array(value)
 		for i, s in enumerate(self.containers):
 			if value in s:
 				return i
@@ -818,10 +988,24 @@ class NDBins(tuple):
 		will accept.  Note that the co-ordinates to be converted
 		must be a tuple, even if it is only a 1-dimensional
 		co-ordinate.
+
+		If any of the co-ordinates is a numpy array, the
+		co-ordinates are broadcast against one another and a tuple
+		of numpy.ma.MaskedArray objects of bin indices is returned.
+		The masks are identical, and mask the co-ordinates that
+		fall outside the binning in any dimension.
+
+		>>> i = x[numpy.array([1., 10., 30.]), numpy.array([1., 5., 5.])]
+		>>> i[0].filled(-1), i[1].filled(-1)
+		(array([ 0,  1, -1]), array([ 0,  1, -1]))
 		"""
 		if isinstance(coords, tuple):
 			if len(coords) != len(self):
 				raise ValueError("dimension mismatch")
+			if any(isinstance(c, numpy.ndarray) for c in coords):
+				indices = tuple(b[c] for b, c in zip(self, numpy.broadcast_arrays(*coords)))
+				mask = reduce(numpy.logical_or, (numpy.ma.getmaskarray(i) for i in indices))
+				return tuple(_masked_indices(i.data, ~mask) for i in indices)
 			return tuple(map(lambda b, c: b[c], self, coords))
 		else:
 			return tuple.__getitem__(self, coords)
@@ -909,6 +1093,35 @@ class NDBins(tuple):
 			seq = sum((coordgen() for coordgen in coordgens), ())
 			yield seq[0::2], sum(seq[1::2])
 
+	def randcoords(self, N, ns = None, domain = None):
+		"""
+		Draw N random co-ordinates in one call.  Returns a tuple of
+		an (N, dimension) array of co-ordinates, and an array of
+		the N natural logarithms of the PDF from which they have
+		been drawn evaluated at each co-ordinate.  The distribution,
+		and the meanings of ns and domain, are the same as for
+		.randcoord().  See Bins.randcoords() for more information.
+
+		Example:
+
+		>>> binning = NDBins((LinearBins(0, 10, 5), LinearBins(0, 10, 5)))
+		>>> coords, lnP = binning.randcoords(1000)
+		>>> coords.shape, lnP.shape
+		((1000, 2), (1000,))
+		>>> print "%.15g" % lnP[0]
+		-4.60517018598809
+		"""
+		if ns is None:
+			ns = (1.,) * len(self)
+		if domain is None:
+			domain = (slice(None, None),) * len(self)
+		coords = numpy.empty((N, len(self)), dtype = "double")
+		ln_P = numpy.zeros((N,), dtype = "double")
+		for dim, (binning, n, d) in enumerate(zip(self, ns, domain)):
+			coords[:, dim], ln_P_dim = binning.randcoords(N, n, domain = d)
+			ln_P += ln_P_dim
+		return coords, ln_P
+
 	class BinsTable(ligolw_table.Table):
 		"""
 		LIGO Light Weight XML table defining a binning.
@@ -922,31 +1135,61 @@ class NDBins(tuple):
 			"n": "int_4u"
 		}
 
+	#
+	# the names by which the Bins subclasses are identified in the
+	# serialized forms of the binning
+	#
+
+	_bins_types = {
+		LinearBins: "lin",
+		LinearPlusOverflowBins: "linplusoverflow",
+		LogarithmicBins: "log",
+		ATanBins: "atan",
+		ATanLogarithmicBins: "atanlog",
+		LogarithmicPlusOverflowBins: "logplusoverflow"
+	}
+
+	def to_params(self):
+		"""
+		Return a list of (type, min, max, n) tuples, one for each
+		dimension, describing the binning.  The inverse of
+		.from_params().
+
+		Example:
+
+		>>> NDBins((LinearBins(0, 10, 5), LogarithmicBins(1, 100, 2))).to_params()
+		[('lin', 0.0, 10.0, 5), ('log', 1.0, 100.0, 2)]
+		"""
+		params = []
+		for binning in self:
+			if isinstance(binning, ATanLogarithmicBins):
+				params.append((self._bins_types[type(binning)], float(binning._real_min), float(binning._real_max), int(binning._real_n)))
+			else:
+				params.append((self._bins_types[type(binning)], float(binning.min), float(binning.max), len(binning)))
+		return params
+
+	@classmethod
+	def from_params(cls, params):
+		"""
+		Construct and return a rate.NDBins object from a sequence of
+		(type, min, max, n) tuples, as returned by .to_params().
+		"""
+		types = dict((name, bins_type) for bins_type, name in cls._bins_types.items())
+		return cls(types[bins_type](min, max, n) for bins_type, min, max, n in params)
+
 	def to_xml(self):
 		"""
 		Construct a LIGO Light Weight XML table representation of the
 		NDBins instance.
 		"""
 		xml = lsctables.New(self.BinsTable)
-		for order, binning in enumerate(self):
+		for order, (bins_type, min, max, n) in enumerate(self.to_params()):
 			row = xml.RowType()
 			row.order = order
-			row.type = {
-				LinearBins: "lin",
-				LinearPlusOverflowBins: "linplusoverflow",
-				LogarithmicBins: "log",
-				ATanBins: "atan",
-				ATanLogarithmicBins: "atanlog",
-				LogarithmicPlusOverflowBins: "logplusoverflow"
-			}[type(binning)]
-			if isinstance(binning, ATanLogarithmicBins):
-				row.min = binning._real_min
-				row.max = binning._real_max
-				row.n = binning._real_n
-			else:
-				row.min = binning.min
-				row.max = binning.max
-				row.n = len(binning)
+			row.type = bins_type
+			row.min = min
+			row.max = max
+			row.n = n
 			xml.append(row)
 		return xml
 
@@ -958,21 +1201,14 @@ class NDBins(tuple):
 		from it.
 		"""
 		xml = cls.BinsTable.get_table(xml)
-		binnings = [None] * (len(xml) and (max(xml.getColumnByName("order")) + 1))
+		params = [None] * (len(xml) and (max(xml.getColumnByName("order")) + 1))
 		for row in xml:
-			if binnings[row.order] is not None:
+			if params[row.order] is not None:
 				raise ValueError("duplicate binning for dimension %d" % row.order)
-			binnings[row.order] = {
-				"lin": LinearBins,
-				"linplusoverflow": LinearPlusOverflowBins,
-				"log": LogarithmicBins,
-				"atan": ATanBins,
-				"atanlog": ATanLogarithmicBins,
-				"logplusoverflow": LogarithmicPlusOverflowBins
-			}[row.type](row.min, row.max, row.n)
-		if None in binnings:
-			raise ValueError("no binning for dimension %d" % binnings.find(None))
-		return cls(binnings)
+			params[row.order] = (row.type, row.min, row.max, row.n)
+		if None in params:
+			raise ValueError("no binning for dimension %d" % params.index(None))
+		return cls.from_params(params)
 
 
 #
@@ -1011,17 +1247,30 @@ def bins_spanned(bins, seglist, dtype = "double"):
 	        0.   ,  0.   ,  0.   ,  0.   ,  0.   ,  0.   ,  0.   ,  0.   ,
 	        0.   ,  0.   ,  0.   ,  0.   ])
 	"""
-	lower = bins.lower()
-	upper = bins.upper()
-	# make an intersection of the segment list with the extend of the bins
-	# need to use lower/upper instead of min/max because the latter sometimes
-	# merely correspond to low and high parameters used to construct the binning
-	# (see, for example, the atan binning)
-	seglist = seglist & segments.segmentlist([segments.segment(lower[0], upper[-1])])
-	array = numpy.zeros((len(bins),), dtype = dtype)
-	for i, (a, b) in enumerate(zip(lower, upper)):
-		array[i] = abs(seglist & segments.segmentlist([segments.segment(a, b)]))
-	return array
+	# the segments' boundaries, and the total duration of the
+	# segments preceding each one
+	seglist = segments.segmentlist(seglist).coalesce()
+	starts = numpy.array([float(seg[0]) for seg in seglist], dtype = "double")
+	ends = numpy.array([float(seg[1]) for seg in seglist], dtype = "double")
+	cumulative = numpy.hstack(([0.], numpy.cumsum(ends - starts)[:-1]))
+
+	def livetime(t):
+		# total time spanned by the segment list up to each time
+		# in the array t.  the durations are accumulated separately
+		# from the boundaries so no precision is lost to the
+		# (large) absolute times
+		livetime = numpy.zeros(t.shape, dtype = "double")
+		i = starts.searchsorted(t, side = "right") - 1
+		started = i >= 0
+		i = i[started]
+		livetime[started] = cumulative[i] + (numpy.minimum(t[started], ends[i]) - starts[i])
+		return livetime
+
+	# the time spanned in each bin is the difference between the
+	# cumulative live time at its upper and lower boundaries
+	lower = numpy.asarray(bins.lower(), dtype = "double")
+	upper = numpy.asarray(bins.upper(), dtype = "double")
+	return (livetime(upper) - livetime(lower)).astype(dtype)
 
 
 #
@@ -1033,6 +1282,34 @@ def bins_spanned(bins, seglist, dtype = "double"):
 #
 
 
+def _flat_indices(bins, coords):
+	"""
+	Convert a tuple of arrays of co-ordinates to an array of indices
+	into the flattened array of the NDBins object bins, and a boolean
+	array that is True where the co-ordinates are inside the binning.
+	"""
+	indices = bins[tuple(numpy.asarray(c) for c in coords)]
+	inrange = ~numpy.ma.getmaskarray(indices[0])
+	return numpy.ravel_multi_index(tuple(i.data for i in indices), bins.shape), inrange
+
+
+def _rebinned_flat_indices(bins, other, coords):
+	"""
+	Return the indices into the flattened array of the NDBins object
+	bins of the bins containing coords, the centres of bins of the
+	binned array other, for adding other's contents to an array binned
+	by bins.  TypeError is raised unless an integer number of other's
+	bins fit into each of bins.
+	"""
+	# can other's bins be put into ours?
+	if bins.min != other.bins.min or bins.max != other.bins.max or False in map(lambda a, b: (b % a) == 0, bins.shape, other.bins.shape):
+		raise TypeError("incompatible binning: %s" % repr(other))
+	flat, inrange = _flat_indices(bins, coords)
+	if not inrange.all():
+		raise TypeError("incompatible binning: %s" % repr(other))
+	return flat
+
+
 class BinnedArray(object):
 	"""
 	A convenience wrapper, using the NDBins class to provide access to
@@ -1098,22 +1375,109 @@ class BinnedArray(object):
 	def __len__(self):
 		return len(self.array)
 
+	def _accumulate(self, flat, weights):
+		"""
+		Add the weights to the elements of the flattened array
+		given by the array of indices flat.  All of the indices are
+		checked before any element is changed, so IndexError is
+		raised with the array left as it was.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x._accumulate(numpy.array([0, 0, 5]), numpy.array([1., 1., 1.]))
+		Traceback (most recent call last):
+		    ...
+		IndexError: index out of range for array of size 5
+		>>> x.array
+		array([ 0.,  0.,  0.,  0.,  0.])
+		>>> x._accumulate(numpy.array([0, 0, 4]), numpy.array([1., 1., 1.]))
+		>>> x.array
+		array([ 2.,  0.,  0.,  0.,  1.])
+		"""
+		flat = flat.ravel()
+		if len(flat) and (flat.min() < 0 or flat.max() >= self.array.size):
+			raise IndexError("index out of range for array of size %d" % self.array.size)
+		# bincount() over the distinct indices accumulates repeated
+		# indices, and is much faster than numpy.add.at().  the
+		# temporaries are the size of flat, not of the array
+		keys, inverse = numpy.unique(flat, return_inverse = True)
+		self.array.flat[keys] += numpy.bincount(inverse, weights = weights.ravel(), minlength = len(keys))
+
+	def fill(self, coords, weights = 1.):
+		"""
+		Add weights to the bins containing the co-ordinates coords,
+		which must be a tuple of arrays (or of values that can be
+		broadcast against one another), one for each dimension.
+		weights is an array of weights, or a single weight to be
+		added for each co-ordinate.  Bins are accumulated
+		correctly when more than one co-ordinate falls in the same
+		bin.  Co-ordinates outside the binning are ignored, and
+		the number of them is returned.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x.fill((numpy.array([0., 0.5, 5., 11.]),))
+		1
+		>>> x.array
+		array([ 2.,  0.,  1.,  0.,  0.])
+		>>> x.fill((numpy.array([9., 9.]),), weights = numpy.array([0.5, 0.25]))
+		0
+		>>> x.array
+		array([ 2.  ,  0.  ,  1.  ,  0.  ,  0.75])
+		"""
+		flat, inrange = _flat_indices(self.bins, coords)
+		weights = numpy.broadcast_arrays(weights, flat)[0]
+		flat = flat[inrange]
+		weights = weights[inrange]
+		self._accumulate(flat, weights)
+		return inrange.size - numpy.count_nonzero(inrange)
+
+	def lookup(self, coords):
+		"""
+		Return the values of the bins containing the co-ordinates
+		coords, which must be a tuple of arrays (or of values that
+		can be broadcast against one another), one for each
+		dimension.  The result is a numpy.ma.MaskedArray, in which
+		the co-ordinates outside the binning are masked.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x.array[:] = numpy.arange(5)
+		>>> x.lookup((numpy.array([0., 3., 11.]),)).filled(-1)
+		array([ 0.,  1., -1.])
+		"""
+		flat, inrange = _flat_indices(self.bins, coords)
+		return numpy.ma.MaskedArray(self.array.flat[flat], mask = ~inrange)
+
 	def __iadd__(self, other):
 		"""
 		Add the contents of another BinnedArray object to this one.
 		It is not necessary for the binnings to be identical, but
 		an integer number of the bins in other must fit into each
 		bin in self.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 2), LinearBins(0, 10, 1))))
+		>>> y = BinnedArray(NDBins((LinearBins(0, 10, 4), LinearBins(0, 10, 2))))
+		>>> y.array[:] = numpy.arange(8).reshape((4, 2))
+		>>> x += y
+		>>> x.array
+		array([[  6.],
+		       [ 22.]])
 		"""
 		# identical binning? (fast path)
 		if not cmp(self.bins, other.bins):
 			self.array += other.array
 			return self
-		# can other's bins be put into ours?
-		if self.bins.min != other.bins.min or self.bins.max != other.bins.max or False in map(lambda a, b: (b % a) == 0, self.bins.shape, other.bins.shape):
-			raise TypeError("incompatible binning: %s" % repr(other))
-		for coords in iterutils.MultiIter(*other.bins.centres()):
-			self[coords] += other[coords]
+		# find the bin in self containing the centre of each bin
+		# in other in one pass (numpy.ix_() returns an open grid
+		# that NDBins broadcasts), then accumulate other's
+		# contents into those bins
+		self._accumulate(_rebinned_flat_indices(self.bins, other, numpy.ix_(*other.bins.centres())), other.array)
 		return self
 
 	def copy(self):
@@ -1203,6 +1567,360 @@ class BinnedArray(object):
 		self.array = ligolw_array.get_array(xml, u"array").array
 		return self
 
+	#
+	# binary file format:  a magic line, a one-line JSON header giving
+	# the binning and the array's type and shape, padded with spaces so
+	# that the array data, which follow immediately in C order, start
+	# on a 64 byte boundary.  this allows the array to be mapped into
+	# memory with numpy.memmap
+	#
+
+	binary_magic = "pylal_rate_binnedarray\n"
+
+	def to_binary(self, filename):
+		"""
+		Write the BinnedArray to a binary file that can be read
+		with .from_binary().
+		"""
+		array = numpy.ascontiguousarray(self.array)
+		header = json.dumps({"bins": self.bins.to_params(), "dtype": array.dtype.str, "shape": array.shape})
+		header += " " * (-(len(self.binary_magic) + len(header) + 1) % 64) + "\n"
+		f = open(filename, "wb")
+		try:
+			f.write(self.binary_magic)
+			f.write(header)
+			array.tofile(f)
+		finally:
+			f.close()
+
+	@classmethod
+	def from_binary(cls, filename, mode = "r"):
+		"""
+		Construct and return a new BinnedArray object from the
+		contents of a file written by .to_binary().  The .array
+		attribute is a numpy.memmap of the file's contents, so
+		only the header is read here and the array data are read
+		from disk as they are accessed.  mode is passed to
+		numpy.memmap:  "r" (the default) for read-only access,
+		"r+" to write changes back to the file, "c" to allow
+		changes that are not written back to the file.
+
+		Example:
+
+		>>> import tempfile
+		>>> f = tempfile.NamedTemporaryFile()
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5), LogarithmicBins(1, 100, 2))))
+		>>> x[3, 30] = 1.5
+		>>> x.to_binary(f.name)
+		>>> y = BinnedArray.from_binary(f.name)
+		>>> y[3, 30]
+		1.5
+		>>> y.bins.to_params()
+		[('lin', 0.0, 10.0, 5), ('log', 1.0, 100.0, 2)]
+		"""
+		f = open(filename, "rb")
+		try:
+			if f.readline() != cls.binary_magic:
+				raise ValueError("%s is not a BinnedArray file" % filename)
+			header = json.loads(f.readline())
+			offset = f.tell()
+		finally:
+			f.close()
+		# an empty binning is used for the initial object creation
+		# to avoid allocating the array
+		self = cls(NDBins())
+		self.bins = NDBins.from_params(header["bins"])
+		self.array = numpy.memmap(filename, dtype = numpy.dtype(str(header["dtype"])), mode = mode, offset = offset, shape = tuple(header["shape"]))
+		if self.array.shape != self.bins.shape:
+			raise ValueError("%s: array and bins have different shapes" % filename)
+		return self
+
+
+class SparseBinnedArray(object):
+	"""
+	Like BinnedArray, but only the bins that have been assigned a value
+	are stored, so that very large, mostly empty, multi-dimensional
+	histograms can be held in memory.  All other bins are 0.  The
+	indices into the flattened array of the bins that are stored are
+	available as the sorted array in the "keys" attribute, and their
+	values as the "values" attribute.  The to_dense() and from_dense()
+	methods convert to and from BinnedArray objects.
+
+	Example:
+
+	>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 5), LinearBins(0, 10, 5))))
+	>>> x.fill((numpy.array([1., 1., 9.]), numpy.array([1., 1., 3.])))
+	0
+	>>> x.keys
+	array([ 0, 21])
+	>>> x.values
+	array([ 2.,  1.])
+	>>> x[1, 1]
+	2.0
+	>>> x[5, 5]
+	0.0
+	>>> x[5, 5] += 1
+	>>> x.argmax()
+	(1.0, 1.0)
+	>>> x.to_dense().array
+	array([[ 2.,  0.,  0.,  0.,  0.],
+	       [ 0.,  0.,  0.,  0.,  0.],
+	       [ 0.,  0.,  1.,  0.,  0.],
+	       [ 0.,  0.,  0.,  0.,  0.],
+	       [ 0.,  1.,  0.,  0.,  0.]])
+	"""
+	def __init__(self, bins, dtype = "double"):
+		self.bins = bins
+		self.keys = numpy.zeros((0,), dtype = numpy.intp)
+		self.values = numpy.zeros((0,), dtype = dtype)
+
+	@property
+	def size(self):
+		"""
+		The number of bins, including the bins that are not
+		stored.
+		"""
+		return reduce(lambda a, b: a * b, self.bins.shape, 1)
+
+	def _flat_index(self, coords):
+		indices = self.bins[coords]
+		if any(isinstance(i, slice) for i in indices):
+			raise NotImplementedError("SparseBinnedArray does not support slices")
+		return numpy.ravel_multi_index(indices, self.bins.shape)
+
+	def __getitem__(self, coords):
+		flat = self._flat_index(coords)
+		i = self.keys.searchsorted(flat)
+		if i < len(self.keys) and self.keys[i] == flat:
+			return self.values[i]
+		return self.values.dtype.type(0)
+
+	def __setitem__(self, coords, val):
+		flat = self._flat_index(coords)
+		i = self.keys.searchsorted(flat)
+		if i < len(self.keys) and self.keys[i] == flat:
+			self.values[i] = val
+		else:
+			self.keys = numpy.insert(self.keys, i, flat)
+			self.values = numpy.insert(self.values, i, val)
+
+	def __len__(self):
+		return self.bins.shape[0]
+
+	def _accumulate(self, flat, weights):
+		"""
+		Add the weights to the elements of the flattened array
+		given by the array of indices flat, adding the elements to
+		the storage as needed.
+		"""
+		keys, inverse = numpy.unique(numpy.concatenate((self.keys, flat.ravel())), return_inverse = True)
+		self.values = numpy.bincount(inverse, weights = numpy.concatenate((self.values, weights.ravel())), minlength = len(keys)).astype(self.values.dtype)
+		self.keys = keys.astype(numpy.intp)
+
+	def _unravel_keys(self):
+		"""
+		Return a tuple of arrays giving the index in each dimension
+		of the stored bins.
+		"""
+		return numpy.unravel_index(self.keys, self.bins.shape)
+
+	def fill(self, coords, weights = 1.):
+		"""
+		Add weights to the bins containing the co-ordinates coords.
+		Same as BinnedArray.fill().
+
+		Example:
+
+		>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x.fill((numpy.array([0., 0.5, 5., 11.]),))
+		1
+		>>> x.keys, x.values
+		(array([0, 2]), array([ 2.,  1.]))
+		"""
+		flat, inrange = _flat_indices(self.bins, coords)
+		weights = numpy.broadcast_arrays(weights, flat)[0]
+		self._accumulate(flat[inrange], weights[inrange])
+		return inrange.size - numpy.count_nonzero(inrange)
+
+	def lookup(self, coords):
+		"""
+		Return the values of the bins containing the co-ordinates
+		coords.  Same as BinnedArray.lookup().
+
+		Example:
+
+		>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x[3,] = 7
+		>>> x.lookup((numpy.array([0., 3., 11.]),)).filled(-1)
+		array([ 0.,  7., -1.])
+		"""
+		flat, inrange = _flat_indices(self.bins, coords)
+		if len(self.keys):
+			i = numpy.minimum(self.keys.searchsorted(flat), len(self.keys) - 1)
+			result = numpy.where(self.keys[i] == flat, self.values[i], 0)
+		else:
+			result = numpy.zeros(flat.shape, dtype = self.values.dtype)
+		return numpy.ma.MaskedArray(result, mask = ~inrange)
+
+	def __iadd__(self, other):
+		"""
+		Add the contents of another SparseBinnedArray or
+		BinnedArray object to this one.  The binnings must satisfy
+		the same requirements as for BinnedArray.__iadd__().
+
+		Example:
+
+		>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 2), LinearBins(0, 10, 1))))
+		>>> y = BinnedArray(NDBins((LinearBins(0, 10, 4), LinearBins(0, 10, 2))))
+		>>> y.array[:] = numpy.arange(8).reshape((4, 2))
+		>>> x += y
+		>>> x.to_dense().array
+		array([[  6.],
+		       [ 22.]])
+		"""
+		if isinstance(other, BinnedArray):
+			other = type(self).from_dense(other)
+		# identical binning? (fast path)
+		if not cmp(self.bins, other.bins):
+			self._accumulate(other.keys, other.values)
+			return self
+		# find the bin in self containing the centre of each of
+		# the stored bins in other
+		self._accumulate(_rebinned_flat_indices(self.bins, other, tuple(centres[indices] for centres, indices in zip(other.bins.centres(), other._unravel_keys()))), other.values)
+		return self
+
+	def copy(self):
+		"""
+		Return a copy of the SparseBinnedArray.  The .bins attribute
+		is shared with the original.
+		"""
+		new = type(self)(self.bins, dtype = self.values.dtype)
+		new.keys = self.keys.copy()
+		new.values = self.values.copy()
+		return new
+
+	def centres(self):
+		"""
+		Return a tuple of arrays containing the bin centres for
+		each dimension.
+		"""
+		return self.bins.centres()
+
+	def _first_unstored(self):
+		"""
+		Return the smallest index into the flattened array of a bin
+		that is not stored, or None if all bins are stored.
+		"""
+		gaps = numpy.flatnonzero(self.keys != numpy.arange(len(self.keys)))
+		if len(gaps):
+			return gaps[0]
+		if len(self.keys) < self.size:
+			return len(self.keys)
+		return None
+
+	def _arg(self, i, better):
+		"""
+		Return the co-ordinates of the bin centre of the stored
+		bin i, or of the first unstored bin if 0 is better than, or
+		equal to and before, its value.
+		"""
+		unstored = self._first_unstored()
+		if i is None:
+			flat = unstored
+		else:
+			flat = self.keys[i]
+			if unstored is not None and (better(0, self.values[i]) or (self.values[i] == 0 and unstored < flat)):
+				flat = unstored
+		return tuple(centres[index] for centres, index in zip(self.centres(), numpy.unravel_index(flat, self.bins.shape)))
+
+	def argmin(self):
+		"""
+		Return the co-ordinates of the bin centre containing the
+		minimum value.  Same as BinnedArray.argmin().
+		"""
+		return self._arg(self.values.argmin() if len(self.values) else None, lambda a, b: a < b)
+
+	def argmax(self):
+		"""
+		Return the co-ordinates of the bin centre containing the
+		maximum value.  Same as BinnedArray.argmax().
+		"""
+		return self._arg(self.values.argmax() if len(self.values) else None, lambda a, b: a > b)
+
+	def to_density(self):
+		"""
+		Divide each bin's value by the volume of the bin.
+		"""
+		volumes = numpy.ones((len(self.keys),), dtype = "double")
+		for b, indices in zip(self.bins, self._unravel_keys()):
+			volumes *= (b.upper() - b.lower())[indices]
+		self.values /= volumes
+
+	def to_pdf(self):
+		"""
+		Convert into a probability density.
+		"""
+		self.values /= self.values.sum()	# make sum = 1
+		self.to_density()	# make integral = 1
+
+	def to_dense(self):
+		"""
+		Return a BinnedArray object containing the same data.  The
+		.bins attribute is shared with the original.
+		"""
+		result = BinnedArray(self.bins, dtype = self.values.dtype)
+		result.array.flat[self.keys] = self.values
+		return result
+
+	@classmethod
+	def from_dense(cls, binnedarray):
+		"""
+		Construct a SparseBinnedArray object from the non-zero bins
+		of a BinnedArray object.  The .bins attribute is shared
+		with the original.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5),)))
+		>>> x[3,] = 1
+		>>> y = SparseBinnedArray.from_dense(x)
+		>>> y.keys, y.values
+		(array([1]), array([ 1.]))
+		"""
+		self = cls(binnedarray.bins, dtype = binnedarray.array.dtype)
+		self.keys = numpy.flatnonzero(binnedarray.array).astype(numpy.intp)
+		self.values = binnedarray.array.flat[self.keys]
+		return self
+
+	def to_xml(self, name):
+		"""
+		Retrun an XML document tree describing a
+		rate.SparseBinnedArray object.
+		"""
+		xml = ligolw.LIGO_LW({u"Name": u"%s:pylal_rate_sparsebinnedarray" % name})
+		xml.appendChild(self.bins.to_xml())
+		xml.appendChild(ligolw_array.from_array(u"keys", self.keys))
+		xml.appendChild(ligolw_array.from_array(u"values", self.values))
+		return xml
+
+	@classmethod
+	def from_xml(cls, xml, name):
+		"""
+		Search for the description of a rate.SparseBinnedArray
+		object named "name" in the XML document tree rooted at xml,
+		and construct and return a new rate.SparseBinnedArray object
+		from the data contained therein.
+		"""
+		xml = [elem for elem in xml.getElementsByTagName(ligolw.LIGO_LW.tagName) if elem.hasAttribute(u"Name") and elem.Name == u"%s:pylal_rate_sparsebinnedarray" % name]
+		try:
+			xml, = xml
+		except ValueError:
+			raise ValueError("document must contain exactly 1 SparseBinnedArray named '%s'" % name)
+		self = cls(NDBins.from_xml(xml))
+		self.keys = ligolw_array.get_array(xml, u"keys").array.astype(numpy.intp)
+		self.values = ligolw_array.get_array(xml, u"values").array
+		return self
+
 
 class BinnedRatios(object):
 	"""
@@ -1252,6 +1970,34 @@ class BinnedRatios(object):
 		"""
 		self.denominator[coords] += weight
 
+	def fillnumerator(self, coords, weights = 1.):
+		"""
+		Add weights to the numerator bins containing the
+		co-ordinates coords.  See BinnedArray.fill() for more
+		information.  Returns the number of co-ordinates outside
+		the binning.
+		"""
+		return self.numerator.fill(coords, weights = weights)
+
+	def filldenominator(self, coords, weights = 1.):
+		"""
+		Add weights to the denominator bins containing the
+		co-ordinates coords.  See BinnedArray.fill() for more
+		information.  Returns the number of co-ordinates outside
+		the binning.
+		"""
+		return self.denominator.fill(coords, weights = weights)
+
+	def lookup(self, coords):
+		"""
+		Return the ratios in the bins containing the co-ordinates
+		coords as a numpy.ma.MaskedArray, in which the
+		co-ordinates outside the binning, and those in bins whose
+		denominator is 0, are masked.  See
+		BinnedArray.lookup() for more information.
+		"""
+		return self.numerator.lookup(coords) / self.denominator.lookup(coords)
+
 	def ratio(self):
 		"""
 		Compute and return the array of ratios.
@@ -1326,6 +2072,22 @@ class BinnedRatios(object):
 		return self
 
 
+def binnedarray_xml_to_binary(xml, name, filename):
+	"""
+	Convert the BinnedArray named "name" in the XML document tree
+	rooted at xml to the binary format, writing it to filename.
+	"""
+	BinnedArray.from_xml(xml, name).to_binary(filename)
+
+
+def binnedarray_binary_to_xml(filename, name):
+	"""
+	Return an XML document tree describing the BinnedArray stored in
+	binary format in filename, with the name "name".
+	"""
+	return BinnedArray.from_binary(filename).to_xml(name)
+
+
 #
 # =============================================================================
 #
@@ -1335,13 +2097,20 @@ class BinnedRatios(object):
 #
 
 
-def InterpBinnedArray(binnedarray, fill_value = 0.0):
+class InterpBinnedArray(object):
 	"""
-	Wrapper constructing a scipy.interpolate interpolator from the
-	contents of a BinnedArray.  Only piecewise linear interpolators are
-	supported.  In 1 and 2 dimensions, scipy.interpolate.interp1d and
-	.interp2d is used, respectively.  In more than 2 dimensions
-	scipy.interpolate.LinearNDInterpolator is used.
+	Piecewise multi-linear interpolator constructed from the contents
+	of a BinnedArray.  The interpolator can be evaluated at a single
+	point, in which case a float is returned, or at arrays of points
+	(co-ordinates that can be broadcast against one another), in which
+	case an array is returned.  Points outside the binning are assigned
+	fill_value.  Any number of dimensions is supported.
+
+	The bin co-ordinates, the reciprocals of their separations, and the
+	strides of the padded array are computed once when the interpolator
+	is constructed, so each evaluation costs one binary search per
+	dimension plus 2^N array look-ups for every point, all done by
+	numpy.
 
 	Example:
 
@@ -1362,6 +2131,8 @@ def InterpBinnedArray(binnedarray, fill_value = 0.0):
 	0.5
 	>>> y(1.5)
 	2.0
+	>>> y(numpy.array([0.5, 1.5, 10.]))
+	array([ 0.5,  2. ,  0. ])
 
 	Two dimensions
 
@@ -1401,121 +2172,104 @@ def InterpBinnedArray(binnedarray, fill_value = 0.0):
 	2.5
 	>>> y(1, 0.75)
 	3.5
+	>>> y(numpy.array([0.25, 0.75]), 1)
+	array([ 1.75,  3.25])
 
-	BUGS:  Due to bugs in some versions of scipy and numpy, if an old
-	version of scipy and/or numpy is detected this code falls back to
-	home-grown piece-wise linear interpolator code for 1- and 2
-	dimensions that is slow, and in 3- and higher dimensions the
-	fall-back is to nearest-neighbour "interpolation".
+	NOTE:  a bin whose value is infinite contaminates the interpolated
+	value at every point at which its weight is non-zero, so, e.g., the
+	interpolated logarithm of a PDF is -inf within one bin of any bin
+	where the PDF is 0.
 	"""
-	# the upper and lower boundaries of the binnings are added as
-	# additional co-ordinates with the array being assumed to equal
-	# fill_value at those points.  this solves the problem of providing
-	# a valid function in the outer halves of the first and last bins.
-
-	# coords[0] = co-ordinates along 1st dimension,
-	# coords[1] = co-ordinates along 2nd dimension,
-	# ...
-	coords = tuple(numpy.hstack((l[0], c, u[-1])) for l, c, u in zip(binnedarray.bins.lower(), binnedarray.bins.centres(), binnedarray.bins.upper()))
-
-	# pad the contents of the binned array with 1 element of fill_value
-	# on each side in each dimension
-	try:
-		z = numpy.pad(binnedarray.array, [(1, 1)] * len(binnedarray.array.shape), mode = "constant", constant_values = [(fill_value, fill_value)] * len(binnedarray.array.shape))
-	except AttributeError:
-		# numpy < 1.7 didn't have pad().  FIXME:  remove when we
-		# can rely on a newer numpy
-		z = numpy.empty(tuple(l + 2 for l in binnedarray.array.shape))
+	def __init__(self, binnedarray, fill_value = 0.0):
+		self.fill_value = fill_value
+
+		# the upper and lower boundaries of the binnings are added
+		# as additional co-ordinates with the array being assumed
+		# to equal fill_value at those points.  this solves the
+		# problem of providing a valid function in the outer halves
+		# of the first and last bins.
+
+		# coords[0] = co-ordinates along 1st dimension,
+		# coords[1] = co-ordinates along 2nd dimension,
+		# ...
+		coords = tuple(numpy.hstack((l[0], c, u[-1])) for l, c, u in zip(binnedarray.bins.lower(), binnedarray.bins.centres(), binnedarray.bins.upper()))
+
+		# pad the contents of the binned array with 1 element of
+		# fill_value on each side in each dimension
+		z = numpy.empty(tuple(l + 2 for l in binnedarray.array.shape), dtype = "double")
 		z.fill(fill_value)
 		z[(slice(1, -1),) * len(binnedarray.array.shape)] = binnedarray.array
 
-	# if any co-ordinates are infinite, remove them.  also remove
-	# degenerate co-ordinates from ends
-	slices = []
-	for c in coords:
-		finite_indexes, = numpy.isfinite(c).nonzero()
-		assert len(finite_indexes) != 0
-
-		lo, hi = finite_indexes.min(), finite_indexes.max()
-
-		while lo < hi and c[lo + 1] == c[lo]:
-			lo += 1
-		while lo < hi and c[hi - 1] == c[hi]:
-			hi -= 1
-		assert lo < hi
-
-		slices.append(slice(lo, hi + 1))
-	coords = tuple(c[s] for c, s in zip(coords, slices))
-	z = z[slices]
-
-	# build the interpolator from the co-ordinates and array data.
-	# scipy/numpy interpolators return an array-like thing so we have
-	# to wrap them, in turn, in a float cast
-	if len(coords) == 1:
-		try:
-			interp1d
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			coords0 = coords[0]
-			lo, hi = coords[0][0], coords[0][-1]
-			with numpy.errstate(invalid = "ignore"):
-				dz_over_dcoords0 = (z[1:] - z[:-1]) / (coords0[1:] - coords0[:-1])
-			isinf = math.isinf
-			def interp(x):
-				if not lo < x < hi:
-					return fill_value
-				i = coords0.searchsorted(x) - 1
-				if isinf(z[i]):
-					return z[i]
-				return z[i] + (x - coords0[i]) * dz_over_dcoords0[i]
-			return interp
-		interp = interp1d(coords[0], z, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
-	elif len(coords) == 2:
-		try:
-			interp2d
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			coords0 = coords[0]
-			coords1 = coords[1]
-			lox, hix = coords0[0], coords0[-1]
-			loy, hiy = coords1[0], coords1[-1]
-			dcoords0 = coords0[1:] - coords0[:-1]
-			dcoords1 = coords1[1:] - coords1[:-1]
-			with numpy.errstate(invalid = "ignore"):
-				dz0 = z[1:,:] - z[:-1,:]
-				dz1 = z[:,1:] - z[:,:-1]
-			isinf = math.isinf
-			def interp(x, y):
-				if not (lox < x < hix and loy < y < hiy):
-					return fill_value
-				i = coords0.searchsorted(x) - 1
-				j = coords1.searchsorted(y) - 1
-				dx = (x - coords0[i]) / dcoords0[i]
-				dy = (y - coords1[j]) / dcoords1[j]
-				if dx + dy <= 1.:
-					if isinf(z[i, j]):
-						return z[i, j]
-					return z[i, j] + dx * dz0[i, j] + dy * dz1[i, j]
-				if isinf(z[i + 1, j + 1]):
-					return z[i + 1, j + 1]
-				return z[i + 1, j + 1] + (1. - dx) * -dz0[i, j + 1] + (1. - dy) * -dz1[i + 1, j]
-			return interp
-		interp = interp2d(coords[0], coords[1], z.T, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
-	else:
-		try:
-			LinearNDInterpolator
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			def interp(*coords):
-				try:
-					return binnedarray[coords]
-				except IndexError:
-					return fill_value
-			return interp
-		interp = LinearNDInterpolator(list(itertools.product(*coords)), z.flat, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
+		# if any co-ordinates are infinite, remove them.  also
+		# remove degenerate co-ordinates from ends
+		slices = []
+		for c in coords:
+			finite_indexes, = numpy.isfinite(c).nonzero()
+			assert len(finite_indexes) != 0
+
+			lo, hi = finite_indexes.min(), finite_indexes.max()
+
+			while lo < hi and c[lo + 1] == c[lo]:
+				lo += 1
+			while lo < hi and c[hi - 1] == c[hi]:
+				hi -= 1
+			assert lo < hi
+
+			slices.append(slice(lo, hi + 1))
+		self.coords = tuple(c[s] for c, s in zip(coords, slices))
+		self.z = numpy.ascontiguousarray(z[tuple(slices)])
+
+		# look-up tables:  the reciprocals of the co-ordinate
+		# separations, and the offset into the flattened array of
+		# a step of 1 element in each dimension
+		with numpy.errstate(divide = "ignore"):
+			self.inv_dcoords = tuple(1. / (c[1:] - c[:-1]) for c in self.coords)
+		self.strides = tuple(stride // self.z.itemsize for stride in self.z.strides)
+
+		# the offsets and dimensions of the 2^N corners of an
+		# N-dimensional cell
+		self.corners = tuple((sum(stride for stride, bit in zip(self.strides, bits) if bit), bits) for bits in iterutils.MultiIter(*([(False, True)] * len(self.coords))))
+
+	def __call__(self, *coords):
+		if len(coords) != len(self.coords):
+			raise ValueError("dimension mismatch")
+		scalar = all(numpy.ndim(x) == 0 for x in coords)
+		coords = numpy.broadcast_arrays(*(numpy.asarray(x, dtype = "double") for x in coords))
+
+		#
+		# find the cell containing each point, and the fractional
+		# position of the point within the cell.  points outside
+		# the co-ordinate range (and NaNs) are assigned to cell 0,
+		# and masked out at the end
+		#
+
+		inrange = numpy.ones(coords[0].shape, dtype = "bool")
+		offset = numpy.zeros(coords[0].shape, dtype = "intp")
+		fractions = []
+		with numpy.errstate(invalid = "ignore"):
+			for x, c, inv_dc, stride in zip(coords, self.coords, self.inv_dcoords, self.strides):
+				inrange &= (c[0] <= x) & (x <= c[-1])
+				i = (c.searchsorted(x, side = "right") - 1).clip(0, len(c) - 2)
+				offset += i * stride
+				fractions.append((x - c[i]) * inv_dc[i])
+
+		#
+		# sum the contributions from the corners of the cells.  a
+		# corner with 0 weight makes no contribution, even if its
+		# value is infinite
+		#
+
+		z = self.z.ravel()
+		result = numpy.zeros(coords[0].shape, dtype = "double")
+		with numpy.errstate(invalid = "ignore"):
+			for corner_offset, bits in self.corners:
+				weight = reduce(numpy.multiply, (t if bit else 1. - t for t, bit in zip(fractions, bits)))
+				result += numpy.where(weight > 0., weight * z[offset + corner_offset], 0.)
+		result[~inrange] = self.fill_value
+
+		if scalar:
+			return float(result)
+		return result
 
 
 #
@@ -1527,6 +2281,77 @@ def InterpBinnedArray(binnedarray, fill_value = 0.0):
 #
 
 
+class _LRUCache(object):
+	"""
+	A dictionary of computed arrays, from which the least-recently-used
+	entries are discarded when the arrays hold more than max_bytes
+	bytes in total.  An array larger than max_bytes is not stored at
+	all.  For internal use.
+
+	Example:
+
+	>>> cache = _LRUCache(80)
+	>>> x = cache.get("a", lambda: numpy.zeros(5))
+	>>> x = cache.get("b", lambda: numpy.zeros(5))
+	>>> x = cache.get("a", lambda: numpy.ones(5))
+	>>> x
+	array([ 0.,  0.,  0.,  0.,  0.])
+	>>> x = cache.get("c", lambda: numpy.zeros(5))
+	>>> sorted(cache.entries), cache.nbytes
+	(['a', 'c'], 80)
+	>>> x = cache.get("d", lambda: numpy.zeros(20))
+	>>> len(x)
+	20
+	>>> sorted(cache.entries), cache.nbytes
+	(['a', 'c'], 80)
+	"""
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.entries = collections.OrderedDict()
+		self.nbytes = 0
+
+	def get(self, key, func):
+		"""
+		Return the value stored under key.  If there isn't one,
+		call func() to compute it and store the result.
+		"""
+		try:
+			value = self.entries.pop(key)
+		except KeyError:
+			value = func()
+			if value.nbytes > self.max_bytes:
+				# would displace everything else.  don't store
+				return value
+			self.nbytes += value.nbytes
+		self.entries[key] = value
+		while self.nbytes > self.max_bytes:
+			self.nbytes -= self.entries.popitem(last = False)[1].nbytes
+		return value
+
+	def clear(self):
+		self.entries.clear()
+		self.nbytes = 0
+
+
+#
+# the window functions are memoized.  they depend only on their arguments,
+# the widths in bins, so those are the cache keys.  callers get a copy of
+# the cached window, which they are free to modify.  a window grows as the
+# product of its widths, so the cache is bounded by the memory it holds
+#
+
+
+_windows = _LRUCache(2**25)
+
+
+def _memoized_window(func):
+	@functools.wraps(func)
+	def window(*args, **kwargs):
+		return _windows.get((func.__name__, args, tuple(sorted(kwargs.items()))), lambda: func(*args, **kwargs)).copy()
+	return window
+
+
+@_memoized_window
 def gaussian_window(*bins, **kwargs):
 	"""
 	Generate a normalized (integral = 1) Gaussian window in N
@@ -1573,6 +2398,7 @@ def gaussian_window(*bins, **kwargs):
 		return window
 
 
+@_memoized_window
 def tophat_window(bins):
 	"""
 	Generate a normalized (integral = 1) top-hat window in 1 dimension.
@@ -1590,6 +2416,7 @@ def tophat_window(bins):
 	return w.data.data / w.sum
 
 
+@_memoized_window
 def tophat_window2d(bins_x, bins_y):
 	"""
 	Generate a normalized (integral = 1) top-hat window in 2
@@ -1633,6 +2460,70 @@ def tophat_window2d(bins_x, bins_y):
 #
 
 
+#
+# FFTs.  scipy >= 1.4 provides multi-threaded transforms, otherwise
+# numpy's are used
+#
+
+
+try:
+	from scipy import fft as _fft
+	# in scipy < 1.4 this is a function
+	_fft.rfftn
+	_fft_kwargs = {"workers": -1}
+except (ImportError, AttributeError):
+	_fft = numpy.fft
+	_fft_kwargs = {}
+try:
+	from scipy.fftpack import next_fast_len as _next_fast_len
+except ImportError:
+	# scipy < 0.18
+	_next_fast_len = lambda n: n
+
+
+#
+# cache of the transforms of the window functions that have been used,
+# keyed by the window's contents and the size of the transform.  the
+# transforms are the size of the arrays being filtered, so the cache is
+# bounded by the memory it holds, not by the number of transforms
+#
+
+
+_window_transforms = _LRUCache(2**26)
+
+
+def _window_transform(window, shape):
+	"""
+	Return the real-input FFT of the window function, zero-padded to
+	shape, re-using a previously computed transform if possible.
+	"""
+	window = numpy.ascontiguousarray(window)
+	key = (hashlib.sha1(window).hexdigest(), window.shape, window.dtype.str, shape)
+	return _window_transforms.get(key, lambda: _fft.rfftn(window, shape, **_fft_kwargs))
+
+
+def _separable_factors(window):
+	"""
+	If the window function is the outer product of 1-dimensional
+	windows, as are the windows returned by gaussian_window(), return a
+	list of the 1-dimensional windows, one for each dimension,
+	otherwise return None.
+	"""
+	if len(window.shape) == 1:
+		return [window]
+	total = window.sum()
+	if total == 0.:
+		return None
+	dims = range(len(window.shape))
+	factors = [window.sum(axis = tuple(d for d in dims if d != dim)) for dim in dims]
+	# all but the first are normalized so that the outer product has
+	# the same sum as the window
+	factors[1:] = [factor / total for factor in factors[1:]]
+	if not numpy.allclose(reduce(numpy.multiply.outer, factors), window, rtol = 1e-10, atol = abs(window).max() * 1e-13):
+		return None
+	return factors
+
+
 def filter_array(a, window, cyclic = False):
 	"""
 	Filter an array using the window function.  The transformation is
@@ -1646,6 +2537,30 @@ def filter_array(a, window, cyclic = False):
 	This is done silently;  to determine if window function truncation
 	will occur, check for yourself that your window function is smaller
 	than your data in all dimensions.
+
+	If the window function is separable, for example the windows
+	returned by gaussian_window(), the filter is applied as a sequence
+	of 1-dimensional direct-form convolutions, one along each
+	dimension.  This is fast, and has no dynamic range limitations.
+	Otherwise the array is convolved with the window by FFT.  See
+	_fft_filter_array() for more information.
+
+	Example:
+
+	>>> a = numpy.zeros((5, 5))
+	>>> a[2, 2] = 1.
+	>>> a[0, 0] = 1e-20
+	>>> filter_array(a, numpy.outer([0.25, 0.5, 0.25], [0.25, 0.5, 0.25]))
+	array([[  2.50000000e-21,   1.25000000e-21,   0.00000000e+00,
+	          0.00000000e+00,   0.00000000e+00],
+	       [  1.25000000e-21,   6.25000000e-02,   1.25000000e-01,
+	          6.25000000e-02,   0.00000000e+00],
+	       [  0.00000000e+00,   1.25000000e-01,   2.50000000e-01,
+	          1.25000000e-01,   0.00000000e+00],
+	       [  0.00000000e+00,   6.25000000e-02,   1.25000000e-01,
+	          6.25000000e-02,   0.00000000e+00],
+	       [  0.00000000e+00,   0.00000000e+00,   0.00000000e+00,
+	          0.00000000e+00,   0.00000000e+00]])
 	"""
 	assert not cyclic	# no longer supported, maybe in future
 	# check that the window and the data have the same number of
@@ -1666,35 +2581,60 @@ def filter_array(a, window, cyclic = False):
 			window_slices.append(slice(first, first + n))
 		else:
 			window_slices.append(slice(0, window.shape[d]))
-	window = window[window_slices]
-
-	# this loop works around dynamic range limits in the FFT
-	# convolution code.  we move data 4 orders of magnitude at a time
-	# from the original array into a work space, convolve the work
-	# space with the filter, zero the workspace in any elements that
-	# are more than 14 orders of magnitude below the maximum value in
-	# the result, and add the result to the total.
-	result = numpy.zeros_like(a)
-	while a.any():
-		# copy contents of input array to work space
-		workspace = numpy.copy(a)
-
-		# mask = indexes of elements of work space not more than 4
-		# orders of magnitude larger than the smallest non-zero
-		# element.  these are the elements to be processed in this
-		# iteration
-		abs_workspace = abs(workspace)
-		mask = abs_workspace <= abs_workspace[abs_workspace > 0].min() * 1e4
-		del abs_workspace
+	window = window[tuple(window_slices)]
+
+	factors = _separable_factors(window)
+	if factors is None:
+		return _fft_filter_array(a, window)
+
+	# convolve with each 1-D window in turn.  length-1 windows are
+	# just scale factors
+	result = a
+	for d, factor in enumerate(factors):
+		if len(factor) == 1:
+			result = result * factor[0]
+		else:
+			result = ndimage.convolve1d(result, factor, axis = d, mode = "constant", cval = 0.)
+	a[...] = result
+
+	return a
 
-		# zero the masked elements in the input array, zero
-		# everything except the masked elements in the work space
-		a[mask] = 0.
-		workspace[~mask] = 0.
-		del mask
+
+def _fft_filter_array(a, window):
+	"""
+	Convolve the array a with the window function by FFT, in place.
+	The window function must be no larger than a in any dimension.
+
+	The FFT convolution has a dynamic range of about 14 orders of
+	magnitude.  To work around this the array's elements are divided
+	into bands spanning 4 orders of magnitude each, each band is
+	convolved with the window separately, elements of the result more
+	than 14 orders of magnitude below its maximum value are zeroed,
+	and the results summed.  The transform of the window function is
+	computed once and cached for re-use.
+	"""
+	abs_a = abs(a)
+	nonzero = abs_a > 0.
+	if not nonzero.any():
+		return a
+
+	# the size of the transforms, large enough to hold the full
+	# linear convolution, and the part of it that corresponds to a
+	shape = tuple(_next_fast_len(n + m - 1) for n, m in zip(a.shape, window.shape))
+	same = tuple(slice((m - 1) // 2, (m - 1) // 2 + n) for n, m in zip(a.shape, window.shape))
+	transform = _window_transform(window, shape)
+
+	# the band to which each non-zero element belongs
+	band = numpy.zeros(a.shape, dtype = "int")
+	band[nonzero] = numpy.floor(numpy.log10(abs_a[nonzero] / abs_a[nonzero].min()) / 4.)
+	del abs_a
+
+	result = numpy.zeros(a.shape, dtype = "double")
+	for k in numpy.unique(band[nonzero]):
+		workspace = numpy.where(nonzero & (band == k), a, 0.)
 
 		# convolve the work space with the kernel
-		workspace = signaltools.fftconvolve(workspace, window, mode = "same")
+		workspace = _fft.irfftn(_fft.rfftn(workspace, shape, **_fft_kwargs) * transform, shape, **_fft_kwargs)[same]
 
 		# determine the largest value in the work space, and set to
 		# zero anything more than 14 orders of magnitude smaller
@@ -1706,8 +2646,7 @@ def filter_array(a, window, cyclic = False):
 		result += workspace
 		del workspace
 	# overwrite the input with the result
-	# FIXME:  in numpy >= 1.7.0 there is a copyto() function
-	a.flat = result.flat
+	a[...] = result
 
 	return a
 
@@ -1811,9 +2750,27 @@ def marginalize(pdf, dim):
 	From a BinnedArray object containing probability density data (bins
 	whose volume integral is 1), return a new BinnedArray object
 	containing the probability density marginalized over dimension
-	dim.
+	dim.  pdf can also be a SparseBinnedArray object, in which case
+	the result is a SparseBinnedArray object.
+
+	Example:
+
+	>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 5), LinearBins(0, 4, 2))))
+	>>> x.fill((numpy.array([1., 1., 9.]), numpy.array([1., 3., 3.])))
+	0
+	>>> x.to_pdf()
+	>>> marginalize(x, 1).to_dense().array
+	array([ 0.33333333,  0.        ,  0.        ,  0.        ,  0.16666667])
+	>>> marginalize(x.to_dense(), 1).array
+	array([ 0.33333333,  0.        ,  0.        ,  0.        ,  0.16666667])
 	"""
 	dx = pdf.bins[dim].upper() - pdf.bins[dim].lower()
+	if isinstance(pdf, SparseBinnedArray):
+		indices = pdf._unravel_keys()
+		result = SparseBinnedArray(NDBins(pdf.bins[:dim] + pdf.bins[dim+1:]), dtype = pdf.values.dtype)
+		result._accumulate(numpy.ravel_multi_index(indices[:dim] + indices[dim+1:], result.bins.shape), pdf.values * dx[indices[dim]])
+		return result
+
 	dx_shape = [1] * len(pdf.bins)
 	dx_shape[dim] = len(dx)
 	dx.shape = dx_shape
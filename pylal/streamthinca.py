@@ -0,0 +1,375 @@
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+#
+# =============================================================================
+#
+#                                   Preamble
+#
+# =============================================================================
+#
+
+
+"""
+Streaming wrapper around the ligolw_thinca coincidence engine.
+
+ligolw_thinca operates on complete documents.  The StreamThinca class
+defined here accepts sngl_inspiral triggers in batches, buffers them,
+and repeatedly runs ligolw_thinca over the part of the buffer for which
+the triggers from all instruments have been received, so that
+coincidences are reported with a latency bounded by the coincidence
+window plus the latency of the slowest trigger source.
+"""
+
+
+import sys
+import time
+
+
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw.utils import ligolw_add
+from pylal import git_version
+from pylal import ligolw_thinca
+
+
+__version__ = "git id %s" % git_version.id
+__date__ = git_version.date
+
+
+#
+# =============================================================================
+#
+#                              Streaming Coincidence
+#
+# =============================================================================
+#
+
+
+class StreamThinca(object):
+	"""
+	Streaming inspiral coincidence.
+
+	Batches of triggers are added with .add_document(), and
+	coincidences are retrieved with .pull().  Time is divided by a
+	boundary:  all coincs whose earliest trigger precedes the boundary
+	have been reported, and triggers preceding the boundary have been
+	discarded.  Each call to .pull() advances the boundary to the
+	coincidence window before the time up to which every instrument
+	has been analyzed, as given by the out segments of the
+	search_summary rows received with its triggers, and reports the
+	coincs whose earliest trigger is between the old and new
+	boundaries.  Any coinc containing such a trigger is composed
+	entirely of triggers that have already been received, so each
+	coinc is reported exactly once.  Triggers are not analyzed until
+	a search_summary row covering them has been received.
+
+	An instrument from which no documents have been received for
+	max_wait seconds of wall-clock time is not waited for, which
+	bounds the latency when one of the trigger sources stalls.
+
+	Example:
+
+	>>> stream = StreamThinca(process, time_slide_table, 5.0, 0.1)
+	>>> stream.add_document(xmldoc)
+	>>> xmldoc, coincs, coinc_event_ids = stream.pull()
+	>>> coincs.write_documents(coinc_event_ids, filename_func)
+	>>> stream.record_latencies()
+	"""
+	def __init__(self, process, time_slide_table, thresholds, coinc_window, event_comparefunc = ligolw_thinca.inspiral_coinc_compare, ntuple_comparefunc = ligolw_thinca.default_ntuple_comparefunc, effective_snr_factor = 250.0, trigger_program = u"inspiral", max_wait = 60.0, verbose = False):
+		"""
+		process is the process table row to which the coincs will
+		be blamed.  time_slide_table is a time_slide table
+		containing the offset vectors to analyze.  thresholds is
+		the e-thinca parameter.  coinc_window is the largest time
+		separation, in seconds, allowed between the triggers in a
+		coinc, not including time slides.
+		"""
+		self.process = process
+		self.time_slide_table = time_slide_table
+		self.thresholds = thresholds
+		self.coinc_window = coinc_window
+		self.event_comparefunc = event_comparefunc
+		self.ntuple_comparefunc = ntuple_comparefunc
+		self.effective_snr_factor = effective_snr_factor
+		self.trigger_program = trigger_program
+		self.max_wait = max_wait
+		self.verbose = verbose
+
+		#
+		# how far a trigger can be from the earliest trigger in a
+		# coinc:  the coincidence window plus the greatest
+		# relative offset among the time slides
+		#
+
+		self.window = coinc_window + max([max(offsets.values()) - min(offsets.values()) for offsets in time_slide_table.as_dict().values()] or [0.])
+
+		#
+		# buffered triggers and the metadata that describes them
+		#
+
+		self.events = []
+		self.process_index = {}
+		self.process_params_index = {}
+		self.search_summary_index = {}
+		self.columnnames = {}
+
+		#
+		# per-instrument end of the latest search_summary out
+		# segment, and the wall-clock time at which a document from
+		# the instrument was last received
+		#
+
+		self.analyzed = {}
+		self.last_heard = {}
+
+		#
+		# the coinc boundary, the batches whose triggers have not
+		# all been passed by it, as (arrival time, latest trigger
+		# end time, trigger count) tuples, and the batches that
+		# have been passed by it but whose coincs have not yet been
+		# recorded as written, as (arrival time, trigger count)
+		# tuples
+		#
+
+		self.boundary = None
+		self.pending = []
+		self.completed = []
+
+		#
+		# latency of each completed batch, as (arrival time,
+		# latency, trigger count) tuples.  consumers should drain
+		# this list
+		#
+
+		self.latencies = []
+
+	def add_document(self, xmldoc, arrival = None):
+		"""
+		Add the sngl_inspiral triggers in xmldoc to the buffer,
+		together with the process, process_params and
+		search_summary rows that describe them.  The out segments
+		of the search_summary rows record how far each instrument
+		has been analyzed;  a document with a search_summary table
+		and no triggers advances them too.  The row IDs in xmldoc
+		are reassigned.  arrival is the wall-clock time at which
+		the document was received (default = now).  Triggers
+		preceding the coinc boundary arrived too late to be
+		analyzed and are discarded.  The document is read
+		completely before the buffer is modified, so if it is
+		malformed the exception leaves the buffer as it was.
+		Returns the number of triggers added.
+		"""
+		if arrival is None:
+			arrival = time.time()
+		ligolw_add.reassign_ids(xmldoc)
+
+		tables = []
+		for tblcls, index, multi in ((lsctables.ProcessTable, self.process_index, False), (lsctables.ProcessParamsTable, self.process_params_index, True), (lsctables.SearchSummaryTable, self.search_summary_index, False)):
+			try:
+				tables.append((tblcls.get_table(xmldoc), index, multi))
+			except ValueError:
+				continue
+		try:
+			sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(xmldoc)
+		except ValueError:
+			sngl_inspiral_table = None
+
+		#
+		# extract the out segments and the trigger end times
+		#
+
+		analyzed = {}
+		for tbl, index, multi in tables:
+			if tbl.tableName == lsctables.SearchSummaryTable.tableName:
+				for row in tbl:
+					end = row.get_out()[1]
+					for instrument in row.get_ifos() or ():
+						analyzed[instrument] = max(analyzed.get(instrument, end), end)
+		if sngl_inspiral_table is not None:
+			ends = [(event, event.get_end()) for event in sngl_inspiral_table]
+		else:
+			ends = []
+
+		#
+		# add them to the buffer
+		#
+
+		for tbl, index, multi in tables:
+			self.columnnames[tbl.tableName] = tbl.columnnames
+			for row in tbl:
+				if multi:
+					index.setdefault(row.process_id, []).append(row)
+				else:
+					index[row.process_id] = row
+		for instrument, end in analyzed.items():
+			if instrument not in self.analyzed or end > self.analyzed[instrument]:
+				self.analyzed[instrument] = end
+			self.last_heard[instrument] = arrival
+
+		if sngl_inspiral_table is None:
+			return 0
+		self.columnnames[sngl_inspiral_table.tableName] = sngl_inspiral_table.columnnames
+		ends = [(event, end) for event, end in ends if self.boundary is None or end >= self.boundary]
+		if self.verbose and len(ends) < len(sngl_inspiral_table):
+			print >>sys.stderr, "discarded %d late triggers" % (len(sngl_inspiral_table) - len(ends))
+		if not ends:
+			return 0
+		self.events.extend(event for event, end in ends)
+		for event, end in ends:
+			self.last_heard[event.ifo] = arrival
+		self.pending.append((arrival, max(end for event, end in ends), len(ends)))
+		return len(ends)
+
+	def complete_until(self, now = None):
+		"""
+		Return the time up to which every instrument that has been
+		heard from within max_wait seconds of now (default = now)
+		has been analyzed, according to the search_summary out
+		segments received, or None if there is no such instrument
+		or one of them has not reported an out segment.
+		"""
+		if now is None:
+			now = time.time()
+		instruments = [instrument for instrument, heard in self.last_heard.items() if now - heard <= self.max_wait]
+		if not instruments or any(instrument not in self.analyzed for instrument in instruments):
+			return None
+		return min(self.analyzed[instrument] for instrument in instruments)
+
+	def _new_document(self, events):
+		"""
+		Construct a document containing the triggers events and
+		the metadata required to run ligolw_thinca() on them.
+		"""
+		xmldoc = ligolw.Document()
+		xmldoc.appendChild(ligolw.LIGO_LW())
+
+		def new_table(tblcls):
+			return xmldoc.childNodes[-1].appendChild(lsctables.New(tblcls, self.columnnames.get(tblcls.tableName)))
+
+		process_table = new_table(lsctables.ProcessTable)
+		process_table.append(self.process)
+		process_table.extend(self.process_index.values())
+		process_params_table = new_table(lsctables.ProcessParamsTable)
+		for rows in self.process_params_index.values():
+			process_params_table.extend(rows)
+		new_table(lsctables.SearchSummaryTable).extend(self.search_summary_index.values())
+		new_table(lsctables.SnglInspiralTable).extend(events)
+		xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.TimeSlideTable, self.time_slide_table.columnnames)).extend(self.time_slide_table)
+		return xmldoc
+
+	def pull(self, flush = False, now = None):
+		"""
+		Advance the coinc boundary and run the coincidence engine on
+		the buffered triggers.  If flush is True, the boundary is
+		advanced past all buffered triggers, otherwise it is
+		advanced as described above.  Returns a tuple of the
+		document that was analyzed, the
+		ligolw_thinca.sngl_inspiral_coincs built from it, and a
+		list of the coinc_event_ids of the coincs that are now
+		complete, or None if the boundary could not be advanced.
+		Once the coincs have been written, .record_latencies()
+		should be called to record the latencies of the batches
+		that they complete.
+		"""
+		if now is None:
+			now = time.time()
+		if flush:
+			if not self.events:
+				return None
+			boundary = max(event.get_end() for event in self.events) + self.window + 1
+			complete = boundary
+		else:
+			complete = self.complete_until(now)
+			if complete is None:
+				return None
+			boundary = complete - self.window
+			if self.boundary is not None and boundary <= self.boundary:
+				return None
+
+		#
+		# run coincidence on the triggers that precede the time up
+		# to which all instruments are complete
+		#
+
+		t_start = time.time()
+		events = [event for event in self.events if event.get_end() < complete]
+		xmldoc = self._new_document(events)
+		ligolw_thinca.ligolw_thinca(
+			xmldoc,
+			process_id = self.process.process_id,
+			coinc_definer_row = ligolw_thinca.InspiralCoincDef,
+			event_comparefunc = self.event_comparefunc,
+			thresholds = self.thresholds,
+			ntuple_comparefunc = self.ntuple_comparefunc,
+			effective_snr_factor = self.effective_snr_factor,
+			trigger_program = self.trigger_program,
+			max_dt = self.coinc_window
+		)
+
+		#
+		# keep the coincs whose earliest trigger precedes the new
+		# boundary.  the triggers preceding the old boundary have
+		# already been discarded so coincs reported by the
+		# previous pass cannot be found again
+		#
+
+		coincs = ligolw_thinca.sngl_inspiral_coincs(xmldoc)
+		coinc_event_ids = [coinc_event_id for coinc_event_id in coincs if min(event.get_end() for event in coincs.sngl_inspirals(coinc_event_id)) < boundary]
+
+		#
+		# advance the boundary, discard the triggers preceding it
+		# and the metadata no longer needed to describe them
+		#
+
+		self.boundary = boundary
+		self.events = [event for event in self.events if event.get_end() >= boundary]
+		process_ids = set(event.process_id for event in self.events)
+		for process_id, row in self.search_summary_index.items():
+			if row.get_out()[1] >= boundary:
+				process_ids.add(process_id)
+		for index in (self.process_index, self.process_params_index, self.search_summary_index):
+			for process_id in set(index) - process_ids:
+				del index[process_id]
+
+		#
+		# the batches that are now complete;  their latencies are
+		# recorded once the coincs have been written
+		#
+
+		still_pending = []
+		for arrival, end, n in self.pending:
+			if end < boundary:
+				self.completed.append((arrival, n))
+			else:
+				still_pending.append((arrival, end, n))
+		self.pending = still_pending
+
+		if self.verbose:
+			print >>sys.stderr, "coinc boundary advanced to %s:  %d triggers analyzed, %d coincs completed in %.3f s, %d triggers buffered" % (boundary, len(events), len(coinc_event_ids), time.time() - t_start, len(self.events))
+
+		return xmldoc, coincs, coinc_event_ids
+
+	def record_latencies(self, now = None):
+		"""
+		Record, in .latencies, the latency of the batches completed
+		by the calls to .pull() since the last call, measured to
+		now (default = now), which should be the time at which
+		their coincs were written.
+		"""
+		if now is None:
+			now = time.time()
+		self.latencies.extend((arrival, now - arrival, n) for arrival, n in self.completed)
+		del self.completed[:]
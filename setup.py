@@ -280,6 +280,7 @@ setup(
         os.path.join("bin", "ligolw_cbc_dbinjfind"),
         os.path.join("bin", "ligolw_cbc_hardware_inj_page"),
         os.path.join("bin", "ligolw_cbc_jitter_skyloc"),
+        os.path.join("bin", "ligolw_cbc_merge_dbs"),
         os.path.join("bin", "ligolw_cbc_plotcumhist"),
         os.path.join("bin", "ligolw_cbc_plotfm"),
         os.path.join("bin", "ligolw_cbc_plotifar"),
@@ -288,6 +289,7 @@ setup(
         os.path.join("bin", "ligolw_cbc_printmissed"),
         os.path.join("bin", "ligolw_cbc_printsims"),
         os.path.join("bin", "ligolw_cbc_sstinca"),
+        os.path.join("bin", "ligolw_cbc_streamthinca"),
         os.path.join("bin", "pylal_cbc_cohptf_efficiency"),
         os.path.join("bin", "pylal_cbc_cohptf_html_summary"),
         os.path.join("bin", "pylal_cbc_cohptf_injcombiner"),
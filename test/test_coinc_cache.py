@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Unit test suite for pylal.coinc_cache.
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from pylal import coinc_cache
+
+
+def new_document(snrs):
+	"""
+	Construct a document holding a sngl_inspiral trigger for each of
+	snrs and a time_slide table with a single offset vector.  The IDs
+	start from 0, as when the same file is read by two jobs.
+	"""
+	for cls in (lsctables.ProcessTable, lsctables.SnglInspiralTable, lsctables.TimeSlideTable):
+		cls.reset_next_id()
+	xmldoc = ligolw.Document()
+	xmldoc.appendChild(ligolw.LIGO_LW())
+	sngl_inspiral_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SnglInspiralTable, ["event_id", "ifo", "end_time", "end_time_ns", "snr"]))
+	for i, snr in enumerate(snrs):
+		event = sngl_inspiral_table.RowType()
+		event.event_id = sngl_inspiral_table.get_next_id()
+		event.ifo = ("H1", "L1")[i % 2]
+		event.end_time, event.end_time_ns = 1000000000 + i, 0
+		event.snr = snr
+		sngl_inspiral_table.append(event)
+	time_slide_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.TimeSlideTable, ["process_id", "time_slide_id", "instrument", "offset"]))
+	for instrument in ("H1", "L1"):
+		row = time_slide_table.RowType()
+		row.process_id = lsctables.ProcessTable.get_next_id()
+		row.time_slide_id = lsctables.TimeSlideTable.get_next_id()
+		row.instrument = instrument
+		row.offset = 0.0
+		time_slide_table.append(row)
+	return xmldoc
+
+
+def add_coincs(xmldoc, process_id, coinc_def_id, n):
+	"""
+	Add n coincs of two triggers each, made by process_id, to xmldoc.
+	"""
+	sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(xmldoc)
+	coinc_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincTable, ["process_id", "coinc_def_id", "coinc_event_id", "time_slide_id", "instruments", "nevents", "likelihood"]))
+	coinc_map_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincMapTable))
+	coinc_inspiral_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincInspiralTable, ["coinc_event_id", "ifos", "end_time", "end_time_ns", "snr"]))
+	for i in xrange(n):
+		events = sngl_inspiral_table[2 * i : 2 * i + 2]
+		coinc = coinc_table.RowType()
+		coinc.process_id = process_id
+		coinc.coinc_def_id = coinc_def_id
+		coinc.coinc_event_id = coinc_table.get_next_id()
+		coinc.time_slide_id = lsctables.TimeSlideTable.get_table(xmldoc)[0].time_slide_id
+		coinc.set_instruments(event.ifo for event in events)
+		coinc.nevents = len(events)
+		coinc.likelihood = None
+		coinc_table.append(coinc)
+		for event in events:
+			coinc_map = coinc_map_table.RowType()
+			coinc_map.coinc_event_id = coinc.coinc_event_id
+			coinc_map.table_name = event.event_id.table_name
+			coinc_map.event_id = event.event_id
+			coinc_map_table.append(coinc_map)
+		coinc_inspiral = coinc_inspiral_table.RowType()
+		coinc_inspiral.coinc_event_id = coinc.coinc_event_id
+		coinc_inspiral.set_ifos(event.ifo for event in events)
+		coinc_inspiral.end_time, coinc_inspiral.end_time_ns = events[0].end_time, events[0].end_time_ns
+		coinc_inspiral.snr = sum(event.snr**2. for event in events)**.5
+		coinc_inspiral_table.append(coinc_inspiral)
+
+
+class coinc_tables(object):
+	"""
+	The parts of ligolw_thinca.InspiralCoincTables used by
+	insert_coincs().
+	"""
+	def __init__(self):
+		self.coinctable = lsctables.New(lsctables.CoincTable, ["process_id", "coinc_def_id", "coinc_event_id", "time_slide_id", "instruments", "nevents", "likelihood"])
+		self.coincmaptable = lsctables.New(lsctables.CoincMapTable)
+		self.coinc_inspiral_table = lsctables.New(lsctables.CoincInspiralTable, ["coinc_event_id", "ifos", "end_time", "end_time_ns", "snr"])
+
+
+def comparefunc(a, b, threshold = 0.005):
+	return abs(a - b) > threshold
+
+
+def wide_comparefunc(a, b, threshold = 0.010):
+	return abs(a - b) > threshold
+# same name as comparefunc, so only the default arguments tell them apart
+wide_comparefunc.__name__ = comparefunc.__name__
+
+
+class test_coinc_cache_key(unittest.TestCase):
+	def test_hit(self):
+		"""The same input gives the same key."""
+		self.assertEqual(coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.005, event_comparefunc = comparefunc), coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.005, event_comparefunc = comparefunc))
+
+	def test_miss(self):
+		"""Changing the triggers, the thresholds, or the default
+		arguments of a comparison function changes the key."""
+		key = coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.005, event_comparefunc = comparefunc)
+		self.assertNotEqual(coinc_cache.coinc_cache_key(new_document([8., 9., 11.]), 0.005, event_comparefunc = comparefunc), key)
+		self.assertNotEqual(coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.010, event_comparefunc = comparefunc), key)
+		self.assertNotEqual(coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.005, event_comparefunc = wide_comparefunc), key)
+		self.assertNotEqual(coinc_cache.coinc_cache_key(new_document([8., 9., 10.]), 0.005, event_comparefunc = comparefunc, effective_snr_factor = 250.), key)
+
+
+class test_CoincCache(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def new_entry(self, n):
+		xmldoc = new_document([8. + i for i in xrange(2 * n)])
+		process_id = lsctables.ProcessTable.get_next_id()
+		coinc_def_id = lsctables.CoincDefTable.get_next_id()
+		add_coincs(xmldoc, process_id, coinc_def_id, n)
+		return coinc_cache.coinc_cache_key(xmldoc, 0.005), coinc_cache.extract_coincs(xmldoc, process_id, coinc_def_id)
+
+	def test_hit(self):
+		"""A stored entry is returned, and its coincs can be
+		re-inserted."""
+		cache = coinc_cache.CoincCache(self.directory)
+		key, coincs = self.new_entry(3)
+		self.assertEqual(cache.get(key), None)
+		cache.put(key, coincs)
+		self.assertTrue(key in cache)
+		self.assertEqual(cache.get(key), coincs)
+
+		tables = coinc_tables()
+		process_id = lsctables.ProcessTable.get_next_id()
+		self.assertEqual(coinc_cache.insert_coincs(tables, process_id, lsctables.CoincDefTable.get_next_id(), cache.get(key)), 3)
+		self.assertEqual(len(tables.coinctable), 3)
+		self.assertEqual(len(tables.coincmaptable), 6)
+		self.assertEqual(len(tables.coinc_inspiral_table), 3)
+		self.assertEqual(set(row.process_id for row in tables.coinctable), set([process_id]))
+		self.assertEqual(set(row.coinc_event_id for row in tables.coincmaptable), set(row.coinc_event_id for row in tables.coinctable))
+
+	def test_corrupt(self):
+		"""A corrupt entry is removed and treated as a miss."""
+		cache = coinc_cache.CoincCache(self.directory)
+		key, coincs = self.new_entry(1)
+		cache.put(key, coincs)
+		open(cache.filename(key), "wb").write("not a cache entry")
+		self.assertEqual(cache.get(key), None)
+		self.assertFalse(key in cache)
+
+	def test_eviction(self):
+		"""When the cache is over --coinc-cache-size, the least
+		recently used entries are evicted."""
+		cache = coinc_cache.CoincCache(self.directory, max_size = 2**30)
+		entries = [self.new_entry(n) for n in (1, 2, 3)]
+		for i, (key, coincs) in enumerate(entries):
+			cache.put(key, coincs)
+			os.utime(cache.filename(key), (1000. + i, 1000. + i))
+		sizes = [os.path.getsize(cache.filename(key)) for key, coincs in entries]
+
+		# using the oldest entry makes the second the least recently
+		# used one
+		self.assertEqual(cache.get(entries[0][0]), entries[0][1])
+
+		# as in ligolw_cbc_sstinca, the size is given in megabytes
+		coinc_cache_size = (sum(sizes) - 1) / 1024.**2
+		cache.max_size = int(coinc_cache_size * 1024**2)
+		cache.evict()
+		self.assertEqual([key in cache for key, coincs in entries], [True, False, True])
+
+		cache.max_size = 0
+		cache.evict()
+		self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+	suite = unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Unit test suite for pylal.imr_utils.
+"""
+
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw.utils import ligolw_sqlite
+from pylal import imr_utils
+
+
+def append_table(xmldoc, cls, rows):
+	"""
+	Append a table of class cls to xmldoc, with a row for each of the
+	dictionaries of column values in rows.
+	"""
+	tbl = xmldoc.childNodes[-1].appendChild(lsctables.New(cls, sorted(rows[0])))
+	for values in rows:
+		row = tbl.RowType()
+		for column, value in values.items():
+			setattr(row, column, value)
+		tbl.append(row)
+
+
+def make_database(filename, start, sim = False):
+	"""
+	Write a ringdown database covering [start, start + 100) in H1 and
+	L1, with a zero-lag and a time-slide coinc, or, if sim is True, with
+	three injections of which the first two are found.
+	"""
+	for cls in (lsctables.ProcessTable, lsctables.TimeSlideTable, lsctables.CoincTable, lsctables.SimInspiralTable):
+		cls.reset_next_id()
+	process_id = lsctables.ProcessTable.get_next_id()
+	rows = dict((cls, []) for cls in (lsctables.ProcessTable, lsctables.SearchSummaryTable, lsctables.TimeSlideTable, lsctables.CoincTable, lsctables.CoincRingdownTable, lsctables.SimInspiralTable, lsctables.CoincMapTable))
+	rows[lsctables.ProcessTable].append({"process_id": process_id, "program": u"test_program", "ifos": u"H1,L1"})
+	for instrument in (u"H1", u"L1"):
+		rows[lsctables.SearchSummaryTable].append({"process_id": process_id, "ifos": instrument, "out_start_time": start, "out_start_time_ns": 0, "out_end_time": start + 100, "out_end_time_ns": 0})
+	time_slide_ids = [lsctables.TimeSlideTable.get_next_id() for n in range(2)]
+	for n, time_slide_id in enumerate(time_slide_ids):
+		for instrument in (u"H1", u"L1"):
+			rows[lsctables.TimeSlideTable].append({"process_id": process_id, "time_slide_id": time_slide_id, "instrument": instrument, "offset": instrument == u"L1" and 5. * n or 0.})
+
+	def add_coinc(time, far, time_slide_id):
+		coinc_event_id = lsctables.CoincTable.get_next_id()
+		rows[lsctables.CoincTable].append({"process_id": process_id, "coinc_event_id": coinc_event_id, "time_slide_id": time_slide_id, "instruments": u"H1,L1", "nevents": 2})
+		rows[lsctables.CoincRingdownTable].append({"coinc_event_id": coinc_event_id, "ifos": u"H1,L1", "start_time": time, "start_time_ns": 0, "false_alarm_rate": far})
+		return coinc_event_id
+
+	if not sim:
+		add_coinc(start + 10, 1e-3 * start, time_slide_ids[0])
+		add_coinc(start + 20, 2e-3 * start, time_slide_ids[1])
+	else:
+		for n in range(3):
+			simulation_id = lsctables.SimInspiralTable.get_next_id()
+			rows[lsctables.SimInspiralTable].append({"process_id": process_id, "simulation_id": simulation_id, "geocent_end_time": start + 10 * (n + 1), "geocent_end_time_ns": 0, "distance": 10. * (n + 1)})
+			if n == 2:
+				continue
+			coinc_event_id = add_coinc(start + 10 * (n + 1), 1e-4 * (n + 1), time_slide_ids[0])
+			sim_coinc_event_id = lsctables.CoincTable.get_next_id()
+			rows[lsctables.CoincTable].append({"process_id": process_id, "coinc_event_id": sim_coinc_event_id, "time_slide_id": time_slide_ids[0], "instruments": None, "nevents": 2})
+			rows[lsctables.CoincMapTable].append({"coinc_event_id": sim_coinc_event_id, "table_name": u"sim_inspiral", "event_id": simulation_id})
+			rows[lsctables.CoincMapTable].append({"coinc_event_id": sim_coinc_event_id, "table_name": u"coinc_event", "event_id": coinc_event_id})
+
+	xmldoc = ligolw.Document()
+	xmldoc.appendChild(ligolw.LIGO_LW())
+	for cls, values in rows.items():
+		if values:
+			append_table(xmldoc, cls, values)
+	connection = sqlite3.connect(filename)
+	ligolw_sqlite.insert_from_xmldoc(connection, xmldoc, preserve_ids = True)
+	connection.close()
+
+
+def summarize(summary):
+	"""
+	Return the contents of a DataBaseSummary that do not depend on how
+	the databases were read.
+	"""
+	def injections(by_instrument_set, found = False):
+		return dict((instruments, sorted((str(sim.simulation_id), far) for far, sim in sims) if found else sorted(str(sim.simulation_id) for sim in sims)) for instruments, sims in by_instrument_set.items())
+	return {
+		"segments": summary.segments,
+		"instruments": summary.instruments,
+		"table_name": summary.table_name,
+		"numslides": summary.numslides,
+		"zerolag_fars": summary.zerolag_fars_by_instrument_set,
+		"ts_fars": summary.ts_fars_by_instrument_set,
+		"found": injections(summary.found_injections_by_instrument_set, found = True),
+		"missed": injections(summary.missed_injections_by_instrument_set),
+		"total": injections(summary.total_injections_by_instrument_set)
+	}
+
+
+class test_DataBaseSummary(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.filenames = [os.path.join(self.tmp_dir, "%d.sqlite" % n) for n in range(3)]
+		make_database(self.filenames[0], 1000)
+		make_database(self.filenames[1], 2000)
+		make_database(self.filenames[2], 1000, sim = True)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def test_serial_pooled(self):
+		"""Reading the databases one after the other and in a pool
+		of worker processes gives the same summary."""
+		serial = imr_utils.DataBaseSummary(self.filenames, live_time_program = "test_program")
+		pooled = imr_utils.DataBaseSummary(self.filenames, live_time_program = "test_program", nproc = 2)
+		self.assertEqual(summarize(serial), summarize(pooled))
+		contents = summarize(serial)
+		self.assertEqual(contents["table_name"], "coinc_ringdown")
+		self.assertEqual(contents["numslides"], 2)
+		self.assertEqual(contents["zerolag_fars"], {frozenset(["H1", "L1"]): [1., 2.]})
+		self.assertEqual(contents["ts_fars"], {frozenset(["H1", "L1"]): [2., 4.]})
+		self.assertEqual([len(sims) for sims in contents["found"].values()], [2])
+		self.assertEqual([len(sims) for sims in contents["missed"].values()], [1])
+		self.assertEqual(abs(contents["segments"]), {"H1": 200, "L1": 200})
+		self.assertEqual(pooled.coinc_ringdown, None)
+
+	def test_tables(self):
+		"""In serial mode, the analysis table of the last database
+		remains usable after the databases are closed."""
+		summary = imr_utils.DataBaseSummary(self.filenames[:2], live_time_program = "test_program")
+		self.assertEqual(len(summary.coinc_ringdown), 2)
+		self.assertEqual(sorted(row.start_time for row in summary.coinc_ringdown), [2010, 2020])
+		self.assertEqual(summary.coinc_inspiral, None)
+
+
+if __name__ == '__main__':
+	suite = unittest.main()
@@ -0,0 +1,889 @@
+#!/usr/bin/env python
+
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+from glue import segments
+from glue.ligolw import dbtables
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw import table
+from glue.ligolw.utils import ligolw_sqlite
+from pylal import ligolw_sqlutils as sqlutils
+
+
+def make_job_database(filename, seed, nslides = 3, ntriggers = 40):
+    """
+    Writes a database like that of one job of an analysis: one experiment,
+    with a zero-lag and nslides - 1 time-slide experiment_summary rows, and
+    ntriggers coincs, with random snrs, spread over them. Every job has the
+    same experiment and time slides, so merged jobs share them.
+    """
+    rng = random.Random(seed)
+    xmldoc = ligolw.Document()
+    xmldoc.appendChild(ligolw.LIGO_LW())
+    def new_table(cls, columns):
+        return xmldoc.childNodes[-1].appendChild(lsctables.New(cls, columns))
+    time_slide_table = new_table(lsctables.TimeSlideTable, ['time_slide_id', 'instrument', 'offset'])
+    experiment_table = new_table(lsctables.ExperimentTable, ['experiment_id', 'search', 'search_group', 'instruments', 'gps_start_time', 'gps_end_time', 'lars_id', 'comments'])
+    summary_table = new_table(lsctables.ExperimentSummaryTable, ['experiment_summ_id', 'experiment_id', 'time_slide_id', 'veto_def_name', 'datatype', 'sim_proc_id', 'duration', 'nevents'])
+    map_table = new_table(lsctables.ExperimentMapTable, ['experiment_summ_id', 'coinc_event_id'])
+    coinc_table = new_table(lsctables.CoincTable, ['coinc_event_id', 'time_slide_id', 'instruments', 'nevents'])
+    coinc_inspiral_table = new_table(lsctables.CoincInspiralTable, ['coinc_event_id', 'ifos', 'snr', 'false_alarm_rate', 'combined_far'])
+
+    experiment = lsctables.Experiment()
+    experiment.experiment_id = experiment_table.get_next_id()
+    experiment.search, experiment.search_group, experiment.instruments = u'test', u'test', u'H1,L1'
+    experiment.gps_start_time, experiment.gps_end_time = 0, 1000
+    experiment.lars_id = experiment.comments = None
+    experiment_table.append(experiment)
+
+    summaries = []
+    for n in range(nslides):
+        summary = lsctables.ExperimentSummary()
+        summary.experiment_summ_id = summary_table.get_next_id()
+        summary.experiment_id = experiment.experiment_id
+        summary.time_slide_id = lsctables.TimeSlideTable.next_id + n
+        for instrument, offset in ((u'H1', 0.), (u'L1', 5. * n)):
+            row = lsctables.TimeSlide()
+            row.time_slide_id, row.instrument, row.offset = summary.time_slide_id, instrument, offset
+            time_slide_table.append(row)
+        summary.veto_def_name = u'VETO_CAT2'
+        summary.datatype = n and u'slide' or u'all_data'
+        summary.sim_proc_id = None
+        summary.duration = rng.randint(100, 200)
+        summary.nevents = 0
+        summary_table.append(summary)
+        summaries.append(summary)
+
+    for n in range(ntriggers):
+        summary = rng.choice(summaries)
+        summary.nevents += 1
+        coinc = lsctables.Coinc()
+        coinc.coinc_event_id = coinc_table.get_next_id()
+        coinc.time_slide_id = summary.time_slide_id
+        coinc.instruments = u'H1,L1'
+        coinc.nevents = 2
+        coinc_table.append(coinc)
+        coinc_inspiral = lsctables.CoincInspiral()
+        coinc_inspiral.coinc_event_id = coinc.coinc_event_id
+        coinc_inspiral.ifos = rng.choice([u'H1,L1', u'H1,V1'])
+        coinc_inspiral.snr = round(rng.uniform(5., 10.), 1)
+        coinc_inspiral.false_alarm_rate = coinc_inspiral.combined_far = None
+        coinc_inspiral_table.append(coinc_inspiral)
+        row = lsctables.ExperimentMap()
+        row.experiment_summ_id, row.coinc_event_id = summary.experiment_summ_id, coinc.coinc_event_id
+        map_table.append(row)
+
+    connection = sqlite3.connect(filename)
+    ligolw_sqlite.insert_from_xmldoc(connection, xmldoc, preserve_ids = True)
+    connection.close()
+
+
+def append_table(xmldoc, cls, rows):
+    """
+    Appends a table of class cls to xmldoc, with a row for each of the
+    dictionaries of column values in rows.
+    """
+    tbl = xmldoc.childNodes[-1].appendChild(lsctables.New(cls, sorted(rows[0])))
+    for values in rows:
+        row = tbl.RowType()
+        for column, value in values.items():
+            setattr(row, column, value)
+        tbl.append(row)
+
+
+def make_merge_job(filename, job):
+    """
+    Writes a document like that of one job of a pipeline, for merging:
+    the segments and veto definitions and the injection process are the
+    same for all jobs, the inspiral jobs are shared by every third job, and
+    the experiment and time slides are the same for all jobs but have
+    injection and non-injection experiment_summary rows in alternate jobs.
+    The document is written with its IDs starting from 0, so they collide
+    with those of the other jobs.
+    """
+    rng = random.Random(job)
+    injection = job % 2
+    rows = dict((cls, []) for cls in (lsctables.ProcessTable, lsctables.ProcessParamsTable, lsctables.SearchSummaryTable, lsctables.SegmentDefTable, lsctables.SegmentSumTable, lsctables.SegmentTable, lsctables.VetoDefTable, lsctables.SimInspiralTable, lsctables.SnglInspiralTable, lsctables.TimeSlideTable, lsctables.CoincDefTable, lsctables.CoincTable, lsctables.ExperimentTable, lsctables.ExperimentSummaryTable, lsctables.ExperimentMapTable))
+    def new_id(cls):
+        return cls.next_id + len(rows[cls])
+    def new_process(program, start_time, ifos = None):
+        process_id = new_id(lsctables.ProcessTable)
+        rows[lsctables.ProcessTable].append({'process_id': process_id, 'program': program, 'start_time': start_time, 'end_time': start_time + 1, 'username': u'user', 'node': u'node', 'version': u'1', 'ifos': ifos, 'cvs_entry_time': 0, 'cvs_repository': u'repo', 'comment': None})
+        return process_id
+
+    process_id = new_process(u'ligolw_segments_from_cats', 0, u'H1')
+    segment_def_id = new_id(lsctables.SegmentDefTable)
+    rows[lsctables.SegmentDefTable].append({'process_id': process_id, 'segment_def_id': segment_def_id, 'ifos': u'H1', 'name': u'CAT1', 'version': 1})
+    rows[lsctables.SegmentSumTable].append({'process_id': process_id, 'segment_sum_id': new_id(lsctables.SegmentSumTable), 'segment_def_id': segment_def_id, 'start_time': 0, 'end_time': 100})
+    rows[lsctables.SegmentTable].append({'process_id': process_id, 'segment_id': new_id(lsctables.SegmentTable), 'segment_def_id': segment_def_id, 'start_time': 10, 'end_time': 20})
+
+    process_id = new_process(u'ligolw_segments_compat', 5, u'H1')
+    rows[lsctables.VetoDefTable].append({'process_id': process_id, 'ifo': u'H1', 'name': u'VETO_CAT2', 'version': 1, 'category': 2})
+
+    inj_process_id = new_process(u'inspinj', 1)
+    rows[lsctables.ProcessParamsTable].append({'process_id': inj_process_id, 'program': u'inspinj', 'param': u'--seed', 'value': u'7', 'type': u'int'})
+    rows[lsctables.SimInspiralTable].append({'process_id': inj_process_id, 'simulation_id': new_id(lsctables.SimInspiralTable), 'mass1': 1.4})
+
+    thinca_process_id = new_process(u'thinca', 100 + job)
+    process_id = new_process(u'inspiral', job % 3)
+    rows[lsctables.ProcessParamsTable].append({'process_id': process_id, 'program': u'inspiral', 'param': u'--x', 'value': unicode(job % 3), 'type': u'int'})
+    rows[lsctables.SearchSummaryTable].append({'process_id': process_id, 'ifos': u'H1', 'in_start_time': job % 3, 'nevents': 3})
+    for n in range(3):
+        rows[lsctables.SnglInspiralTable].append({'process_id': process_id, 'event_id': new_id(lsctables.SnglInspiralTable), 'snr': rng.uniform(5., 10.)})
+
+    time_slide_ids = []
+    for n in range(2):
+        time_slide_id = lsctables.TimeSlideTable.next_id + n
+        time_slide_ids.append(time_slide_id)
+        for instrument in (u'H1', u'L1'):
+            rows[lsctables.TimeSlideTable].append({'process_id': thinca_process_id, 'time_slide_id': time_slide_id, 'instrument': instrument, 'offset': instrument == u'L1' and 5. * n or 0.})
+    coinc_def_id = new_id(lsctables.CoincDefTable)
+    rows[lsctables.CoincDefTable].append({'coinc_def_id': coinc_def_id, 'search': u'inspiral', 'search_coinc_type': 0, 'description': u'sngl_inspiral<-->sngl_inspiral coincidences'})
+    experiment_id = new_id(lsctables.ExperimentTable)
+    rows[lsctables.ExperimentTable].append({'experiment_id': experiment_id, 'search': u'test', 'search_group': u'test', 'instruments': u'H1,L1', 'gps_start_time': 0, 'gps_end_time': 100, 'lars_id': None, 'comments': None})
+    for time_slide_id in time_slide_ids:
+        experiment_summ_id = new_id(lsctables.ExperimentSummaryTable)
+        rows[lsctables.ExperimentSummaryTable].append({'experiment_summ_id': experiment_summ_id, 'experiment_id': experiment_id, 'time_slide_id': time_slide_id, 'veto_def_name': u'VETO_CAT2', 'datatype': injection and u'simulation' or u'all_data', 'sim_proc_id': injection and inj_process_id or None, 'duration': 10 + job, 'nevents': 2})
+        for n in range(2):
+            coinc_event_id = new_id(lsctables.CoincTable)
+            rows[lsctables.CoincTable].append({'process_id': thinca_process_id, 'coinc_def_id': coinc_def_id, 'coinc_event_id': coinc_event_id, 'time_slide_id': time_slide_id, 'instruments': u'H1,L1', 'nevents': 2, 'likelihood': None})
+            rows[lsctables.ExperimentMapTable].append({'experiment_summ_id': experiment_summ_id, 'coinc_event_id': coinc_event_id})
+
+    xmldoc = ligolw.Document()
+    xmldoc.appendChild(ligolw.LIGO_LW())
+    for cls, values in rows.items():
+        append_table(xmldoc, cls, values)
+    connection = sqlite3.connect(filename)
+    ligolw_sqlite.insert_from_xmldoc(connection, xmldoc, preserve_ids = True)
+    connection.close()
+
+
+def dump_database(connection):
+    """
+    Returns a dictionary of table name -> the sorted rows of the table, for
+    comparing databases.
+    """
+    return dict((table_name, sorted(connection.execute('SELECT * FROM %s' % table_name).fetchall())) for table_name in dbtables.get_table_names(connection))
+
+
+# the triggers and their fars, as update_fars_incrementally wants them
+far_query = """
+    SELECT
+        coinc_inspiral.coinc_event_id, experiment_summary.experiment_id,
+        experiment_summary.experiment_summ_id, coinc_inspiral.ifos, 0,
+        coinc_inspiral.snr, coinc_inspiral.false_alarm_rate,
+        coinc_inspiral.combined_far
+    FROM
+        coinc_inspiral
+        JOIN experiment_map ON (
+            experiment_map.coinc_event_id == coinc_inspiral.coinc_event_id)
+        JOIN experiment_summary ON (
+            experiment_summary.experiment_summ_id == experiment_map.experiment_summ_id)"""
+
+
+def new_summaries(connection):
+    """
+    Returns a Summaries with the durations, datatypes and zero-lag ids of
+    the experiment_summary table filled in.
+    """
+    summaries = sqlutils.Summaries()
+    for eid, esid, datatype, duration in connection.execute('SELECT experiment_id, experiment_summ_id, datatype, duration FROM experiment_summary'):
+        summaries.append_duration(eid, esid, duration)
+        summaries.store_datatypes(eid, esid, datatype)
+        if datatype == 'all_data':
+            summaries.append_zero_lag_id(eid, esid)
+    summaries.calc_bkg_durs()
+    return summaries
+
+
+def calc_fars_from_scratch(connection):
+    """
+    Calculates the fars of every trigger with add_to_bkg_stats and
+    update_fars, and returns a dictionary of coinc_event_id -> (ufar, cfar).
+    """
+    summaries = new_summaries(connection)
+    rows = connection.execute(far_query).fetchall()
+    for ceid, eid, esid, ifos, param_group, stat, ufar, cfar in rows:
+        summaries.add_to_bkg_stats(eid, esid, ifos, param_group, stat)
+    summaries.sort_bkg_stats()
+    summaries.calc_max_bkg_fars(ifo_group = 'ALL_IFOS')
+    summaries.update_fars(connection, 'SELECT coinc_event_id, experiment_id, experiment_summ_id, ifos, param_group, stat FROM (%s)' % far_query.replace('0,', '0 AS param_group,').replace('coinc_inspiral.snr', 'coinc_inspiral.snr AS stat'), 'coinc_inspiral', 'false_alarm_rate', 'combined_far', rank_by = 'MAX', ifo_group = 'ALL_IFOS')
+    return dict((row[0], (row[6], row[7])) for row in connection.execute(far_query))
+
+
+class test_get_connection(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'test.sqlite')
+
+    def tearDown(self):
+        sqlutils.close_connection(self.filename)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_temp_store(self):
+        '''
+        Temporary tables are only kept in memory if asked for.
+        '''
+        default = sqlite3.connect(':memory:').execute('PRAGMA temp_store').fetchone()[0]
+        connection = sqlutils.get_connection(self.filename)
+        self.assertEqual(connection.execute('PRAGMA temp_store').fetchone()[0], default)
+        sqlutils.close_connection(self.filename)
+        connection = sqlutils.get_connection(self.filename, memory_temp_store = True)
+        self.assertEqual(connection.execute('PRAGMA temp_store').fetchone()[0], 2)
+
+    def test_shared(self):
+        '''
+        The open connection is returned when asked for with the same
+        options, and it is an error to ask for it with others.
+        '''
+        connection = sqlutils.get_connection(self.filename, trace = True)
+        self.assertTrue(sqlutils.get_connection(self.filename, trace = True) is connection)
+        self.assertRaises(ValueError, sqlutils.get_connection, self.filename)
+        self.assertRaises(ValueError, sqlutils.get_connection, self.filename, trace = True, explain = True)
+        self.assertRaises(ValueError, sqlutils.get_connection, self.filename, scratch = True, trace = True)
+        sqlutils.close_connection(self.filename)
+        self.assertFalse(sqlutils.get_connection(self.filename) is connection)
+
+
+def row_values(tbl, row):
+    return tuple(getattr(row, column) for column in tbl.columnnames)
+
+
+class test_DeletionPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.executescript("""
+            CREATE TABLE process (process_id TEXT, program TEXT);
+            CREATE TABLE process_params (process_id TEXT, param TEXT);
+            CREATE TABLE search_summary (process_id TEXT);
+            CREATE TABLE sngl_inspiral (process_id TEXT, event_id TEXT);
+            CREATE INDEX sngl_inspiral_pid_idx ON sngl_inspiral (process_id);
+            INSERT INTO process VALUES ('p:0', 'inspiral');
+            INSERT INTO process VALUES ('p:1', 'inspiral');
+            INSERT INTO process VALUES ('p:2', 'thinca');
+            INSERT INTO process_params VALUES ('p:0', '--a');
+            INSERT INTO process_params VALUES ('p:1', '--a');
+            INSERT INTO process_params VALUES ('p:2', '--b');
+            INSERT INTO process_params VALUES (NULL, '--c');
+            INSERT INTO search_summary VALUES ('p:0');
+            INSERT INTO search_summary VALUES ('p:3');
+            INSERT INTO sngl_inspiral VALUES ('p:0', 'e:0');
+            INSERT INTO sngl_inspiral VALUES ('p:0', 'e:1');
+            """)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def indices(self):
+        return sorted(name for (name,) in self.connection.execute("SELECT name FROM sqlite_master WHERE type == 'index'"))
+
+    def temp_tables(self):
+        return self.connection.execute("SELECT name FROM sqlite_temp_master WHERE type == 'table'").fetchall()
+
+    def params(self):
+        return sorted(self.connection.execute('SELECT process_id, param FROM process_params').fetchall())
+
+    def test_not_exists(self):
+        '''
+        delete_where_not_in deletes what NOT IN did, using the key table's
+        index if it has one, a temporary index if it has none, or a keyed
+        table if the keys are filtered or come from a view.
+        '''
+        with sqlutils.DeletionPlanner(self.connection) as planner:
+            planner.delete_where_not_in('process_params', 'process_id', 'sngl_inspiral', 'process_id')
+            self.assertEqual(self.indices(), ['sngl_inspiral_pid_idx'])
+        self.assertEqual(self.params(), [(None, u'--c'), (u'p:0', u'--a')])
+
+        with sqlutils.DeletionPlanner(self.connection) as planner:
+            planner.delete_where_not_in('search_summary', 'process_id', 'process', 'process_id')
+            self.assertEqual(len(self.indices()), 2)
+        self.assertEqual(self.indices(), ['sngl_inspiral_pid_idx'])
+        self.assertEqual(self.connection.execute('SELECT process_id FROM search_summary').fetchall(), [(u'p:0',)])
+
+        self.connection.execute("CREATE VIEW inspiral_process AS SELECT process_id FROM process WHERE program == 'inspiral'")
+        with sqlutils.DeletionPlanner(self.connection) as planner:
+            planner.delete_where_not_in('process', 'process_id', 'process', 'process_id', key_filter = "program == 'inspiral'", where = "program != 'thinca'")
+            planner.delete_where_not_in('process', 'process_id', 'inspiral_process', 'process_id', where = "process_id != 'p:1'")
+            self.assertEqual(len(self.temp_tables()), 2)
+        self.assertEqual(self.temp_tables(), [])
+        self.assertEqual(self.connection.execute('SELECT process_id FROM process').fetchall(), [(u'p:0',), (u'p:1',)])
+
+    def test_null_keys(self):
+        '''
+        Rows whose column is NULL are kept, as they were by NOT IN, but a
+        NULL key no longer stops every row being deleted.
+        '''
+        self.connection.execute("INSERT INTO sngl_inspiral VALUES (NULL, 'e:2')")
+        # NOT IN deletes nothing when the keys include NULL
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM process_params WHERE process_id NOT IN (SELECT process_id FROM sngl_inspiral)').fetchone()[0], 0)
+        with sqlutils.DeletionPlanner(self.connection) as planner:
+            planner.delete_where_not_in('process_params', 'process_id', 'sngl_inspiral', 'process_id')
+        self.assertEqual(self.params(), [(None, u'--c'), (u'p:0', u'--a')])
+
+    def test_dry_run(self):
+        '''
+        A dry run deletes nothing.
+        '''
+        stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+        try:
+            with sqlutils.DeletionPlanner(self.connection, dry_run = True) as planner:
+                planner.delete_where_not_in('process_params', 'process_id', 'process', 'process_id')
+                planner.delete_where_in('process_params', 'process_id', 'SELECT process_id FROM process')
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(len(self.params()), 4)
+        self.assertEqual(self.indices(), ['sngl_inspiral_pid_idx'])
+
+    def test_error(self):
+        '''
+        When a delete fails, the indices and tables of the planner are still
+        dropped.
+        '''
+        def fail():
+            with sqlutils.DeletionPlanner(self.connection) as planner:
+                planner.delete_where_not_in('search_summary', 'process_id', 'process', 'process_id')
+                planner.delete_where_in('process_params', 'process_id', 'SELECT process_id FROM process')
+                planner.delete_where_not_in('process_params', 'no_such_column', 'process', 'process_id')
+        self.assertRaises(sqlite3.OperationalError, fail)
+        self.assertEqual(self.indices(), ['sngl_inspiral_pid_idx'])
+        self.assertEqual(self.temp_tables(), [])
+
+    def test_clean_metadata(self):
+        '''
+        clean_metadata deletes the metadata of the processes that are not
+        in the key tables; it used to delete nothing.
+        '''
+        sqlutils.clean_metadata(self.connection, [('sngl_inspiral', 'process_id', ''), ('process', 'process_id', "program == 'thinca'")])
+        self.assertEqual(self.connection.execute('SELECT process_id FROM process').fetchall(), [(u'p:0',), (u'p:2',)])
+        self.assertEqual(self.params(), [(None, u'--c'), (u'p:0', u'--a'), (u'p:2', u'--b')])
+        self.assertEqual(self.connection.execute('SELECT process_id FROM search_summary').fetchall(), [(u'p:0',)])
+        self.assertEqual(self.indices(), ['sngl_inspiral_pid_idx'])
+        self.assertEqual(self.temp_tables(), [])
+
+
+class test_DBTableAccessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'job.sqlite')
+        make_job_database(self.filename, 0)
+        self.connection = sqlite3.connect(self.filename)
+        self.xmldoc = dbtables.get_xml(self.connection)
+
+    def tearDown(self):
+        # the DBTables keep statements open on the connection, so it is
+        # closed when they are collected
+        self.xmldoc.unlink()
+        del self.connection, self.xmldoc
+        shutil.rmtree(self.tmp_dir)
+
+    def test_row_from_cols(self):
+        '''
+        Rows built by row_from_cols are those built by dbtables.get_xml's
+        tables.
+        '''
+        tables = sqlutils.DBTableAccessor(self.connection)
+        self.assertEqual(sorted(tables.table_names), sorted(dbtables.get_table_names(self.connection)))
+        for table_name in tables.table_names:
+            expected = table.get_table(self.xmldoc, table_name)
+            got = tables.get_table(table_name)
+            self.assertEqual(got.columnnames, expected.columnnames)
+            values = self.connection.execute('SELECT * FROM %s' % table_name).fetchall()
+            self.assertTrue(values)
+            self.assertEqual([row_values(got, tables.row_from_cols(table_name)(row)) for row in values],
+                [row_values(expected, expected.row_from_cols(row)) for row in values])
+        self.assertFalse('sngl_inspiral' in tables)
+        self.assertRaises(ValueError, tables.get_table, 'sngl_inspiral')
+
+    def test_get_xml(self):
+        '''
+        get_xml returns the tables asked for that are in the database, with
+        the rows dbtables.get_xml gives them.
+        '''
+        tables = sqlutils.DBTableAccessor(self.connection)
+        xmldoc = tables.get_xml(['experiment', 'coinc_inspiral', 'sngl_inspiral'])
+        self.assertEqual([tbl.tableName for tbl in xmldoc.childNodes], ['experiment', 'coinc_inspiral'])
+        for tbl in xmldoc.childNodes:
+            expected = table.get_table(self.xmldoc, tbl.tableName)
+            self.assertEqual([row_values(tbl, row) for row in tbl], [row_values(expected, row) for row in expected])
+        xmldoc.unlink()
+
+
+class test_tracing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'test.sqlite')
+
+    def tearDown(self):
+        sqlutils.close_connection(self.filename)
+        shutil.rmtree(self.tmp_dir)
+
+    def get_connection(self, trace, explain = False):
+        connection = sqlutils.get_connection(self.filename, trace = trace, explain = explain)
+        connection.execute('CREATE TABLE IF NOT EXISTS t (x INTEGER)')
+        connection.commit()
+        return connection
+
+    def test_rollback(self):
+        '''
+        Tracing, with or without query plans, must not commit the open
+        transaction.
+        '''
+        for trace, explain in ((False, False), (True, False), (True, True)):
+            connection = self.get_connection(trace, explain)
+            connection.execute('INSERT INTO t VALUES (1)')
+            connection.execute('SELECT * FROM t WHERE x == 1').fetchall()
+            connection.execute('INSERT INTO t VALUES (2)')
+            connection.rollback()
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+            sqlutils.close_connection(self.filename)
+
+    def test_plans(self):
+        '''
+        The plans of statements on temporary tables are found after the
+        transaction ends.
+        '''
+        connection = self.get_connection(True, True)
+        connection.execute('CREATE TEMP TABLE tmp (y INTEGER)')
+        connection.execute('INSERT INTO t VALUES (1)')
+        connection.execute('SELECT * FROM t WHERE x == 1').fetchall()
+        connection.execute('INSERT INTO tmp SELECT x FROM t')
+        connection.commit()
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM tmp').fetchone()[0], 1)
+        records = dict((record['statement'], record) for record in connection.profile.records)
+        self.assertTrue(records['SELECT * FROM t WHERE x == 1']['plan'])
+        self.assertTrue(records['INSERT INTO tmp SELECT x FROM t']['plan'])
+
+
+class test_bkg_stats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def update_fars(self, filename):
+        connection = sqlite3.connect(filename)
+        new_summaries(connection).update_fars_incrementally(connection, far_query, 'coinc_inspiral', 'false_alarm_rate', 'combined_far', rank_by = 'MAX', ifo_group = 'ALL_IFOS')
+        connection.commit()
+        fars = dict((row[0], (row[6], row[7])) for row in connection.execute(far_query))
+        connection.close()
+        return fars
+
+    def test_duplicate_rows(self):
+        '''
+        Loading a background with two rows for a slide would count it twice.
+        '''
+        filename = os.path.join(self.tmp_dir, 'job.sqlite')
+        make_job_database(filename, 0)
+        self.update_fars(filename)
+        connection = sqlite3.connect(filename)
+        self.assertTrue(sqlutils.Summaries().load_bkg_stats(connection))
+        connection.execute('INSERT INTO %s SELECT * FROM %s LIMIT 1' % ((sqlutils.Summaries.bkg_stats_table,) * 2))
+        self.assertRaises(ValueError, sqlutils.Summaries().load_bkg_stats, connection)
+        connection.close()
+
+    def test_merge(self):
+        '''
+        Save the background of several jobs, merge them, then update the
+        fars of the merged database; they must be those calculated from
+        scratch.
+        '''
+        filenames = [os.path.join(self.tmp_dir, 'job%d.sqlite' % n) for n in range(3)]
+        for n, filename in enumerate(filenames):
+            make_job_database(filename, n)
+            self.update_fars(filename)
+        merged = os.path.join(self.tmp_dir, 'merged.sqlite')
+        sqlutils.merge_databases(merged, filenames)
+        connection = sqlite3.connect(merged)
+        self.assertFalse(sqlutils.Summaries().load_bkg_stats(connection))
+        connection.close()
+        scratch = os.path.join(self.tmp_dir, 'scratch.sqlite')
+        shutil.copy(merged, scratch)
+        connection = sqlite3.connect(scratch)
+        expected = calc_fars_from_scratch(connection)
+        connection.close()
+        self.assertEqual(len(expected), 3 * 40)
+        self.assertEqual(self.update_fars(merged), expected)
+
+
+class test_simplify_database(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filenames = [os.path.join(self.tmp_dir, 'job%d.sqlite' % job) for job in range(6)]
+        for job, filename in enumerate(self.filenames):
+            make_merge_job(filename, job)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def merge(self):
+        '''
+        Returns connections to two copies of the merged, but not simplified,
+        jobs. The IDs given to the rows depend on what was merged before in
+        the process, so the same merge is used for both.
+        '''
+        filename = os.path.join(self.tmp_dir, 'merged.sqlite')
+        sqlutils.merge_databases(filename, self.filenames, simplify = False)
+        shutil.copy(filename, filename + '.copy')
+        return sqlite3.connect(filename), sqlite3.connect(filename + '.copy')
+
+    def test_simplify(self):
+        '''
+        simplify_database removes the same duplicates from merged jobs as
+        the simplify_* functions do.
+        '''
+        old, new = self.merge()
+        sqlutils.get_process_info(old)
+        sqlutils.simplify_expr_tbl(old)
+        sqlutils.simplify_timeslide_tbl(old)
+        sqlutils.simplify_coincdef_tbl(old)
+        sqlutils.simplify_summ_tbls(old)
+        sqlutils.simplify_sim_tbls(old)
+        sqlutils.simplify_exprsumm_tbl(old)
+        sqlutils.update_pid_in_snglstbls(old)
+        sqlutils.simplify_proc_tbls(old)
+        sqlutils.simplify_segments_tbls(old)
+        sqlutils.simplify_vetodef_tbl(old)
+        old.commit()
+        expected = dump_database(old)
+        old.close()
+
+        discarded = sqlutils.simplify_database(new)
+        self.assertEqual(dump_database(new), expected)
+        self.assertEqual(discarded['experiment_id'], 5)
+        self.assertEqual(len(expected['experiment']), 1)
+        self.assertEqual(len(expected['experiment_summary']), 4)
+        self.assertEqual(sum(row[1] for row in expected['experiment_summary']), 2 * sum(10 + job for job in range(6)))
+        # a simplified database has no duplicates left
+        self.assertFalse(any(sqlutils.simplify_database(new).values()))
+        new.close()
+
+
+class test_merge_dbs(unittest.TestCase):
+
+    program = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'bin', 'ligolw_cbc_merge_dbs')
+
+    # the tables that the ids in each column refer to
+    references = dict([ (column_name, sqlutils.simplify_id_tables[id_type])
+        for column_name, id_type in sqlutils.simplify_id_columns.items() ] +
+        [ ('coinc_event_id', 'coinc_event'), ('segment_def_id', 'segment_definer') ])
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filenames = [os.path.join(self.tmp_dir, 'job%d.sqlite' % job) for job in range(6)]
+        for job, filename in enumerate(self.filenames):
+            make_merge_job(filename, job)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def merge(self, name, *args):
+        filename = os.path.join(self.tmp_dir, name)
+        self.assertEqual(subprocess.call([sys.executable, self.program, '--output', filename, '--tmp-space', self.tmp_dir] + list(args) + self.filenames), 0)
+        return sqlite3.connect(filename)
+
+    def check_references(self, connection):
+        for table_name in dbtables.get_table_names(connection):
+            for column_name in sqlutils.get_column_names_from_table(connection, table_name):
+                owner = self.references.get(column_name)
+                if owner is None or owner == table_name:
+                    continue
+                owner_column = column_name == 'sim_proc_id' and 'process_id' or column_name
+                dangling = connection.execute('SELECT COUNT(*) FROM %s WHERE %s IS NOT NULL AND %s NOT IN (SELECT %s FROM %s)' % (table_name, column_name, column_name, owner_column, owner)).fetchone()[0]
+                self.assertEqual(dangling, 0, '%s.%s has %d dangling references' % (table_name, column_name, dangling))
+
+    def dump(self, connection):
+        """
+        Returns the contents of the database without the ids, which depend
+        on the order in which the files were merged, and without the rows
+        of the merging process itself.
+        """
+        contents = {}
+        for table_name in dbtables.get_table_names(connection):
+            column_names = [column_name for column_name in sqlutils.get_column_names_from_table(connection, table_name) if not column_name.endswith('_id')]
+            # tables of ids alone, e.g. experiment_map, are compared by size
+            sqlquery = 'SELECT %s FROM %s' % (', '.join(column_names) or 'COUNT(*)', table_name)
+            if table_name in ('process', 'process_params'):
+                sqlquery += " WHERE program != 'ligolw_cbc_merge_dbs'"
+            contents[table_name] = sorted(connection.execute(sqlquery).fetchall())
+        # and the references between the tables, followed from the coincs
+        contents['coincs'] = sorted(connection.execute("""
+            SELECT experiment_summary.datatype, time_slide.instrument,
+                time_slide.offset, process.program, COUNT(*)
+            FROM coinc_event
+                JOIN experiment_map ON (
+                    experiment_map.coinc_event_id == coinc_event.coinc_event_id)
+                JOIN experiment_summary ON (
+                    experiment_summary.experiment_summ_id == experiment_map.experiment_summ_id)
+                JOIN time_slide ON (
+                    time_slide.time_slide_id == experiment_summary.time_slide_id
+                    AND time_slide.time_slide_id == coinc_event.time_slide_id)
+                JOIN process ON (
+                    process.process_id == coinc_event.process_id)
+            GROUP BY experiment_summary.datatype, time_slide.instrument,
+                time_slide.offset, process.program""").fetchall())
+        return contents
+
+    def test_serial_parallel(self):
+        '''
+        Merging the jobs in one process, and in shards that are combined
+        pairwise in several, give the same tables, with the durations
+        summed and no dangling references.
+        '''
+        serial = self.merge('serial.sqlite', '--nproc', '1')
+        parallel = self.merge('parallel.sqlite', '--nproc', '3', '--group-size', '1')
+        for connection in (serial, parallel):
+            self.check_references(connection)
+            self.assertEqual(sorted(connection.execute('SELECT datatype, duration, nevents FROM experiment_summary').fetchall()),
+                [(u'all_data', 36, 6)] * 2 + [(u'simulation', 39, 6)] * 2)
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM process WHERE program == 'ligolw_cbc_merge_dbs'").fetchone()[0], 1)
+        contents = self.dump(serial)
+        self.assertEqual(sum(row[-1] for row in contents['coincs']), 2 * 24)
+        self.assertEqual(self.dump(parallel), contents)
+        serial.close()
+        parallel.close()
+
+
+class test_rank_stats(unittest.TestCase):
+
+    def setUp(self):
+        # ties, and NULL stats, both among those ranked and among those
+        # the ranks are taken from
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('CREATE TABLE coincs (coinc_event_id INTEGER PRIMARY KEY, stat REAL, background INTEGER)')
+        rng = random.Random(7)
+        stats = [rng.choice([None, 1.0, 2.0, 2.5, 3.0, 4.0, 5.0]) for ii in range(60)]
+        self.connection.executemany('INSERT INTO coincs (stat, background) VALUES (?, ?)',
+            [(stat, ii % 3 != 0) for ii, stat in enumerate(stats)])
+
+    def tearDown(self):
+        self.connection.close()
+
+    def check(self, rank_by, limit):
+        ranker = sqlutils.rank_stats('coincs', 'stat', rank_by)
+        ranker.populate_stats_list(self.connection, limit, filter = 'WHERE background')
+        self.connection.create_function('rank', 1, ranker.get_rank)
+        expected = self.connection.execute('SELECT coinc_event_id, rank(stat) FROM coincs ORDER BY coinc_event_id').fetchall()
+
+        self.assertEqual(ranker.write_ranks(self.connection, 'rank', temp_table = 'ranks'), 60)
+        self.assertEqual(self.connection.execute('SELECT coinc_event_id, rank FROM ranks ORDER BY coinc_event_id').fetchall(), expected)
+        self.connection.execute('DROP TABLE ranks')
+
+        self.assertEqual(ranker.write_ranks(self.connection, 'rank'), 60)
+        self.assertEqual(self.connection.execute('SELECT coinc_event_id, rank FROM coincs ORDER BY coinc_event_id').fetchall(), expected)
+
+    def test_asc(self):
+        '''
+        write_ranks gives the same ranks as get_rank, ranking ascending.
+        '''
+        self.check('ASC', None)
+
+    def test_desc(self):
+        '''
+        write_ranks gives the same ranks as get_rank, ranking descending.
+        '''
+        self.check('DESC', None)
+
+    def test_limit(self):
+        '''
+        write_ranks gives the same ranks as get_rank when only the top
+        stats are ranked against.
+        '''
+        self.check('ASC', 10)
+        self.check('DESC', 10)
+
+    def test_filter(self):
+        '''
+        Only the rows selected by the filter are ranked, and with
+        temp_table the ranked table is left unchanged.
+        '''
+        ranker = sqlutils.rank_stats('coincs', 'stat', 'DESC')
+        ranker.populate_stats_list(self.connection)
+        self.assertEqual(ranker.write_ranks(self.connection, 'rank', filter = 'WHERE 0', temp_table = 'ranks'), 0)
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM ranks').fetchone()[0], 0)
+        nranked = ranker.write_ranks(self.connection, 'rank', filter = 'WHERE NOT background', temp_table = 'more_ranks')
+        self.assertEqual(nranked, 20)
+        self.assertEqual(self.connection.execute('SELECT COUNT(*) FROM more_ranks JOIN coincs USING (coinc_event_id) WHERE background').fetchone()[0], 0)
+        self.assertEqual(sqlutils.get_column_names_from_table(self.connection, 'coincs'), ['coinc_event_id', 'stat', 'background'])
+
+
+class test_sweep_cluster(unittest.TestCase):
+
+    # the query ligolw_cbc_cluster_coincs clustered with before
+    # sweep_cluster
+    old_query = """
+        DELETE
+        FROM
+            experiment_map
+        WHERE (cast(coinc_event_id AS char) || "," || cast(experiment_summ_id AS char)) IN (
+            SELECT
+                (cast(ceid AS char) || "," || cast(esid AS char))
+            FROM clustered AS deltrigs
+            WHERE EXISTS (
+                SELECT *
+                FROM
+                    clustered AS reftrigs
+                WHERE
+                    reftrigs.esid == deltrigs.esid
+                    AND reftrigs.ifos == deltrigs.ifos
+                    AND reftrigs.param_grouping == deltrigs.param_grouping
+                    AND reftrigs.ranking_stat %(rank_by)s deltrigs.ranking_stat
+                    AND reftrigs.gps_time > ( deltrigs.gps_time - %(window)r )
+                    AND reftrigs.gps_time <= ( deltrigs.gps_time + %(window)r )
+                LIMIT 1)
+            )"""
+
+    def setUp(self):
+        # integer times and stats, so there are triggers on the edges of
+        # the windows and ties, and some NULLs
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('CREATE TABLE experiment_map (experiment_summ_id, coinc_event_id)')
+        self.connection.execute('CREATE TABLE clustered (esid, ceid, ifos, gps_time, param_grouping, ranking_stat)')
+        rng = random.Random(11)
+        for ceid in range(300):
+            for esid in rng.sample(range(3), rng.choice([1, 2])):
+                self.connection.execute('INSERT INTO experiment_map VALUES (?, ?)', (esid, ceid))
+                self.connection.execute('INSERT INTO clustered VALUES (?, ?, ?, ?, ?, ?)', (esid, ceid,
+                    rng.choice([u'H1,L1', u'H1,V1', None] + [u'H1,L1'] * 4),
+                    rng.choice([None] + [rng.randint(0, 400)] * 20),
+                    rng.choice([0, 1]),
+                    rng.choice([None] + [rng.randint(0, 10)] * 20)))
+        self.connection.commit()
+
+    def tearDown(self):
+        self.connection.close()
+
+    def check(self, window, rank_by):
+        rows = self.connection.execute('SELECT esid, ifos, param_grouping, gps_time, ranking_stat, ceid FROM clustered ORDER BY esid, ifos, param_grouping, gps_time')
+        losers = sqlutils.sweep_cluster(rows, window, rank_by)
+        self.assertEqual(len(losers), len(set(losers)))
+        everything = set(self.connection.execute('SELECT coinc_event_id, experiment_summ_id FROM experiment_map'))
+        self.connection.execute(self.old_query % {'window': window, 'rank_by': rank_by})
+        survivors = set(self.connection.execute('SELECT coinc_event_id, experiment_summ_id FROM experiment_map'))
+        self.connection.rollback()
+        self.assertTrue(survivors)
+        self.assertEqual(everything - set(losers), survivors)
+
+    def test_max(self):
+        '''
+        sweep_cluster removes the same triggers as the old query when
+        clustering on the largest stat.
+        '''
+        for window in (1, 4, 15, 1000):
+            self.check(window, '>')
+
+    def test_min(self):
+        '''
+        sweep_cluster removes the same triggers as the old query when
+        clustering on the smallest stat.
+        '''
+        for window in (0.5, 4, 15, 1000):
+            self.check(window, '<')
+
+    def test_window(self):
+        '''
+        A window that is not positive is an error.
+        '''
+        rows = [(0, u'H1,L1', 0, 10, 1., 0), (0, u'H1,L1', 0, 10, 2., 1)]
+        self.assertRaises(ValueError, sqlutils.sweep_cluster, rows, 0, '>')
+        self.assertRaises(ValueError, sqlutils.sweep_cluster, rows, -1., '>')
+        self.assertEqual(sqlutils.sweep_cluster(rows, 1., '>'), [(0, 0)])
+
+
+class test_segdict_from_segment(unittest.TestCase):
+
+    # [start, end) segments of the segment table, by segment_definer ifos
+    segs = {
+        u'H1': [(10, 20), (20, 30), (40, 50), (45, 47)],
+        u'L1': [(15, 25)],
+        u'H1,L1': [(100, 110)],
+        }
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute('CREATE TABLE segment_definer (segment_def_id, ifos)')
+        self.connection.execute('CREATE TABLE segment (segment_def_id, start_time, end_time)')
+        for segment_def_id, (ifos, segs) in enumerate(sorted(self.segs.items())):
+            self.connection.execute('INSERT INTO segment_definer VALUES (?, ?)', (segment_def_id, ifos))
+            self.connection.executemany('INSERT INTO segment VALUES (?, ?, ?)', [(segment_def_id, start, end) for start, end in segs])
+        self.segdict = sqlutils.segdict_from_segment(self.connection)
+
+        # the same segments as glue segmentlists
+        self.seglists = {}
+        for ifos, segs in self.segs.items():
+            for ifo in lsctables.instrument_set_from_ifos(ifos):
+                self.seglists.setdefault(ifo, segments.segmentlist()).extend(segments.segment(start, end) for start, end in segs)
+        for seglist in self.seglists.values():
+            seglist.coalesce()
+
+        # every boundary, and the nanoseconds either side of it
+        times = []
+        for segs in self.segs.values():
+            for seg in segs:
+                for t in seg:
+                    times += [(t - 1, 999999999), (t, 0), (t, 1)]
+        times += [(0, 0), (35, 500000000), (200, 0)]
+        self.gpstimes, self.gpstimes_ns = [numpy.array(column) for column in zip(*sorted(times))]
+
+    def tearDown(self):
+        self.connection.close()
+
+    def expected(self, ifo):
+        return [t + 1e-9 * ns in self.seglists[ifo] for t, ns in zip(self.gpstimes, self.gpstimes_ns)]
+
+    def test_is_in_sngl_segdict(self):
+        '''
+        is_in_sngl_segdict agrees with glue segmentlist membership, with
+        adjacent segments merged.
+        '''
+        self.assertEqual(self.segdict.snglinst_segdict['H1'], segments.segmentlist([segments.segment(10, 30), segments.segment(40, 50), segments.segment(100, 110)]))
+        for ifo in ('H1', 'L1'):
+            self.assertEqual([self.segdict.is_in_sngl_segdict(ifo, t, ns) for t, ns in zip(self.gpstimes, self.gpstimes_ns)], self.expected(ifo))
+        self.assertTrue(self.segdict.is_in_sngl_segdict('H1', 20, 0))
+        self.assertTrue(self.segdict.is_in_sngl_segdict('H1', 10, 0))
+        self.assertFalse(self.segdict.is_in_sngl_segdict('H1', 30, 0))
+
+    def test_are_in_sngl_segdict(self):
+        '''
+        are_in_sngl_segdict agrees with glue segmentlist membership for
+        one instrument and for an array of instruments.
+        '''
+        for ifo in ('H1', 'L1'):
+            result = self.segdict.are_in_sngl_segdict(ifo, self.gpstimes, self.gpstimes_ns)
+            self.assertEqual(result.dtype, bool)
+            self.assertEqual(list(result), self.expected(ifo))
+        instruments = numpy.array(['H1', 'L1'] * len(self.gpstimes))[:len(self.gpstimes)]
+        expected = [h1 if ifo == 'H1' else l1 for ifo, h1, l1 in zip(instruments, self.expected('H1'), self.expected('L1'))]
+        self.assertEqual(list(self.segdict.are_in_sngl_segdict(instruments, self.gpstimes, self.gpstimes_ns)), expected)
+
+
+# construct and run the test suite.
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(test_get_connection))
+suite.addTest(unittest.makeSuite(test_DeletionPlanner))
+suite.addTest(unittest.makeSuite(test_DBTableAccessor))
+suite.addTest(unittest.makeSuite(test_tracing))
+suite.addTest(unittest.makeSuite(test_bkg_stats))
+suite.addTest(unittest.makeSuite(test_simplify_database))
+suite.addTest(unittest.makeSuite(test_merge_dbs))
+suite.addTest(unittest.makeSuite(test_rank_stats))
+suite.addTest(unittest.makeSuite(test_sweep_cluster))
+suite.addTest(unittest.makeSuite(test_segdict_from_segment))
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Unit test suite for pylal.ligolw_thinca.
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from glue import segments
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw import utils as ligolw_utils
+from pylal import ligolw_thinca
+from pylal.xlal.date import LIGOTimeGPS
+
+
+class ContentHandler(ligolw.LIGOLWContentHandler):
+	pass
+lsctables.use_in(ContentHandler)
+
+
+def new_coinc_document():
+	"""
+	Construct a document holding the triggers of an H1 job and an L1
+	job, and three H1,L1 coincs among them found by a thinca job, one
+	of them in a time slide.
+	"""
+	for cls in (lsctables.ProcessTable, lsctables.SnglInspiralTable, lsctables.TimeSlideTable, lsctables.CoincDefTable, lsctables.CoincTable):
+		cls.reset_next_id()
+	xmldoc = ligolw.Document()
+	xmldoc.appendChild(ligolw.LIGO_LW())
+	process_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.ProcessTable, ["process_id", "program", "ifos"]))
+	process_params_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.ProcessParamsTable, ["process_id", "program", "param", "type", "value"]))
+	search_summary_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SearchSummaryTable, ["process_id", "ifos", "out_start_time", "out_start_time_ns", "out_end_time", "out_end_time_ns"]))
+	sngl_inspiral_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SnglInspiralTable, ["process_id", "event_id", "ifo", "end_time", "end_time_ns", "snr", "chisq", "chisq_dof"]))
+	coinc_def_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincDefTable))
+	coinc_event_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincTable, ["process_id", "coinc_def_id", "coinc_event_id", "time_slide_id", "instruments", "nevents", "likelihood"]))
+	coinc_inspiral_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincInspiralTable, ["coinc_event_id", "ifos", "end_time", "end_time_ns", "snr"]))
+	coinc_event_map_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincMapTable))
+	time_slide_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.TimeSlideTable))
+
+	def new_process(program, ifos):
+		process = process_table.RowType()
+		process.process_id = process_table.get_next_id()
+		process.program = program
+		process.ifos = ifos
+		process_table.append(process)
+		return process
+
+	events = {}
+	for instrument in ("H1", "L1"):
+		process = new_process(u"inspiral", instrument)
+		params = process_params_table.RowType()
+		params.process_id = process.process_id
+		params.program = process.program
+		params.param, params.type, params.value = u"--ifo", u"lstring", instrument
+		process_params_table.append(params)
+		row = search_summary_table.RowType()
+		row.process_id = process.process_id
+		row.set_ifos([instrument])
+		row.set_out(segments.segment(LIGOTimeGPS(0), LIGOTimeGPS(1000)))
+		search_summary_table.append(row)
+		for t in (100, 200, 300, 400):
+			event = sngl_inspiral_table.RowType()
+			event.process_id = process.process_id
+			event.event_id = sngl_inspiral_table.get_next_id()
+			event.ifo = instrument
+			event.set_end(LIGOTimeGPS(t))
+			event.snr, event.chisq, event.chisq_dof = 8.0 + t / 100., 10.0, 16
+			sngl_inspiral_table.append(event)
+			events[instrument, t] = event
+
+	thinca_process = new_process(u"ligolw_thinca", u"H1,L1")
+	time_slide_ids = [time_slide_table.append_offsetvector(offsetvector, thinca_process) for offsetvector in ({"H1": 0.0, "L1": 0.0}, {"H1": 0.0, "L1": 100.0})]
+	coinc_def = coinc_def_table.RowType()
+	coinc_def.coinc_def_id = coinc_def_table.get_next_id()
+	coinc_def.search = ligolw_thinca.InspiralCoincDef.search
+	coinc_def.search_coinc_type = ligolw_thinca.InspiralCoincDef.search_coinc_type
+	coinc_def.description = ligolw_thinca.InspiralCoincDef.description
+	coinc_def_table.append(coinc_def)
+
+	for (h1, l1), time_slide_id in (((100, 100), time_slide_ids[0]), ((300, 300), time_slide_ids[0]), ((200, 100), time_slide_ids[1])):
+		coinc_events = [events["H1", h1], events["L1", l1]]
+		coinc = coinc_event_table.RowType()
+		coinc.process_id = thinca_process.process_id
+		coinc.coinc_def_id = coinc_def.coinc_def_id
+		coinc.coinc_event_id = coinc_event_table.get_next_id()
+		coinc.time_slide_id = time_slide_id
+		coinc.set_instruments(event.ifo for event in coinc_events)
+		coinc.nevents = len(coinc_events)
+		coinc.likelihood = None
+		coinc_event_table.append(coinc)
+		for event in coinc_events:
+			coinc_map = coinc_event_map_table.RowType()
+			coinc_map.coinc_event_id = coinc.coinc_event_id
+			coinc_map.table_name = event.event_id.table_name
+			coinc_map.event_id = event.event_id
+			coinc_event_map_table.append(coinc_map)
+		coinc_inspiral = coinc_inspiral_table.RowType()
+		coinc_inspiral.coinc_event_id = coinc.coinc_event_id
+		coinc_inspiral.set_ifos(event.ifo for event in coinc_events)
+		coinc_inspiral.end_time, coinc_inspiral.end_time_ns = coinc_events[0].end_time, coinc_events[0].end_time_ns
+		coinc_inspiral.snr = sum(event.snr**2. for event in coinc_events)**.5
+		coinc_inspiral_table.append(coinc_inspiral)
+	return xmldoc
+
+
+def table_rows(xmldoc, cls):
+	"""
+	Return the rows of the table of class cls in xmldoc as a sorted
+	list of tuples of column values, for comparing documents.
+	"""
+	table = cls.get_table(xmldoc)
+	return sorted(tuple(getattr(row, column) for column in table.columnnames) for row in table)
+
+
+class test_sngl_inspiral_coincs(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.xmldoc = new_coinc_document()
+		self.coincs = ligolw_thinca.sngl_inspiral_coincs(self.xmldoc)
+
+	def tearDown(self):
+		self.xmldoc.unlink()
+		shutil.rmtree(self.tmp_dir)
+
+	def write_documents(self, nproc):
+		"""
+		Write all the coincs with nproc worker processes, and check
+		that each file holds the same coinc as the corresponding
+		document returned by the coincs object.
+		"""
+		directory = os.path.join(self.tmp_dir, "nproc%d" % nproc)
+		os.mkdir(directory)
+		coinc_event_ids = sorted(self.coincs.keys())
+		filename_func = lambda coinc_event_id: os.path.join(directory, "%d.xml.gz" % int(coinc_event_id))
+		filenames = self.coincs.write_documents(coinc_event_ids, filename_func, nproc = nproc)
+		self.assertEqual(filenames, map(filename_func, coinc_event_ids))
+		self.assertEqual(ligolw_thinca._bulk_export_state, None)
+		contents = {}
+		for coinc_event_id, filename in zip(coinc_event_ids, filenames):
+			expected = self.coincs[coinc_event_id]
+			written = ligolw_utils.load_filename(filename, contenthandler = ContentHandler)
+			for cls in (lsctables.CoincTable, lsctables.SnglInspiralTable, lsctables.ProcessTable):
+				self.assertEqual(table_rows(written, cls), table_rows(expected, cls))
+			self.assertEqual([row.coinc_event_id for row in lsctables.CoincTable.get_table(written)], [coinc_event_id])
+			contents[coinc_event_id] = dict((cls.tableName, table_rows(written, cls)) for cls in (lsctables.CoincTable, lsctables.SnglInspiralTable, lsctables.ProcessTable, lsctables.TimeSlideTable))
+			expected.unlink()
+			written.unlink()
+		return contents
+
+	def test_write_documents(self):
+		"""Writing the coincs in one process and in a pool of
+		worker processes gives the same documents."""
+		self.assertEqual(len(self.coincs.keys()), 3)
+		serial = self.write_documents(1)
+		pooled = self.write_documents(2)
+		self.assertEqual(serial, pooled)
+		for tables in serial.values():
+			# both triggers, and the processes of the thinca job
+			# and of the two inspiral jobs
+			self.assertEqual(len(tables[lsctables.SnglInspiralTable.tableName]), 2)
+			self.assertEqual(len(tables[lsctables.ProcessTable.tableName]), 3)
+
+
+if __name__ == '__main__':
+	suite = unittest.main()
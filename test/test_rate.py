@@ -1,7 +1,44 @@
 #!/usr/bin/env python
 
 import doctest
+import unittest
+import numpy
 from pylal import rate
 
+
+class test_memoized_windows(unittest.TestCase):
+	def setUp(self):
+		# room for the two small windows, but not for the large one
+		self.windows = rate._windows
+		rate._windows = rate._LRUCache(1000)
+
+	def tearDown(self):
+		rate._windows = self.windows
+
+	def test_oversized(self):
+		"""A window too large for the cache is returned, and the
+		windows cached before it are kept."""
+		small = rate.tophat_window(4)
+		gaussian = rate.gaussian_window(1.5, sigma = 3)
+		keys = sorted(rate._windows.entries)
+		self.assertEqual(len(keys), 2)
+		large = rate.tophat_window(201)
+		self.assertEqual(len(large), 201)
+		self.assertEqual(sorted(rate._windows.entries), keys)
+		# the cached windows are returned for the same arguments
+		small[:] = 0.
+		self.assertTrue((rate.tophat_window(4) == 0.2).all())
+		self.assertTrue((rate.gaussian_window(1.5, sigma = 3) == gaussian).all())
+
+	def test_eviction(self):
+		"""The least recently used windows are evicted first."""
+		rate.tophat_window(4)
+		rate.tophat_window(20)
+		rate.tophat_window(4)
+		rate.tophat_window(100)
+		self.assertEqual([key[1] for key in rate._windows.entries], [(4,), (100,)])
+
+
 if __name__ == '__main__':
 	doctest.testmod(rate)
+	unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Unit test suite for pylal.streamthinca.
+"""
+
+
+import unittest
+
+
+from glue import segments
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from pylal import ligolw_thinca
+from pylal import streamthinca
+from pylal.xlal.date import LIGOTimeGPS
+
+
+def new_process():
+	process = lsctables.Process()
+	process.process_id = lsctables.ProcessTable.get_next_id()
+	process.program = u"test_streamthinca"
+	process.ifos = None
+	return process
+
+
+def new_time_slide_table(process):
+	time_slide_table = lsctables.New(lsctables.TimeSlideTable)
+	time_slide_table.append_offsetvector({"H1": 0.0, "L1": 0.0}, process)
+	return time_slide_table
+
+
+def new_document(instrument, out_segment, end_times, search_summary = True, end_time = True):
+	"""
+	Construct a trigger document from one instrument, as written by a
+	job that analyzed out_segment and found triggers at end_times.
+	"""
+	xmldoc = ligolw.Document()
+	xmldoc.appendChild(ligolw.LIGO_LW())
+	process = new_process()
+	process.ifos = instrument
+	xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.ProcessTable, ["process_id", "program", "ifos"])).append(process)
+
+	if search_summary:
+		search_summary_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SearchSummaryTable, ["process_id", "ifos", "out_start_time", "out_start_time_ns", "out_end_time", "out_end_time_ns"]))
+		row = lsctables.SearchSummary()
+		row.process_id = process.process_id
+		row.set_ifos([instrument])
+		row.set_out(segments.segment(LIGOTimeGPS(out_segment[0]), LIGOTimeGPS(out_segment[1])))
+		search_summary_table.append(row)
+
+	columns = ["process_id", "event_id", "ifo", "snr", "chisq", "chisq_dof"]
+	if end_time:
+		columns += ["end_time", "end_time_ns"]
+	sngl_inspiral_table = xmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SnglInspiralTable, columns))
+	for t in end_times:
+		event = sngl_inspiral_table.RowType()
+		event.process_id = process.process_id
+		event.event_id = sngl_inspiral_table.get_next_id()
+		event.ifo = instrument
+		event.snr, event.chisq, event.chisq_dof = 8.0, 10.0, 16
+		if end_time:
+			event.set_end(LIGOTimeGPS(t))
+		sngl_inspiral_table.append(event)
+	return xmldoc
+
+
+class test_StreamThinca(unittest.TestCase):
+	def setUp(self):
+		self.process = new_process()
+		self.stream = streamthinca.StreamThinca(self.process, new_time_slide_table(self.process), 5.0, 0.1, max_wait = 60.0)
+
+	def test_complete_until(self):
+		"""The boundary follows the out segments, not the triggers."""
+		self.stream.add_document(new_document("H1", (0, 200), [100]), arrival = 1000.0)
+		self.assertEqual(self.stream.complete_until(now = 1000.0), 200)
+		self.stream.add_document(new_document("L1", (0, 150), []), arrival = 1000.0)
+		self.assertEqual(self.stream.complete_until(now = 1000.0), 150)
+		# no triggers, but L1 has now been analyzed further
+		self.stream.add_document(new_document("L1", (150, 300), []), arrival = 1010.0)
+		self.assertEqual(self.stream.complete_until(now = 1010.0), 200)
+		# H1 has stalled
+		self.assertEqual(self.stream.complete_until(now = 1065.0), 300)
+
+	def test_no_out_segment(self):
+		"""Triggers without a search_summary row are not complete."""
+		self.stream.add_document(new_document("H1", None, [100], search_summary = False), arrival = 1000.0)
+		self.assertEqual(self.stream.complete_until(now = 1000.0), None)
+		self.assertEqual(self.stream.pull(now = 1000.0), None)
+
+	def test_malformed_document(self):
+		"""A malformed document leaves the buffer unchanged."""
+		self.stream.add_document(new_document("H1", (0, 200), [100]), arrival = 1000.0)
+		self.assertRaises(AttributeError, self.stream.add_document, new_document("L1", (0, 300), [100], end_time = False), 1000.0)
+		self.assertEqual(len(self.stream.events), 1)
+		self.assertEqual(self.stream.analyzed.keys(), ["H1"])
+		self.assertEqual(len(self.stream.pending), 1)
+
+	def test_pull(self):
+		"""pull() returns the coincs it built, and latencies are
+		recorded when the caller says the coincs are written."""
+		self.stream.add_document(new_document("H1", (0, 200), [100, 199.95]), arrival = 1000.0)
+		self.stream.add_document(new_document("L1", (0, 200), []), arrival = 1000.0)
+		xmldoc, coincs, coinc_event_ids = self.stream.pull(now = 1001.0)
+		self.assertTrue(isinstance(coincs, ligolw_thinca.sngl_inspiral_coincs))
+		self.assertEqual(coinc_event_ids, [])
+		# the trigger at 199.95 is within the window of the boundary
+		self.assertEqual(len(self.stream.events), 1)
+		self.assertEqual(self.stream.latencies, [])
+		xmldoc.unlink()
+
+		xmldoc, coincs, coinc_event_ids = self.stream.pull(flush = True)
+		xmldoc.unlink()
+		self.assertEqual(self.stream.events, [])
+		self.assertEqual(self.stream.latencies, [])
+		self.stream.record_latencies(now = 1005.0)
+		self.assertEqual(self.stream.latencies, [(1000.0, 5.0, 2)])
+		self.assertEqual(self.stream.completed, [])
+
+
+if __name__ == '__main__':
+	suite = unittest.main()